@@ -1,96 +1,61 @@
-from flask import Flask, render_template_string, request, jsonify, Response
-from flask_cors import CORS
+from flask import Blueprint, render_template_string, request, jsonify, Response
 import cv2
 import mediapipe as mp
 import numpy as np
-import csv
 import time
-import threading
+from contextlib import ExitStack
 from queue import Queue
-
-app = Flask(__name__)
-# Enable CORS for Flutter web app - allow all origins for development
-CORS(app, 
-     resources={r"/*": {"origins": "*"}},
-     supports_credentials=False,
-     methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-     allow_headers=["Content-Type", "Authorization"])  # Enable CORS for Flutter app
-
-# Global variables for jump data
-jump_count = 0
-last_jump_height = 0.0
-max_jump_height = 0.0
-is_detection_running = False
-detection_thread = None
-status_message = "Waiting to start..."
-user_height = 170.0  # Default height in cm
-user_weight = 70.0   # Default weight in kg
-
-# Global variable to store the latest frame for streaming
-latest_frame = None
-frame_lock = threading.Lock()
+from batch_analysis import analyze_upload, AnalysisError
+import autotune
+import calibration
+from camera_service import get_camera, parse_sources
+from counters import JumpCounter, JumpView
+import kinematics
+from pipeline import LatestQueue, start_stage, draw_overlay
+import pose_estimator
+import recording
+import results_store
+from streaming import MjpegBroadcaster, SSE_HEADERS
+from sessions import SessionManager, SessionError, requested_session_id, requested_event_id, event_stream
+import display
+
+# Jump routes; served alone by `python app1.py` or next to the other exercises by server.py
+bp = Blueprint("jump", __name__)
+
+# Each /start runs in its own worker process; see sessions.py
+INITIAL_STATE = dict(
+    jump_count=0,
+    last_jump_height=0.0,
+    max_jump_height=0.0,
+    status_message="Waiting to start...",
+    awaiting_calibration=False,
+    paper_detected=False,
+    **autotune.IDLE_STATUS,
+)
+DEFAULT_HEIGHT = 170.0  # Default height in cm
+DEFAULT_WEIGHT = 70.0   # Default weight in kg
+
+# Shown on /video_feed when there is no session to watch
+idle_broadcaster = MjpegBroadcaster()
 
 # MediaPipe setup
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-OUTPUT_CSV = "jump_results.csv"
 FRAME_WIDTH = 1280
 FRAME_HEIGHT = 720
-
-# Kalman filter for 1D vertical position tracking
-class KalmanFilter1D:
-    def __init__(self):
-        self.kalman = cv2.KalmanFilter(2, 1)  # State: [position, velocity], Measure: [position]
-        self.kalman.transitionMatrix = np.array([[1, 1], [0, 1]], np.float32)
-        self.kalman.measurementMatrix = np.array([[1, 0]], np.float32)
-        self.kalman.processNoiseCov = np.array([[1e-4, 0], [0, 1e-4]], np.float32)
-        self.kalman.measurementNoiseCov = np.array([[1e-2]], np.float32)
-        self.kalman.errorCovPost = np.array([[1, 0], [0, 1]], np.float32)
-        self.kalman.statePost = np.array([[0], [0]], np.float32)
-
-    def predict(self):
-        pred = self.kalman.predict()
-        return pred[0][0]
-
-    def correct(self, measurement):
-        measurement = np.array([[np.float32(measurement)]])
-        corrected = self.kalman.correct(measurement)
-        return corrected[0][0]
-
-def calculate_px_per_cm(landmarks, h, user_height_cm):
-    try:
-        head = landmarks[mp_pose.PoseLandmark.NOSE.value]
-        left_ankle = landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value]
-        right_ankle = landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value]
-        ankle_y = max(left_ankle.y, right_ankle.y) * h
-        head_y = head.y * h
-        px_height = abs(ankle_y - head_y)
-        px_per_cm = px_height / user_height_cm
-        return px_per_cm, ankle_y
-    except Exception:
-        return None, None
-
-def check_body_visible(landmarks, h, w):
-    try:
-        keypoints = [
-            mp_pose.PoseLandmark.NOSE.value,
-            mp_pose.PoseLandmark.LEFT_ANKLE.value,
-            mp_pose.PoseLandmark.RIGHT_ANKLE.value,
-            mp_pose.PoseLandmark.LEFT_WRIST.value,
-            mp_pose.PoseLandmark.RIGHT_WRIST.value,
-        ]
-        for idx in keypoints:
-            lm = landmarks[idx]
-            x, y = int(lm.x * w), int(lm.y * h)
-            if x < 0 or x > w or y < 0 or y > h:
-                return False
-        return True
-    except:
-        return False
-
-def calibrate_with_paper(frame, status_callback=None):
-    """Calibrate with A4 paper detection. Returns px_per_cm or None."""
+WINDOW_NAME = "Vertical Jump Counter"
+CALIBRATION_WINDOW = "Calibration"
+# Landmark frames of another camera waiting for the counting loop (fused mode)
+VIEW_QUEUE_SIZE = 16
+
+def detect_paper(frame):
+    """Look for an A4 paper in the guide box.
+
+    Returns (px_per_cm, vis_frame): px_per_cm is None when no paper was found and
+    vis_frame is a copy of frame with the guide box and instructions drawn on it.
+    Confirming the calibration is left to the caller (SPACE key or HTTP).
+    """
     # A4 paper dimensions in cm
     PAPER_WIDTH = 21.0
     PAPER_LENGTH = 29.7
@@ -140,7 +105,7 @@ def calibrate_with_paper(frame, status_callback=None):
     
     cv2.putText(vis_frame, "Hold paper FLAT inside the yellow box", (20, 70),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-    cv2.putText(vis_frame, "Press SPACE when paper is positioned correctly", (20, 110),
+    cv2.putText(vis_frame, "Press SPACE or Confirm in the app when it is in place", (20, 110),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
     # Expand detection area slightly beyond the box for more tolerance
@@ -224,9 +189,9 @@ def calibrate_with_paper(frame, status_callback=None):
         for point in box:
             cv2.circle(vis_frame, tuple(point), 6, (0, 255, 0), -1)
             
-        cv2.putText(vis_frame, "PAPER DETECTED! Press SPACE to confirm", (20, h - 80),
+        cv2.putText(vis_frame, "PAPER DETECTED! Press SPACE / Confirm", (20, h - 80),
                     cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
-        cv2.putText(vis_frame, "PAPER DETECTED! Press SPACE to confirm", (20, h - 80),
+        cv2.putText(vis_frame, "PAPER DETECTED! Press SPACE / Confirm", (20, h - 80),
                     cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
         
         if px_per_cm:
@@ -238,209 +203,351 @@ def calibrate_with_paper(frame, status_callback=None):
         cv2.putText(vis_frame, "Make sure paper is flat and well-lit", (20, h - 40),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
 
-    cv2.imshow("Calibration", vis_frame)
-    key = cv2.waitKey(1)
-
-    if key == ord(' ') and paper_detected:
-        cv2.putText(vis_frame, "CALIBRATION SUCCESSFUL!", (w//2 - 200, h//2),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 3)
-        cv2.putText(vis_frame, "CALIBRATION SUCCESSFUL!", (w//2 - 200, h//2),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 2)
-        cv2.imshow("Calibration", vis_frame)
-        cv2.waitKey(1500)
-        if status_callback:
-            status_callback("Calibration successful!")
-        return px_per_cm
+    if not paper_detected:
+        px_per_cm = None
+    return px_per_cm, vis_frame
+
+def run_jump_detection(ctx):
+    """Jump detection for one session. Runs inside the session's worker process.
+
+    With several cameras (fused mode) the first one is calibrated, counts and
+    is shown; every other one runs its own capture and inference stage, and
+    all of them measure each jump's height (counters.fuse_jump_height).
+    """
+    user_height = float(ctx.params.get('height', DEFAULT_HEIGHT))
+    cameras = ctx.params.get('cameras') or [ctx.params.get('camera', 0)]
+    camera = cameras[0]
+    # Phase 1 and 2 are scored by the same counter the offline batch analysis uses
+    counter = JumpCounter(user_height=user_height)
+    status_message = "Waiting to start..."
+    awaiting_calibration = False
+    paper_px_per_cm = None
+    calibration_confirmed = False
+    tuner = None
+
+    def report(message=None):
+        ctx.update(
+            jump_count=counter.jump_count,
+            last_jump_height=counter.last_jump_height,
+            max_jump_height=counter.max_jump_height,
+            status_message=status_message if message is None else message,
+            awaiting_calibration=awaiting_calibration,
+            paper_detected=paper_px_per_cm is not None,
+            **(tuner.status() if tuner else {}),
+        )
+
+    def handle_commands():
+        nonlocal calibration_confirmed
+        for command, payload in ctx.poll_commands():
+            if command == "reset":
+                counter.reset_counts()
+            elif command == "increment":
+                counter.record_jump(payload)
+            elif command == "confirm_calibration":
+                calibration_confirmed = True
+
+    def calibrate_with_paper():
+        """PHASE 0: A4 paper calibration. Returns px_per_cm, or None if the session ended first."""
+        nonlocal status_message, awaiting_calibration, paper_px_per_cm, calibration_confirmed
+        px_per_cm = None
+        calibration_confirmed = False
+        awaiting_calibration = True
+        status_message = "Phase 0: A4 Paper Calibration - Place paper on ground"
+        report()
+
+        while ctx.running:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            handle_commands()
+
+            detected_px_per_cm, vis_frame = detect_paper(frame)
+            paper_px_per_cm = detected_px_per_cm
+            ctx.publish_frame(vis_frame)
+            key = display.show(CALIBRATION_WINDOW, vis_frame)
+
+            if detected_px_per_cm and (key == ord(' ') or calibration_confirmed):
+                px_per_cm = detected_px_per_cm
+                status_message = "A4 Calibration complete! Proceed to body calibration."
+                if not display.HEADLESS:
+                    h, w = vis_frame.shape[:2]
+                    cv2.putText(vis_frame, "CALIBRATION SUCCESSFUL!", (w//2 - 200, h//2),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 3)
+                    cv2.putText(vis_frame, "CALIBRATION SUCCESSFUL!", (w//2 - 200, h//2),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 2)
+                    display.show(CALIBRATION_WINDOW, vis_frame, delay=1500)
+                    display.close_window(CALIBRATION_WINDOW)
+                break
+            report()
 
-    return None
+        awaiting_calibration = False
+        paper_px_per_cm = None
+        return px_per_cm
 
-def run_jump_detection():
-    global jump_count, last_jump_height, max_jump_height, is_detection_running, status_message, user_height, user_weight, latest_frame, frame_lock
-    
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    cap = get_camera(camera, FRAME_WIDTH, FRAME_HEIGHT).subscribe()
+    if cap is None:
         status_message = "ERROR: Camera could not be opened."
-        is_detection_running = False
+        report()
         return
 
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-    WINDOW_NAME = "Vertical Jump Counter"
-    cv2.namedWindow(WINDOW_NAME)
-
-    csvfile = open(OUTPUT_CSV, "w", newline="")
-    csvw = csv.writer(csvfile)
-    csvw.writerow(["timestamp", "jump_height_cm"])
-
-    standing_reach_y = None
-    px_per_cm = None
-    jump_height_cm = 0.0
-    setup_done = False
-    clap_frames = 0
-    CLAP_FRAMES_REQUIRED = 5
-    CLAP_DISTANCE_THRESHOLD = 60  # pixels
-
-    in_air = False
-    last_jump_time = 0
-    jump_cooldown = 1.0  # seconds
-
-    cheat_detection_enabled = True
-    cheat_flag = False
-    kalman_filter = KalmanFilter1D()
-    KALMAN_CHEAT_THRESHOLD_PX = 40  # pixel difference threshold
-
-    # ===== PHASE 0: A4 PAPER CALIBRATION =====
-    calibration_done = False
-    status_message = "Phase 0: A4 Paper Calibration - Place paper on ground"
-    
-    while not calibration_done and is_detection_running:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        px_per_cm = calibrate_with_paper(frame, lambda msg: None)
-        
-        if px_per_cm:
-            calibration_done = True
-            status_message = "A4 Calibration complete! Proceed to body calibration."
-            cv2.waitKey(1000)
-            cv2.destroyWindow("Calibration")
-            break
-    
-    if not calibration_done or not px_per_cm:
-        status_message = "Calibration failed. Exiting."
-        is_detection_running = False
-        cap.release()
-        csvfile.close()
-        cv2.destroyAllWindows()
-        return
-
-    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-        while is_detection_running:
-            ret, frame = cap.read()
-            if not ret:
+    # Fused mode: (FrameSubscriber, PoseEstimator, JumpView) of every other camera
+    extras = []
+    # Holds every camera's pose_estimator.checkout() until the session ends
+    estimators = ExitStack()
+    store = None
+    recorder = None
+    try:
+        # Model and capture resolution are settled before anything is calibrated in pixels
+        status_message = "Tuning pose model for this machine..."
+        report()
+        estimator = estimators.enter_context(pose_estimator.checkout())
+        tuner = autotune.AutoTuner.from_params("jump", estimator, ctx.params)
+        tuner.startup(cap)
+
+        if len(cameras) > 1:
+            counter.views = [JumpView(str(source), user_height) for source in cameras]
+            for source, view in zip(cameras[1:], counter.views[1:]):
+                view_cap = get_camera(source, *tuner.capture).subscribe()
+                if view_cap is None:
+                    status_message = f"ERROR: Camera {source} could not be opened."
+                    report()
+                    return
+                view_cap.service.set_resolution(*tuner.capture)
+                extras.append((view_cap, estimators.enter_context(pose_estimator.checkout()), view))
+
+        display.open_window(WINDOW_NAME)
+
+        # Every jump is kept in the shared results database, across sessions and restarts
+        athlete = ctx.params.get('athlete')
+        store = results_store.get_store()
+        store.start_session(ctx.session_id, "jump", athlete=athlete,
+                            station="camera:" + "+".join(map(str, cameras)), params=ctx.params)
+
+        def record_event(event):
+            store.record(ctx.session_id, "jump", event)
+
+        # Per-frame landmarks, to re-score the session later (recording.py)
+        recorder = recording.LandmarkRecorder.for_session(
+            ctx.session_id, "jump", athlete=athlete, width=tuner.capture[0], height=tuner.capture[1],
+            params=dict(height=user_height))
+
+        # A saved profile for this camera and resolution skips the paper phase; so does a known
+        # scale (px_per_cm param, e.g. for a replayed clip), which is never saved or checked
+        if ctx.params.get('px_per_cm'):
+            profile_key = None
+            profile = dict(px_per_cm=float(ctx.params['px_per_cm']))
+        else:
+            profile_key = calibration.profile_key("jump", camera, *tuner.capture)
+            profile = None if ctx.params.get('recalibrate') else calibration.load_profile(profile_key)
+
+        while ctx.running:
+            if profile is None:
+                px_per_cm = calibrate_with_paper()
+                if not px_per_cm:
+                    status_message = "Calibration failed. Exiting."
+                    report()
+                    return
+                profile = calibration.save_profile(profile_key, px_per_cm)
+            else:
+                status_message = f"Using saved calibration ({profile['px_per_cm']:.1f} px/cm)"
+            counter.px_per_cm = profile["px_per_cm"]
+            if recorder:
+                recorder.note(params=dict(height=user_height, px_per_cm=counter.px_per_cm))
+            report()
+
+            if not _run_jump_pipeline(ctx, cap, tuner, counter, record_event, recorder, report, handle_commands,
+                                      profile_key, profile, extras):
                 break
-            h, w = frame.shape[:2]
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = pose.process(frame_rgb)
-            
-            # Store frame for streaming (convert back to BGR for display)
-            vis_frame = frame.copy()
-            
-            # Draw pose landmarks on frame
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(vis_frame, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-            
-            # Store latest frame for streaming
-            with frame_lock:
-                _, buffer = cv2.imencode('.jpg', vis_frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                latest_frame = buffer.tobytes()
-
-            if not setup_done:
-                cv2.putText(vis_frame, "Phase 1: Stand up - Ground detection & body visibility", (40, 60),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
-                cv2.putText(vis_frame, "Stand upright with full body visible", (40, 100),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
-                status_message = "Phase 1: Stand upright with full body visible. Prepare to clap."
-                if results.pose_landmarks:
-                    is_visible = check_body_visible(results.pose_landmarks.landmark, h, w)
-                    px_cal, ground_y = calculate_px_per_cm(results.pose_landmarks.landmark, h, user_height)
-                    if is_visible and px_cal:
-                        cv2.line(vis_frame, (0, int(ground_y)), (w, int(ground_y)), (0, 255, 0), 3)
-                        cv2.putText(vis_frame, "Ground Detected", (40, 150),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                        lm = results.pose_landmarks.landmark
-                        left_wrist = lm[mp_pose.PoseLandmark.LEFT_WRIST.value]
-                        right_wrist = lm[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-                        lw_x, lw_y = int(left_wrist.x * w), int(left_wrist.y * h)
-                        rw_x, rw_y = int(right_wrist.x * w), int(right_wrist.y * h)
-                        dist = np.linalg.norm([lw_x - rw_x, lw_y - rw_y])
-                        if dist < CLAP_DISTANCE_THRESHOLD:
-                            clap_frames += 1
-                            cv2.putText(vis_frame, "Clap detected!", (40, 210), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-                            if clap_frames >= CLAP_FRAMES_REQUIRED:
-                                setup_done = True
-                                standing_reach_y = right_wrist.y * h
-                                kalman_filter.statePost = np.array([[standing_reach_y], [0]], np.float32)
-                                cv2.putText(vis_frame, "Confirmed! Ready to jump!", (40, 250), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2)
-                                status_message = "Phase 1 complete! Phase 2: Start jumping!"
-                        else:
-                            clap_frames = 0
-                            cv2.putText(vis_frame, "Join (clap) your hands to start jumping.", (40, 210), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                            status_message = "Join (clap) your hands to start jumping."
-                    else:
-                        cv2.putText(vis_frame, "Ensure full body & ground is visible.", (40, 150), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                        status_message = "Ensure full body & ground is visible."
-                cv2.imshow(WINDOW_NAME, vis_frame)
-                key = cv2.waitKey(10) & 0xFF
-                if key == ord('q'):
-                    is_detection_running = False
-                    break
-                continue
-
+            # The camera moved since the profile was saved: calibrate again, keep the counts
+            profile = None
+            counter.restart_setup()
+
+        ctx.stop()
+        status_message = "Detection stopped."
+    finally:
+        # Workers are reused: nothing of this session may stay open, even after an error
+        estimators.close()
+        for view_cap, _, _ in extras:
+            view_cap.close()
+        cap.close()
+        display.close_all()
+        if store is not None:
+            store.end_session(ctx.session_id, dict(jump_count=counter.jump_count,
+                                                   max_jump_height=counter.max_jump_height))
+            store.flush()
+        if recorder:
+            recorder.close()
+    report()
+
+def _run_jump_pipeline(ctx, cap, tuner, counter, record_event, recorder, report, handle_commands, profile_key,
+                       profile, extras=()):
+    """Phases 1 and 2 on the staged pipeline. Returns True when the calibration has to be redone."""
+    # ===== PIPELINE: capture (camera service) -> inference -> jump logic -> render/encode =====
+    inference_queue = LatestQueue()
+    render_queue = LatestQueue()
+    controls = {"cheat_detection_enabled": True}
+    stages = [
+        start_stage("jump-inference", _jump_inference_stage, ctx, cap, tuner, inference_queue),
+        start_stage("jump-render", _jump_render_stage, ctx, render_queue, WINDOW_NAME, controls),
+    ]
+    # Fused mode: one capture + inference stage per other camera, every frame kept for its view
+    view_queues = []
+    for view_cap, view_estimator, view in extras:
+        view_queue = LatestQueue(VIEW_QUEUE_SIZE)
+        stages.append(start_stage(f"jump-view-{view.name}", _jump_view_stage, ctx, view_cap, view_estimator,
+                                  tuner, view, view_queue))
+        view_queues.append((view_queue, view))
+    recalibrate = False
+
+    while ctx.running:
+        item = inference_queue.get(timeout=1.0)
+        handle_commands()
+        if item is None:
+            if inference_queue.closed:
+                break
+            continue
+        frame, results = item
+        h, w = frame.image.shape[:2]
+        landmarks = kinematics.to_array(results.pose_landmarks)
+        counter.cheat_detection = controls["cheat_detection_enabled"]
+        if counter.views:
+            # Before the counter: completing phase 1 locks the views on their latest standing frame
+            counter.views[0].update(landmarks, w, h, frame.timestamp)
+            for view_queue, view in view_queues:
+                while len(view_queue):
+                    view.update(*view_queue.get(timeout=0))
+        was_setup = counter.setup_done
+        # Time the jump from when the frame was captured, not when inference finished
+        with ctx.metrics.time("postprocess"):
+            event = counter.update(landmarks, w, h, frame.timestamp)
+        if event is not None:
+            # Queued for the results writer thread, never waits on the disk
+            record_event(event)
+        if recorder:
+            recorder.append(landmarks, frame.timestamp)
+
+        if counter.setup_done and not was_setup and profile_key is not None:
+            # Cheap check of the saved scale against the athlete's own body
+            if calibration.scale_drifted(profile, counter.body_px_per_cm):
+                calibration.delete_profile(profile_key)
+                counter.status_message = "Camera moved - recalibrating with A4 paper"
+                recalibrate = True
+                break
+            calibration.learn_body_ratio(profile_key, profile, counter.body_px_per_cm)
+
+        overlay = []
+        if not was_setup:
+            overlay.append(("text", "Phase 1: Stand up - Ground detection & body visibility", (40, 60), 1, (255, 0, 0), 2))
+            overlay.append(("text", "Stand upright with full body visible", (40, 100), 1, (255, 0, 0), 2))
+            if counter.body_visible:
+                overlay.append(("line", (0, int(counter.ground_y)), (w, int(counter.ground_y)), (0, 255, 0), 3))
+                overlay.append(("text", "Ground Detected", (40, 150), 1, (0, 255, 0), 2))
+                if counter.clap_detected:
+                    overlay.append(("text", "Clap detected!", (40, 210), 1, (0, 255, 255), 2))
+                    if counter.setup_done:
+                        overlay.append(("text", "Confirmed! Ready to jump!", (40, 250), 1, (255, 255, 0), 2))
+                else:
+                    overlay.append(("text", "Join (clap) your hands to start jumping.", (40, 210), 1, (0, 0, 255), 2))
+            elif landmarks is not None:
+                overlay.append(("text", "Ensure full body & ground is visible.", (40, 150), 1, (0, 0, 255), 2))
+        elif counter.wrist_tracked:
             # ===== PHASE 2: JUMP MEASUREMENT WITH CHEAT DETECTION =====
-            cheat_flag = False
-            if results.pose_landmarks:
-                lm = results.pose_landmarks.landmark
-                wrist = lm[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-                if wrist.visibility >= 0.5:
-                    wrist_y_px = wrist.y * h
-                    predicted_y = kalman_filter.predict()
-                    corrected_y = kalman_filter.correct(wrist_y_px)
-                    if cheat_detection_enabled and abs(wrist_y_px - predicted_y) > KALMAN_CHEAT_THRESHOLD_PX:
-                        cheat_flag = True
-
-                    current_time = time.time()
-
-                    if wrist_y_px < standing_reach_y - 30:
-                        if not in_air and (current_time - last_jump_time > jump_cooldown):
-                            if not cheat_flag:
-                                in_air = True
-                                peak_jump_y = wrist_y_px
-                        elif in_air:
-                            peak_jump_y = min(peak_jump_y, wrist_y_px)
-                    else:
-                        if in_air:
-                            jump_height_px = standing_reach_y - peak_jump_y
-                            jump_height_cm = jump_height_px / px_per_cm
-                            jump_count += 1
-                            last_jump_height = jump_height_cm
-                            if jump_height_cm > max_jump_height:
-                                max_jump_height = jump_height_cm
-                            last_jump_time = current_time
-                            csvw.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), f"{jump_height_cm:.2f}"])
-                            in_air = False
-                            status_message = f"Jump detected! Height: {jump_height_cm:.2f} cm"
-
-                    # Display jump info on frame
-                    cv2.putText(vis_frame, f"Phase 2: Jumping | Jumps: {jump_count}", (30, 60),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2)
-                    cv2.putText(vis_frame, f"Last Jump Height: {jump_height_cm:.2f} cm", (30, 120),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
-                    cv2.putText(vis_frame, f"Max Jump Height: {max_jump_height:.2f} cm", (30, 150),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
-
-                    # Display cheat status
-                    cheat_text = "CHEAT DETECTED!" if cheat_flag else "No Cheat Detected"
-                    cheat_color = (0, 0, 255) if cheat_flag else (0, 255, 0)
-                    cv2.putText(vis_frame, f"Cheat Detection: {cheat_text}", (30, 200),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, cheat_color, 2)
-                    cv2.putText(vis_frame, "Press 'c' to toggle | 'q' to quit", (30, 240),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 1)
-
-            cv2.imshow(WINDOW_NAME, vis_frame)
-            key = cv2.waitKey(10) & 0xFF
-            if key == ord('q'):
-                is_detection_running = False
+            overlay.append(("text", f"Phase 2: Jumping | Jumps: {counter.jump_count}", (30, 60), 1.5, (0, 255, 0), 2))
+            overlay.append(("text", f"Last Jump Height: {counter.jump_height_cm:.2f} cm", (30, 120), 1.0, (0, 255, 0), 2))
+            overlay.append(("text", f"Max Jump Height: {counter.max_jump_height:.2f} cm", (30, 150), 1.0, (0, 255, 0), 2))
+
+            # Display cheat status
+            cheat_text = "CHEAT DETECTED!" if counter.cheat_flag else "No Cheat Detected"
+            cheat_color = (0, 0, 255) if counter.cheat_flag else (0, 255, 0)
+            overlay.append(("text", f"Cheat Detection: {cheat_text}", (30, 200), 1, cheat_color, 2))
+            overlay.append(("text", "Press 'c' to toggle | 'q' to quit", (30, 240), 0.7, (255, 255, 0), 1))
+
+        render_queue.put((frame.image, results.pose_landmarks, overlay))
+        ctx.metrics.track("frames_dropped_total", inference_queue.dropped, source=inference_queue,
+                          reason="inference_queue")
+        ctx.metrics.track("frames_dropped_total", render_queue.dropped, source=render_queue,
+                          reason="render_queue")
+        ctx.metrics.set("queue_depth", len(inference_queue), queue="inference")
+        ctx.metrics.set("queue_depth", len(render_queue), queue="render")
+        report(counter.status_message)
+
+    # Closing the queues stops the stages without ending the session
+    inference_queue.close()
+    render_queue.close()
+    for view_queue, _ in view_queues:
+        view_queue.close()
+    for stage in stages:
+        stage.join(timeout=2.0)
+    report(counter.status_message)
+    return recalibrate
+
+def _jump_inference_stage(ctx, cap, tuner, inference_queue):
+    """Pull the newest captured frame, run pose inference and hand the result on."""
+    estimator = tuner.estimator
+    while ctx.running and not inference_queue.closed:
+        with ctx.metrics.time("capture"):
+            frame = cap.read_frame(timeout=1.0)
+        if frame is None:
+            if not cap.service.is_open:
                 break
-            elif key == ord('c'):
-                cheat_detection_enabled = not cheat_detection_enabled
-
-    cap.release()
-    csvfile.close()
-    cv2.destroyAllWindows()
-    is_detection_running = False
-    status_message = "Detection stopped."
+            continue
+        ctx.metrics.track("frames_dropped_total", cap.missed, source=cap, reason="capture")
+        start = time.perf_counter()
+        # Crops to the athlete; landmarks come back in full-frame coordinates
+        with ctx.metrics.time("convert"):
+            frame_rgb = estimator.prepare(frame.image)
+        with ctx.metrics.time("inference"):
+            results = estimator.infer(frame_rgb)
+        tuner.record(time.perf_counter() - start)
+        ctx.metrics.inc("frames_processed_total")
+        # A lockstep replay waits for the counting loop instead of skipping frames
+        inference_queue.put((frame, results), block=not cap.service.realtime)
+    inference_queue.close()
+
+def _jump_view_stage(ctx, cap, estimator, tuner, view, view_queue):
+    """Pose inference on another camera of a fused session; its landmarks go to the view's queue."""
+    while ctx.running and not view_queue.closed:
+        frame = cap.read_frame(timeout=1.0)
+        if frame is None:
+            if not cap.service.is_open:
+                break
+            continue
+        ctx.metrics.track("frames_dropped_total", cap.missed, source=cap, reason="capture",
+                          camera=view.name)
+        # Same model and crop size as the counting camera, which the tuner may change
+        level = tuner.level
+        estimator.configure(level.model_complexity, level.roi_size)
+        with ctx.metrics.time("view_inference"):
+            results = estimator.process(frame.image)
+        ctx.metrics.inc("frames_processed_total")
+        h, w = frame.image.shape[:2]
+        view_queue.put((kinematics.to_array(results.pose_landmarks), w, h, frame.timestamp),
+                       block=not cap.service.realtime)
+
+def _jump_render_stage(ctx, render_queue, window_name, controls):
+    """Draw landmarks and overlay, publish the JPEG for /video_feed and show the window."""
+    while True:
+        item = render_queue.get(timeout=1.0)
+        if item is None:
+            if render_queue.closed:
+                break
+            continue
+        # The overlay is only worth drawing for a preview window or a /video_feed viewer
+        if display.HEADLESS and not ctx.has_viewers:
+            continue
+        image, pose_landmarks, overlay = item
+        with ctx.metrics.time("overlay"):
+            vis_frame = image.copy()
+            if pose_landmarks:
+                mp_drawing.draw_landmarks(vis_frame, pose_landmarks, mp_pose.POSE_CONNECTIONS)
+            draw_overlay(vis_frame, overlay)
+        ctx.publish_frame(vis_frame)
+
+        key = display.show(window_name, vis_frame)
+        if key == ord('q'):
+            ctx.stop()
+        elif key == ord('c'):
+            controls["cheat_detection_enabled"] = not controls["cheat_detection_enabled"]
 
 HTML = """
 <!DOCTYPE html>
@@ -459,105 +566,174 @@ HTML = """
         <p id="status">Status: <span>{{ status_message }}</span></p>
     </div>
     <script>
-        setInterval(function() {
-            fetch('/status').then(r => r.json()).then(data => {
-                document.querySelector("#count span").textContent = data.jump_count;
-                document.querySelector("#height span").textContent = Number(data.last_jump_height).toFixed(2);
-                document.querySelector("#max-height span").textContent = Number(data.max_jump_height).toFixed(2);
-                document.querySelector("#status span").textContent = data.status_message;
-            });
-        }, 1000);
+        // Pushed by /events as soon as the session reports a change
+        function show(data) {
+            if ("jump_count" in data) document.querySelector("#count span").textContent = data.jump_count;
+            if ("last_jump_height" in data) document.querySelector("#height span").textContent = Number(data.last_jump_height).toFixed(2);
+            if ("max_jump_height" in data) document.querySelector("#max-height span").textContent = Number(data.max_jump_height).toFixed(2);
+            if ("status_message" in data) document.querySelector("#status span").textContent = data.status_message;
+        }
+        var events = new EventSource('/events');
+        events.addEventListener('snapshot', function(e) { show(JSON.parse(e.data)); });
+        events.addEventListener('state', function(e) { show(JSON.parse(e.data)); });
     </script>
 </body>
 </html>
 """
 
-@app.route('/', methods=['GET', 'OPTIONS'])
+def session_state(session):
+    """State reported by /status for a session (or the idle defaults)."""
+    if session is None:
+        return dict(INITIAL_STATE, is_running=False, session_id=None)
+    return dict(session.state, is_running=session.is_running, session_id=session.id)
+
+@bp.route('/', methods=['GET', 'OPTIONS'])
 def index():
-    global jump_count, last_jump_height, max_jump_height, status_message
-    return render_template_string(
-        HTML,
-        jump_count=jump_count,
-        last_jump_height=last_jump_height,
-        max_jump_height=max_jump_height,
-        status_message=status_message
-    )
-
-@app.route('/status', methods=['GET', 'OPTIONS'])
+    return render_template_string(HTML, **session_state(sessions.get()))
+
+@bp.route('/status', methods=['GET', 'OPTIONS'])
 def status():
-    global jump_count, last_jump_height, max_jump_height, status_message, is_detection_running
-    return jsonify(
-        jump_count=jump_count,
-        last_jump_height=last_jump_height,
-        max_jump_height=max_jump_height,
-        status_message=status_message,
-        is_running=is_detection_running
-    )
-
-@app.route('/start', methods=['POST'])
+    session_id = requested_session_id(request)
+    session = sessions.get(session_id)
+    if session_id and session is None:
+        return jsonify(success=False, message="Unknown session"), 404
+    return jsonify(**session_state(session))
+
+@bp.route('/events', methods=['GET'])
+def events():
+    """Server-Sent Events: jump count, heights and status pushed as they change.
+
+    Reconnecting clients send Last-Event-ID and get only what they missed.
+    """
+    session_id = requested_session_id(request)
+    session = sessions.get(session_id)
+    if session_id and session is None:
+        return jsonify(success=False, message="Unknown session"), 404
+    return Response(event_stream(session, requested_event_id(request), session_state),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@bp.route('/sessions', methods=['GET'])
+def list_sessions():
+    return jsonify(sessions=[session_state(s) for s in sessions.sessions.values()])
+
+@bp.route('/calibration/confirm', methods=['POST'])
+def confirm_calibration():
+    """Confirm the A4 calibration from a client, same as pressing SPACE in the preview window."""
+    session = sessions.get(requested_session_id(request))
+    if session is None or not session.is_running or not session.state.get("awaiting_calibration"):
+        return jsonify(success=False, message="Not calibrating")
+    if not session.state.get("paper_detected"):
+        return jsonify(success=False, message="No paper detected")
+    session.send("confirm_calibration")
+    return jsonify(success=True, message="Calibration confirmed", session_id=session.id)
+
+@bp.route('/calibration/profiles', methods=['GET', 'DELETE'])
+def calibration_profiles():
+    """List saved calibration profiles, or DELETE one (?key=jump:0:1280x720) to force the A4 phase."""
+    if request.method == 'DELETE':
+        key = request.args.get('key')
+        if not key:
+            return jsonify(success=False, message="Missing key"), 400
+        calibration.delete_profile(key)
+        return jsonify(success=True, message="Calibration profile deleted")
+    return jsonify(success=True, profiles=calibration.load_profiles())
+
+@bp.route('/start', methods=['POST'])
 def start_detection():
-    global is_detection_running, detection_thread, user_height, user_weight
-    
-    data = request.get_json() or {}
-    user_height = float(data.get('height', 170.0))
-    user_weight = float(data.get('weight', 70.0))
-    
-    if not is_detection_running:
-        is_detection_running = True
-        detection_thread = threading.Thread(target=run_jump_detection, daemon=True)
-        detection_thread.start()
-        return jsonify(success=True, message="Detection started")
-    return jsonify(success=False, message="Detection already running")
-
-@app.route('/stop', methods=['POST'])
+    data = request.get_json(silent=True) or {}
+    try:
+        # Device indices or CAMERA_SOURCES names (files and URLs only through replay.py); with several the heights are fused
+        cameras = parse_sources(data.get('cameras') or [data.get('camera', 0)])
+        params = {
+            'height': float(data.get('height', DEFAULT_HEIGHT)),
+            'weight': float(data.get('weight', DEFAULT_WEIGHT)),
+            'camera': cameras[0],
+            'cameras': cameras,
+            'athlete': data.get('athlete'),
+            # Ignore the saved calibration profile and run the A4 phase again
+            'recalibrate': bool(data.get('recalibrate', False)),
+        }
+        params.update(autotune.session_params(data))
+        session = sessions.start(params, key=cameras)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    except SessionError as e:
+        # Camera or session slots busy
+        return jsonify(success=False, message=str(e)), 409
+    return jsonify(success=True, message="Detection started", session_id=session.id)
+
+@bp.route('/stop', methods=['POST'])
 def stop_detection():
-    global is_detection_running
-    is_detection_running = False
+    session = sessions.get(requested_session_id(request))
+    if session is not None:
+        session.stop()
     return jsonify(success=True, message="Detection stopped")
 
-@app.route('/reset', methods=['POST'])
+@bp.route('/reset', methods=['POST'])
 def reset():
-    global jump_count, last_jump_height, max_jump_height
-    jump_count = 0
-    last_jump_height = 0.0
-    max_jump_height = 0.0
+    session = sessions.get(requested_session_id(request))
+    if session is not None:
+        session.update_state(jump_count=0, last_jump_height=0.0, max_jump_height=0.0)
+        session.send("reset")
     return jsonify(success=True, message="Data reset")
 
-@app.route('/increment', methods=['POST'])
+@bp.route('/increment', methods=['POST'])
 def increment():
-    global jump_count, last_jump_height, max_jump_height
-    data = request.get_json()
-    jump_count += 1
-    if data and "jump_height" in data:
-        last_jump_height = data["jump_height"]
-        if last_jump_height > max_jump_height:
-            max_jump_height = last_jump_height
+    data = request.get_json(silent=True) or {}
+    jump_height = data.get("jump_height")
+    session = sessions.get(requested_session_id(request))
+    if session is None:
+        return jsonify(success=False, message="No session")
+    if not session.send("increment", jump_height):
+        # Session already finished, adjust its final state directly
+        changes = dict(jump_count=session.state["jump_count"] + 1)
+        if jump_height is not None:
+            changes["last_jump_height"] = jump_height
+            if jump_height > session.state["max_jump_height"]:
+                changes["max_jump_height"] = jump_height
+        session.update_state(**changes)
     return jsonify(success=True)
 
-@app.route('/video_feed', methods=['GET', 'OPTIONS'])
+@bp.route('/results', methods=['GET'])
+def results():
+    """Stored results of every exercise, newest first: ?exercise=&athlete=&session_id=&since=&limit="""
+    args = request.args
+    try:
+        rows = results_store.query(exercise=args.get('exercise'), athlete=args.get('athlete'),
+                                   session_id=args.get('session_id'), since=args.get('since'),
+                                   limit=int(args.get('limit', 500)))
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    return jsonify(success=True, results=rows)
+
+@bp.route('/analyze', methods=['POST'])
+def analyze():
+    """Score an uploaded recording (multipart field 'video'); form field exercise=jump|reach."""
+    video = request.files.get('video')
+    if video is None:
+        return jsonify(success=False, message="No video uploaded"), 400
+    exercise = request.form.get('exercise', 'jump')
+    try:
+        result = analyze_upload(video, exercise, request.form)
+    except AnalysisError as e:
+        return jsonify(success=False, message=str(e)), e.status
+    return jsonify(success=True, **result)
+
+@bp.route('/video_feed', methods=['GET', 'OPTIONS'])
 def video_feed():
     """Stream video frames as MJPEG"""
-    def generate():
-        global latest_frame, frame_lock
-        while True:
-            with frame_lock:
-                if latest_frame is not None:
-                    frame = latest_frame
-                else:
-                    # Return a black frame if no frame available
-                    black_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                    _, buffer = cv2.imencode('.jpg', black_frame)
-                    frame = buffer.tobytes()
-            
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.033)  # ~30 FPS
-    
-    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    session = sessions.get(requested_session_id(request))
+    broadcaster = session.broadcaster if session is not None else idle_broadcaster
+    return Response(broadcaster.stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+sessions = SessionManager(run_jump_detection, INITIAL_STATE, warmup=pose_estimator.warm_up)
 
 if __name__ == '__main__':
     # Allow external connections (for physical devices)
     # Use host='127.0.0.1' for localhost only, or '0.0.0.0' for all interfaces
+    if display.HEADLESS:
+        print("Headless mode: no preview windows, confirm calibration with POST /calibration/confirm")
     print("Starting Flask server on http://0.0.0.0:5001")
     print("For physical device, use: http://10.117.19.2:5001")
-    app.run(host='0.0.0.0', port=5001, debug=True, threaded=True)
\ No newline at end of file
+    from server import run_standalone
+    run_standalone(bp, 5001)
\ No newline at end of file
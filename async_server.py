@@ -0,0 +1,224 @@
+"""
+async_server.py
+Production serving mode: every exercise on one asyncio (aiohttp) server.
+
+server.py runs Flask's development server, which spends a thread on every
+open connection: each /video_feed viewer and each /events client sleeps in its
+own thread for as long as it watches. Here the long-lived streams are
+coroutines over MjpegBroadcaster.astream() and EventStream.astream(), so a gym
+full of viewers costs sockets, not threads. The REST routes (start, stop,
+status, results, uploads, ...) stay the Flask blueprints of the exercise
+modules: a coroutine hands each request to the WSGI app on a small, bounded
+thread pool and awaits it, so there is still one implementation of every route.
+A request body is spooled as it arrives, in memory while it is small and to a
+temporary file beyond SPOOL_BYTES, so a video upload is never held in memory
+whole; bodies over batch_analysis.MAX_UPLOAD_BYTES are refused with 413.
+
+There is no debug reloader and no second process. Same ports as server.py:
+
+    python async_server.py
+"""
+
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from aiohttp import web
+
+import display
+import server
+from batch_analysis import MAX_UPLOAD_BYTES
+import sessions
+from streaming import BOUNDARY, SSE_HEADERS
+
+# Threads for the short Flask REST handlers; streams never use one
+REST_THREADS = 16
+# Largest request body: the /analyze upload cap
+MAX_BODY_BYTES = MAX_UPLOAD_BYTES
+# Request bodies up to this size are spooled in memory, larger ones to a temporary file
+SPOOL_BYTES = 1024 * 1024
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+PREFLIGHT_HEADERS = dict(CORS_HEADERS, **{
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization, Last-Event-ID",
+})
+
+
+def _call_wsgi(app, environ):
+    # Runs on the REST pool: the whole response is collected, these responses are small.
+    # The spooled request body is closed here, by the thread reading it, even if the request was cancelled
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = int(status.split(" ", 1)[0])
+        captured["headers"] = headers
+
+    try:
+        result = app(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+    finally:
+        environ["wsgi.input"].close()
+    return captured["status"], captured["headers"], body
+
+
+async def _spool(request):
+    # The body as a file for wsgi.input; aiohttp only applies client_max_size to read(), so it is checked here
+    if (request.content_length or 0) > MAX_BODY_BYTES:
+        raise web.HTTPRequestEntityTooLarge(MAX_BODY_BYTES, request.content_length)
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        size = 0
+        async for chunk in request.content.iter_any():
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise web.HTTPRequestEntityTooLarge(MAX_BODY_BYTES, size)
+            # Past SPOOL_BYTES a write goes to the page cache: no slower than the socket it came from
+            body.write(chunk)
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    return body, size
+
+
+def _environ(request, body, length):
+    host, _, port = (request.host or "localhost").partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or "80",
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _stream(request, response, chunks):
+    await response.prepare(request)
+    try:
+        # aclosing: a viewer that disconnects is unsubscribed right away, not at garbage collection
+        async with aclosing(chunks) as stream:
+            async for chunk in stream:
+                await response.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+    except ConnectionResetError:
+        pass
+    return response
+
+
+async def _preflight(request):
+    # Answered here: passed on to Flask, an OPTIONS on a stream route would run the stream on the REST pool
+    return web.Response(headers=PREFLIGHT_HEADERS)
+
+
+def _session_events(manager, snapshot):
+    async def handler(request):
+        session_id = request.query.get("session_id")
+        session = manager.get(session_id)
+        if session_id and session is None:
+            return web.json_response(dict(success=False, message="Unknown session"), status=404,
+                                     headers=CORS_HEADERS)
+        last_event_id = request.headers.get("Last-Event-ID") or request.query.get("last_event_id")
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **SSE_HEADERS,
+                                               **CORS_HEADERS})
+        return await _stream(request, response, sessions.async_event_stream(session, last_event_id, snapshot))
+    return handler
+
+
+def build_app():
+    """aiohttp app: coroutine streams, everything else through the Flask app of server.py."""
+    # Imported after server.build_app(), which imports every exercise module
+    flask_app = server.build_app()
+    import app1
+    import reach_app
+    import situps_app
+    import squat_app
+
+    rest_pool = ThreadPoolExecutor(REST_THREADS, thread_name_prefix="rest")
+
+    async def video_feed(request):
+        session = app1.sessions.get(request.query.get("session_id"))
+        broadcaster = session.broadcaster if session is not None else app1.idle_broadcaster
+        response = web.StreamResponse(headers={
+            "Content-Type": f"multipart/x-mixed-replace; boundary={BOUNDARY.decode()}", **CORS_HEADERS})
+        return await _stream(request, response, broadcaster.astream())
+
+    async def reach_events(request):
+        last_event_id = request.headers.get("Last-Event-ID") or request.query.get("last_event_id")
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **SSE_HEADERS,
+                                               **CORS_HEADERS})
+        return await _stream(request, response, reach_app.events.astream(last_event_id, reach_app.reach_state))
+
+    async def rest(request):
+        body, length = await _spool(request)
+        status, headers, payload = await asyncio.get_running_loop().run_in_executor(
+            rest_pool, _call_wsgi, flask_app, _environ(request, body, length))
+        response = web.Response(status=status, body=payload)
+        for name, value in headers:
+            # aiohttp sets the length of the buffered body itself
+            if name.lower() != "content-length":
+                response.headers.add(name, value)
+        return response
+
+    async def shutdown(app):
+        rest_pool.shutdown(wait=False)
+
+    streams = {
+        '/video_feed': video_feed,
+        '/events': _session_events(app1.sessions, app1.session_state),
+        '/squat/events': _session_events(squat_app.sessions, squat_app.session_state),
+        '/situp/events': _session_events(situps_app.sessions, situps_app.session_state),
+        '/reach/events': reach_events,
+    }
+    app = web.Application(client_max_size=MAX_BODY_BYTES)
+    for path, handler in streams.items():
+        app.router.add_get(path, handler)
+        app.router.add_route('OPTIONS', path, _preflight)
+    app.router.add_route('*', '/{tail:.*}', rest)
+    app.on_cleanup.append(shutdown)
+    return app
+
+
+async def serve(host='0.0.0.0', ports=(server.PORT,) + server.LEGACY_PORTS):
+    # handler_cancellation: a stream whose client left ends now, not at its next write
+    runner = web.AppRunner(build_app(), handler_cancellation=True)
+    await runner.setup()
+    for port in ports:
+        await web.TCPSite(runner, host, port).start()
+    # Warmed-up workers shared by the exercises, so the first /start does not wait for MediaPipe
+    sessions.prewarm()
+    if display.HEADLESS:
+        print("Headless mode: no preview windows, confirm calibration with POST /calibration/confirm")
+    print(f"Serving (async) jump, squat, sit-up and sit-and-reach on http://{host}:{', '.join(map(str, ports))}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
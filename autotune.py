@@ -0,0 +1,236 @@
+"""
+autotune.py
+Pick MediaPipe model complexity and resolution per machine to hold a target frame rate.
+
+We deploy to everything from gaming laptops to fanless mini-PCs, so one fixed
+setting is either too slow on the small boxes or wastes accuracy on the big
+ones. A session's AutoTuner walks a ladder of LEVELS, heaviest first:
+
+  * at startup it times a few real frames on each level and settles on the
+    heaviest one whose throughput clears the exercise's target with some
+    headroom; the level also decides the capture resolution, which is only
+    changed here, before anything is calibrated in pixels. A reused session
+    worker remembers the level the last session ended on and starts there
+    without probing again;
+  * during the session it keeps timing prepare + inference and steps down a
+    level when the machine falls behind the target (thermal throttling, a
+    second session starting), or back up once there is plenty of room.
+
+Jumps are short and need a high frame rate to catch the apex; sit-and-reach
+holds still and is fine with far fewer frames (TARGET_FPS).
+
+    tuner = AutoTuner.from_params("squat", estimator, ctx.params)
+    tuner.startup(cap)
+    ...
+    start = time.perf_counter()
+    results = estimator.process(frame.image)
+    tuner.record(time.perf_counter() - start)
+    ctx.update(**tuner.status())
+"""
+
+import time
+from collections import namedtuple
+
+# roi_size is the pose_estimator crop size; capture is only applied at startup
+Level = namedtuple("Level", ["model_complexity", "roi_size", "capture_width", "capture_height"])
+
+LEVELS = (
+    Level(2, 512, 1280, 720),
+    Level(1, 384, 1280, 720),
+    Level(1, 256, 960, 540),
+    Level(0, 256, 960, 540),
+    Level(0, 192, 640, 360),
+)
+DEFAULT_LEVEL = 1
+
+TARGET_FPS = {"jump": 30.0, "squat": 20.0, "situp": 15.0, "reach": 10.0}
+
+# Startup probe: frames timed per level, the first few only warm the graph up
+PROBE_FRAMES = 12
+PROBE_WARMUP = 3
+# Throughput needed to pick a level at startup, relative to the target
+STARTUP_HEADROOM = 1.2
+# In-session checks: step down below the target, up only with this much room
+CHECK_INTERVAL = 2.0
+STEP_UP_HEADROOM = 2.0
+COOLDOWN = 6.0
+
+# Reported in /status before a session has tuned anything
+IDLE_STATUS = dict(autotune=False, model_complexity=None, inference_size=None,
+                   capture_resolution=None, target_fps=None, fps=0.0)
+
+# Level index each (exercise, target_fps) last ran at in this process
+_settled = {}
+
+
+class AutoTuner:
+    """Chooses and adjusts the PoseEstimator level for one session."""
+
+    def __init__(self, exercise, estimator, target_fps=None, enabled=True, model_complexity=None):
+        self.exercise = exercise
+        self.estimator = estimator
+        self.target_fps = float(target_fps or TARGET_FPS.get(exercise, 20.0))
+        # A fixed model_complexity is a manual override: the tuner only reports
+        self.enabled = enabled and model_complexity is None
+        self.index = DEFAULT_LEVEL
+        if model_complexity is not None:
+            self.index = next(i for i, level in enumerate(LEVELS) if level.model_complexity == int(model_complexity))
+        # Heaviest level still allowed; lowered for good when a level falls short in-session
+        self.ceiling = 0
+        # Model complexities that failed to load (the lite and heavy models are downloaded on first use)
+        self.unavailable = set()
+        self.capture = None
+        self.fps = 0.0
+        self.capacity = 0.0
+        self._busy = 0.0
+        self._frames = 0
+        self._window_start = time.monotonic()
+        self._changed_at = self._window_start
+
+    @classmethod
+    def from_params(cls, exercise, estimator, params):
+        """Build from session params: autotune (default on), target_fps, model_complexity."""
+        return cls(exercise, estimator,
+                   target_fps=params.get("target_fps"),
+                   enabled=params.get("autotune", True),
+                   model_complexity=params.get("model_complexity"))
+
+    @property
+    def level(self):
+        return LEVELS[self.index]
+
+    def _apply(self, index, settle=True):
+        """Switch the estimator to LEVELS[index]. Returns False if that model cannot be loaded.
+
+        settle=False does not remember the level for the next session.
+        """
+        level = LEVELS[index]
+        if level.model_complexity in self.unavailable:
+            return False
+        try:
+            self.estimator.configure(level.model_complexity, level.roi_size)
+        except Exception as e:
+            print(f"Pose model {level.model_complexity} unavailable: {e}")
+            self.unavailable.add(level.model_complexity)
+            return False
+        self.index = index
+        self._changed_at = time.monotonic()
+        if self.enabled and settle:
+            _settled[(self.exercise, self.target_fps)] = index
+        return True
+
+    def startup(self, cap):
+        """Probe the levels on live frames from a FrameSubscriber and pick one.
+
+        Sets the camera to the chosen level's capture resolution; call this
+        before anything measures in pixels. Returns the chosen Level.
+        """
+        if not self.enabled:
+            self._apply(self.index)
+            self.capture = (cap.service.width, cap.service.height)
+            return self.level
+        settled = _settled.get((self.exercise, self.target_fps))
+        if settled is None or not self._apply(settled):
+            loaded = probed = False
+            for index in range(len(LEVELS)):
+                if not self._apply(index, settle=False):
+                    continue
+                loaded = True
+                capacity = self._probe(cap)
+                probed = capacity is not None
+                if not probed:
+                    # No frames to time (a camera slow to start): the default level, probed again next session
+                    self._apply(DEFAULT_LEVEL, settle=False)
+                    break
+                if capacity >= self.target_fps * STARTUP_HEADROOM:
+                    break
+            if not loaded:
+                raise RuntimeError("No pose model could be loaded")
+            if probed:
+                _settled[(self.exercise, self.target_fps)] = self.index
+        level = self.level
+        cap.service.set_resolution(level.capture_width, level.capture_height)
+        # A replay keeps its own frame size
+        self.capture = (cap.service.width, cap.service.height)
+        self.estimator.reset()
+        self._window_start = time.monotonic()
+        return level
+
+    def _probe(self, cap):
+        # Frames per second of prepare + inference alone, None without frames
+        durations = []
+        for _ in range(PROBE_FRAMES):
+            frame = cap.read_frame(timeout=1.0)
+            if frame is None:
+                break
+            start = time.perf_counter()
+            self.estimator.process(frame.image)
+            durations.append(time.perf_counter() - start)
+        durations = durations[PROBE_WARMUP:]
+        if not durations:
+            return None
+        return len(durations) / sum(durations)
+
+    def record(self, seconds):
+        """Account one frame's prepare + inference time. Returns the new Level when it changed."""
+        self._frames += 1
+        self._busy += seconds
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < CHECK_INTERVAL:
+            return None
+        self.fps = self._frames / elapsed
+        self.capacity = self._frames / self._busy if self._busy else 0.0
+        self._frames, self._busy, self._window_start = 0, 0.0, now
+        if not self.enabled or now - self._changed_at < COOLDOWN:
+            return None
+        if self.capacity < self.target_fps:
+            # This level cannot hold the target any more; never climb back above it
+            self.ceiling = max(self.ceiling, self.index + 1)
+            candidates = range(self.index + 1, len(LEVELS))
+        elif self.capacity > self.target_fps * STEP_UP_HEADROOM:
+            candidates = range(self.index - 1, self.ceiling - 1, -1)
+        else:
+            return None
+        for index in candidates:
+            if self._apply(index):
+                return self.level
+        return None
+
+    def status(self):
+        """Fields for the session's /status."""
+        level = self.level
+        capture = self.capture or (level.capture_width, level.capture_height)
+        return dict(
+            autotune=self.enabled,
+            model_complexity=level.model_complexity,
+            inference_size=level.roi_size,
+            capture_resolution=f"{capture[0]}x{capture[1]}",
+            target_fps=self.target_fps,
+            fps=round(self.fps, 1),
+        )
+
+
+def _flag(value):
+    # A JSON boolean, or the strings and numbers forms and query strings send instead
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(f"autotune must be true or false, not {value!r}")
+
+
+def session_params(data):
+    """Tuning settings from a /start JSON body, to merge into the session params."""
+    params = {"autotune": _flag(data.get("autotune", True))}
+    if data.get("target_fps"):
+        params["target_fps"] = float(data["target_fps"])
+    if data.get("model_complexity") is not None:
+        complexity = int(data["model_complexity"])
+        if complexity not in (0, 1, 2):
+            raise ValueError("model_complexity must be 0, 1 or 2")
+        params["model_complexity"] = complexity
+    return params
@@ -0,0 +1,323 @@
+"""
+batch_analysis.py
+Score recorded videos after the fact with the same counters the live sessions use.
+
+Pose inference dominates the cost, so a video is cut into segments that are
+decoded and run through MediaPipe in parallel worker processes. Each worker
+starts a few frames before its segment so pose tracking is already locked on at
+the boundary, and returns the raw landmarks. The counters are then run once,
+in frame order, over the stitched landmarks: rep stage, in_air, smoothing and
+Kalman state carry over segment boundaries exactly as they would live. The
+jump, squat and sit-up counters score the whole stack in one vectorized call
+(score_landmarks); sit-and-reach still walks it frame by frame.
+
+Usage:
+    python batch_analysis.py squat recording.mp4
+    python batch_analysis.py jump attempt.mp4 --px-per-cm 12.4 --workers 8
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+import kinematics
+from counters import JumpCounter, SquatCounter, SitupCounter, ReachCounter
+
+mp_pose = mp.solutions.pose
+
+EXERCISES = ("jump", "squat", "situp", "reach")
+SEGMENT_SECONDS = 10.0
+# Frames decoded before each segment so tracking has settled at the boundary
+WARMUP_FRAMES = 15
+NUM_LANDMARKS = kinematics.NUM_LANDMARKS
+# Largest upload request (the video and its form fields), in MB
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "256")) * 1024 * 1024
+# Bytes copied at a time from an upload to its temporary file
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class AnalysisError(Exception):
+    """Raised when a video cannot be analyzed."""
+
+    # HTTP status for the upload routes
+    status = 400
+
+
+class AnalysisBusy(AnalysisError):
+    """Raised by analyze_upload() while another upload is being analyzed."""
+
+    status = 503
+
+
+class UploadTooLarge(AnalysisError):
+    """Raised by analyze_upload() for a video over MAX_UPLOAD_BYTES."""
+
+    status = 413
+
+
+# Every upload analysis already uses all cores; more at once would only queue up processes
+_upload_slot = threading.Lock()
+
+
+def probe_video(path):
+    """Return (frame_count, fps, width, height) of a video file."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise AnalysisError(f"Could not open video: {path}")
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    if frame_count <= 0:
+        raise AnalysisError(f"Video has no frames: {path}")
+    return frame_count, fps, width, height
+
+
+def _seek(cap, index):
+    # Container seeking is not frame accurate for every codec; fall back to grabbing
+    if index and cap.set(cv2.CAP_PROP_POS_FRAMES, index) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(index):
+        if not cap.grab():
+            break
+
+
+def extract_landmarks(path, start, end, warmup=WARMUP_FRAMES):
+    """Pose landmarks for frames [start, end) as an (n, 33, 4) float32 array.
+
+    Columns are x, y, z, visibility; frames without a detected pose are NaN.
+    Runs in a worker process.
+    """
+    out = np.full((end - start, NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+    first = max(0, start - warmup)
+    cap = cv2.VideoCapture(path)
+    try:
+        _seek(cap, first)
+        with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
+            for index in range(first, end):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                results = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                if index < start or not results.pose_landmarks:
+                    continue
+                out[index - start] = kinematics.to_array(results.pose_landmarks)
+    finally:
+        cap.release()
+    return out
+
+
+def segment_bounds(frame_count, segment_frames):
+    return [(start, min(start + segment_frames, frame_count))
+            for start in range(0, frame_count, segment_frames)]
+
+
+def frame_landmarks(row):
+    """A row of extract_landmarks output as counter input: the (33, 4) array, or None for no pose."""
+    return None if np.isnan(row[0, 0]) else row
+
+
+def _first_frame(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        ret, frame = cap.read()
+    finally:
+        cap.release()
+    return frame if ret else None
+
+
+def make_counter(exercise, params, path):
+    """Build the counter for an exercise. Returns (counter, feed) where feed(landmarks, w, h, t) -> event."""
+    if exercise == "jump":
+        counter = JumpCounter(px_per_cm=params.get("px_per_cm"),
+                              user_height=float(params.get("height", 170.0)),
+                              cheat_detection=params.get("cheat_detection", True))
+        return counter, counter.update
+    if exercise == "squat":
+        counter = SquatCounter()
+        return counter, lambda lm, w, h, t: counter.update(lm, t)
+    if exercise == "situp":
+        counter = SitupCounter()
+        return counter, lambda lm, w, h, t: counter.update(lm, t)
+    if exercise == "reach":
+        pixels_per_cm = params.get("pixels_per_cm")
+        if pixels_per_cm is None and path is not None:
+            # Same A4 detection the live script starts with
+            from sit_and_reach import auto_calibrate
+            frame = _first_frame(path)
+            pixels_per_cm = auto_calibrate(frame) if frame is not None else None
+        if pixels_per_cm is None:
+            raise AnalysisError("Sit-and-reach needs pixels_per_cm or an A4 paper in the first frame")
+        counter = ReachCounter()
+        return counter, lambda lm, w, h, t: counter.update(lm, w, h, pixels_per_cm, t)
+    raise AnalysisError(f"Unknown exercise: {exercise}")
+
+
+def score_landmarks(counter, feed, landmarks, timestamps, w, h):
+    """Events of a whole (n, 33, 4) landmark stack, through counter.score() when it has one."""
+    if hasattr(counter, "score"):
+        return counter.score(landmarks, timestamps, w, h)
+    events = []
+    for row, timestamp in zip(landmarks, timestamps):
+        event = feed(frame_landmarks(row), w, h, float(timestamp))
+        if event is not None:
+            events.append(event)
+    return events
+
+
+def summarize(exercise, counter):
+    if exercise == "jump":
+        return dict(jump_count=counter.jump_count,
+                    last_jump_height=round(float(counter.last_jump_height), 2),
+                    max_jump_height=round(float(counter.max_jump_height), 2))
+    if exercise == "reach":
+        best = counter.max_reach_cm if counter.max_reach_cm > -999.0 else None
+        return dict(max_reach_cm=None if best is None else round(float(best), 2))
+    return dict(count=counter.count)
+
+
+def analyze_video(path, exercise, workers=None, segment_seconds=SEGMENT_SECONDS, params=None):
+    """Score a recorded video. Returns a dict with per-rep events and totals.
+
+    Event timestamps are seconds from the start of the video.
+    """
+    if exercise not in EXERCISES:
+        raise AnalysisError(f"Unknown exercise: {exercise}")
+    params = params or {}
+    started = time.time()
+    frame_count, fps, w, h = probe_video(path)
+    segments = segment_bounds(frame_count, max(1, int(segment_seconds * fps)))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(segments)))
+    # Built first so a missing calibration fails before any inference is spent
+    counter, feed = make_counter(exercise, params, path)
+
+    if workers == 1:
+        chunks = [extract_landmarks(path, start, end) for start, end in segments]
+    else:
+        # spawn: MediaPipe graphs and OpenCV threads do not survive a fork
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(extract_landmarks, path, start, end) for start, end in segments]
+            chunks = [f.result() for f in futures]
+
+    # Stitch: one counter scores every frame in order
+    landmarks = np.concatenate(chunks)
+    events = score_landmarks(counter, feed, landmarks, np.arange(len(landmarks)) / fps, w, h)
+    for event in events:
+        event["timestamp"] = round(event["timestamp"], 3)
+
+    elapsed = time.time() - started
+    duration = frame_count / fps
+    return dict(
+        exercise=exercise,
+        frames=frame_count,
+        fps=round(fps, 2),
+        duration=round(duration, 2),
+        segments=len(segments),
+        workers=workers,
+        elapsed=round(elapsed, 2),
+        realtime_factor=round(duration / elapsed, 2) if elapsed else None,
+        events=events,
+        **summarize(exercise, counter),
+    )
+
+
+def _form_number(form, key, kind):
+    # A positive number from an upload's form field, None when absent
+    if not form.get(key):
+        return None
+    try:
+        value = kind(form[key])
+    except ValueError:
+        raise AnalysisError(f"{key} must be a number") from None
+    if not math.isfinite(value) or value <= 0:
+        raise AnalysisError(f"{key} must be positive")
+    return value
+
+
+def _save_upload(file_storage, f):
+    # Copied in chunks, so a video over the cap is refused without being written out whole
+    size = 0
+    while True:
+        chunk = file_storage.stream.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Videos are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+        f.write(chunk)
+
+
+def analyze_upload(file_storage, exercise, form):
+    """Run analyze_video on a Flask upload (multipart field 'video').
+
+    Runs on the request's thread. One upload is analyzed at a time, on at
+    most all cores; AnalysisBusy is raised for another one meanwhile, and
+    UploadTooLarge for a video over MAX_UPLOAD_BYTES. The servers refuse a
+    larger request body before it is read (server.create_app(),
+    async_server.py).
+    """
+    import tempfile
+
+    params = {}
+    for key in ("px_per_cm", "pixels_per_cm", "height"):
+        value = _form_number(form, key, float)
+        if value is not None:
+            params[key] = value
+    workers = _form_number(form, "workers", int)
+    if workers is not None:
+        workers = min(workers, os.cpu_count() or 1)
+    if not _upload_slot.acquire(blocking=False):
+        raise AnalysisBusy("Another video is being analyzed, try again when it is done")
+    try:
+        suffix = os.path.splitext(file_storage.filename or "")[1] or ".mp4"
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                _save_upload(file_storage, f)
+            return analyze_video(path, exercise, workers=workers, params=params)
+        finally:
+            os.remove(path)
+    finally:
+        _upload_slot.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a recorded exercise video.")
+    parser.add_argument("exercise", choices=EXERCISES)
+    parser.add_argument("video")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS)
+    parser.add_argument("--px-per-cm", type=float, default=None, help="jump: scale from an A4 calibration")
+    parser.add_argument("--pixels-per-cm", type=float, default=None, help="reach: scale, else A4 in the first frame")
+    parser.add_argument("--height", type=float, default=170.0, help="jump: athlete height in cm")
+    args = parser.parse_args()
+
+    params = {"height": args.height}
+    if args.px_per_cm is not None:
+        params["px_per_cm"] = args.px_per_cm
+    if args.pixels_per_cm is not None:
+        params["pixels_per_cm"] = args.pixels_per_cm
+    try:
+        result = analyze_video(args.video, args.exercise, workers=args.workers,
+                               segment_seconds=args.segment_seconds, params=params)
+    except AnalysisError as e:
+        parser.exit(1, f"{e}\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+benchmark.py
+Replay recorded fixtures through the exercise pipelines and time every stage.
+
+Needs no camera. A fixture is a JSON manifest in the fixtures directory:
+
+    {"exercise": "squat", "video": "squat_01.mp4", "golden": {"count": 12}}
+
+with optional "landmarks" (an .npy file of (n, 33, 4) landmarks as written by
+--record) and "params" (px_per_cm, pixels_per_cm, height; see batch_analysis).
+With a video the full per-frame pipeline is timed: decode, cvtColor,
+pose.process, draw_landmarks, imencode and count (with --roi, cvtColor also
+covers the person crop and downscale of pose_estimator; with --flow, it also
+covers the optical flow that stands in for inference on most frames). With
+only landmarks, the counting logic is replayed on its own, which is cheap
+enough for every CI run.
+Built-in synthetic landmark fixtures always run so the counters are covered
+even without recordings.
+
+Reports p50/p95/p99/max latency per stage, end-to-end FPS and peak memory, and
+exits non-zero when a count does not match its golden value. Each fixture
+runs twice: timed first, then under tracemalloc for the peak Python memory.
+
+Usage:
+    python benchmark.py                       # all fixtures + synthetic
+    python benchmark.py --no-video            # landmarks only (CI)
+    python benchmark.py --roi                 # video fixtures with person-ROI inference
+    python benchmark.py --roi --flow          # ... and optical flow between inferences
+    python benchmark.py --record squat_01 squat recording.mp4
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from batch_analysis import extract_landmarks, make_counter, summarize, probe_video, frame_landmarks
+import kinematics
+from pose_estimator import PoseEstimator
+from streaming import JPEG_QUALITY
+
+mp_pose = mp.solutions.pose
+mp_drawing = mp.solutions.drawing_utils
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+STAGES = ("decode", "cvtColor", "pose.process", "to_array", "draw_landmarks", "imencode", "count")
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """Collects per-frame durations (seconds) by stage name."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def time(self, stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.samples[stage].append(time.perf_counter() - start)
+        return result
+
+    def report(self):
+        rows = {}
+        for stage in STAGES:
+            values = self.samples.get(stage)
+            if not values:
+                continue
+            ms = np.asarray(values) * 1000.0
+            row = {f"p{p}": round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+            row["max"] = round(float(ms.max()), 3)
+            row["n"] = len(values)
+            rows[stage] = row
+        return rows
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+# ---------- Synthetic landmark fixtures ----------
+
+def _blank(n):
+    out = np.zeros((n, 33, 4), dtype=np.float32)
+    out[:, :, 3] = 1.0  # visibility
+    return out
+
+
+def _set(frames, i, landmark, x, y):
+    frames[i, landmark.value, 0] = x
+    frames[i, landmark.value, 1] = y
+
+
+def synthetic_squat(reps, fps=30):
+    """Side-on leg whose knee angle sweeps standing -> 90 degrees -> standing per rep."""
+    L = mp_pose.PoseLandmark
+    per_rep = 2 * fps
+    angles = np.concatenate([np.full(fps, 175.0)] +
+                            [175.0 - 85.0 * np.sin(np.linspace(0, np.pi, per_rep)) for _ in range(reps)] +
+                            [np.full(fps, 175.0)])
+    frames = _blank(len(angles))
+    for i, angle in enumerate(angles):
+        knee = (0.5, 0.6)
+        theta = np.radians(180.0 - angle)
+        _set(frames, i, L.LEFT_KNEE, *knee)
+        _set(frames, i, L.LEFT_ANKLE, 0.5, 0.8)
+        _set(frames, i, L.LEFT_HIP, knee[0] - 0.2 * np.sin(theta), knee[1] - 0.2 * np.cos(theta))
+    return frames
+
+
+def synthetic_situps(reps, fps=30):
+    """Lying -> sitting -> lying with hands behind the head."""
+    L = mp_pose.PoseLandmark
+    hold = fps // 2
+    poses = [("down", fps)] + [("up", hold), ("down", hold)] * reps
+    frames = _blank(sum(n for _, n in poses))
+    i = 0
+    for stage, n in poses:
+        for _ in range(n):
+            hip, knee = (0.5, 0.9), (0.7, 0.85)
+            shoulder = (0.55, 0.5) if stage == "up" else (0.2, 0.9)
+            _set(frames, i, L.LEFT_HIP, *hip)
+            _set(frames, i, L.LEFT_KNEE, *knee)
+            _set(frames, i, L.LEFT_SHOULDER, *shoulder)
+            _set(frames, i, L.NOSE, shoulder[0], shoulder[1] - 0.05)
+            _set(frames, i, L.LEFT_WRIST, shoulder[0], shoulder[1] - 0.08)
+            _set(frames, i, L.RIGHT_WRIST, shoulder[0], shoulder[1] - 0.08)
+            i += 1
+    return frames
+
+
+def synthetic_jumps(reps, fps=30):
+    """Standing clap to finish setup, then reps of the right wrist rising and falling."""
+    L = mp_pose.PoseLandmark
+    reach_y = 0.4
+    track = [reach_y] * 10 + [reach_y] * fps
+    for _ in range(reps):
+        track += list(reach_y - 0.2 * np.sin(np.linspace(0, np.pi, fps // 2))) + [reach_y] * (fps + 5)
+    frames = _blank(len(track))
+    for i, wrist_y in enumerate(track):
+        _set(frames, i, L.NOSE, 0.5, 0.1)
+        _set(frames, i, L.LEFT_ANKLE, 0.45, 0.9)
+        _set(frames, i, L.RIGHT_ANKLE, 0.55, 0.9)
+        _set(frames, i, L.LEFT_WRIST, 0.5, reach_y)
+        _set(frames, i, L.RIGHT_WRIST, 0.52, wrist_y)
+    return frames
+
+
+SYNTHETIC = [
+    ("synthetic_squat", "squat", lambda: synthetic_squat(5), {}, {"count": 5}),
+    ("synthetic_situps", "situp", lambda: synthetic_situps(4), {}, {"count": 4}),
+    # No paper step: the scale falls back to the athlete's body height
+    ("synthetic_jumps", "jump", lambda: synthetic_jumps(3), {"cheat_detection": False}, {"jump_count": 3}),
+]
+
+
+# ---------- Runners ----------
+
+def run_landmarks(exercise, landmarks, params, fps=30.0, size=(1280, 720)):
+    """Replay only the counting logic over pre-extracted landmarks."""
+    timer = StageTimer()
+    counter, feed = make_counter(exercise, params, None)
+    w, h = size
+    started = time.perf_counter()
+    for index, row in enumerate(landmarks):
+        lm = frame_landmarks(row)
+        timer.time("count", feed, lm, w, h, index / fps)
+    return counter, timer, len(landmarks), time.perf_counter() - started
+
+
+def run_video(exercise, path, params, roi=False, flow=False):
+    """Run every live pipeline stage on each frame of a recording."""
+    timer = StageTimer()
+    _, fps, w, h = probe_video(path)
+    counter, feed = make_counter(exercise, params, path)
+    cap = cv2.VideoCapture(path)
+    frames = 0
+    started = time.perf_counter()
+    try:
+        with PoseEstimator(roi=roi, flow=flow) as estimator:
+            while True:
+                ret, frame = timer.time("decode", cap.read)
+                if not ret:
+                    break
+                rgb = timer.time("cvtColor", estimator.prepare, frame)
+                results = timer.time("pose.process", estimator.infer, rgb)
+                lm = timer.time("to_array", kinematics.to_array, results.pose_landmarks)
+                timer.time("count", feed, lm, w, h, frames / fps)
+                if results.pose_landmarks:
+                    timer.time("draw_landmarks", mp_drawing.draw_landmarks, frame,
+                               results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
+                timer.time("imencode", cv2.imencode, '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                frames += 1
+    finally:
+        cap.release()
+    return counter, timer, frames, time.perf_counter() - started
+
+
+def check_golden(exercise, counter, golden):
+    """Return a list of 'field: got X, expected Y' mismatches."""
+    summary = summarize(exercise, counter)
+    failures = []
+    for key, expected in (golden or {}).items():
+        got = summary.get(key)
+        if isinstance(expected, float):
+            ok = got is not None and abs(got - expected) <= 0.5
+        else:
+            ok = got == expected
+        if not ok:
+            failures.append(f"{key}: got {got}, expected {expected}")
+    return failures
+
+
+def run_fixture(name, exercise, runner, golden):
+    # Timed on a clean pass: tracemalloc slows every allocation, so it gets a pass of its own
+    counter, timer, frames, elapsed = runner()
+    tracemalloc.start()
+    try:
+        runner()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    failures = check_golden(exercise, counter, golden)
+    return dict(
+        fixture=name,
+        exercise=exercise,
+        frames=frames,
+        fps=round(frames / elapsed, 1) if elapsed else None,
+        stages_ms=timer.report(),
+        peak_python_mb=round(peak / (1024.0 * 1024.0), 2),
+        peak_rss_mb=round(_peak_rss_mb(), 1),
+        counts=summarize(exercise, counter),
+        failures=failures,
+    )
+
+
+def load_fixtures(directory, use_video=True, roi=False, flow=False):
+    """Yield (name, exercise, runner, golden) for every manifest in directory."""
+    for manifest in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(manifest) as f:
+            spec = json.load(f)
+        name = os.path.splitext(os.path.basename(manifest))[0]
+        exercise = spec["exercise"]
+        params = spec.get("params", {})
+        video = spec.get("video") and os.path.join(directory, spec["video"])
+        landmarks = spec.get("landmarks") and os.path.join(directory, spec["landmarks"])
+        if use_video and video and os.path.exists(video):
+            yield (name, exercise, (lambda e=exercise, v=video, p=params: run_video(e, v, p, roi, flow)),
+                   spec.get("golden"))
+        elif landmarks and os.path.exists(landmarks):
+            fps = spec.get("fps", 30.0)
+            yield (name + " (landmarks)", exercise,
+                   (lambda e=exercise, l=landmarks, p=params, r=fps: run_landmarks(e, np.load(l), p, r)),
+                   spec.get("golden"))
+
+
+def record_fixture(directory, name, exercise, video, params):
+    """Extract landmarks from a video and write a manifest with the current counts as golden."""
+    os.makedirs(directory, exist_ok=True)
+    frame_count, fps, w, h = probe_video(video)
+    landmarks = extract_landmarks(video, 0, frame_count)
+    np.save(os.path.join(directory, name + ".npy"), landmarks)
+    counter, _, _, _ = run_landmarks(exercise, landmarks, params, fps, (w, h))
+    spec = dict(exercise=exercise, video=os.path.basename(video), landmarks=name + ".npy",
+                fps=fps, params=params, golden=summarize(exercise, counter))
+    with open(os.path.join(directory, name + ".json"), "w") as f:
+        json.dump(spec, f, indent=2)
+    return spec
+
+
+def print_result(result):
+    status = "FAIL" if result["failures"] else "ok"
+    print(f"\n[{status}] {result['fixture']} ({result['exercise']}): {result['frames']} frames, "
+          f"{result['fps']} FPS, peak {result['peak_python_mb']} MB python / {result['peak_rss_mb']} MB RSS")
+    print(f"  counts: {result['counts']}")
+    for stage, row in result["stages_ms"].items():
+        print(f"  {stage:<15} p50 {row['p50']:>8.3f}  p95 {row['p95']:>8.3f}  "
+              f"p99 {row['p99']:>8.3f}  max {row['max']:>8.3f} ms")
+    for failure in result["failures"]:
+        print(f"  golden mismatch: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the exercise pipelines on recorded fixtures.")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--no-video", action="store_true", help="replay landmarks only, skip decode and inference")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--roi", action="store_true", help="run inference on a crop around the person")
+    parser.add_argument("--flow", action="store_true", help="track landmarks by optical flow between inferences")
+    parser.add_argument("--record", nargs=3, metavar=("NAME", "EXERCISE", "VIDEO"),
+                        help="extract a landmark fixture from a video and record its counts as golden")
+    parser.add_argument("--px-per-cm", type=float, default=None)
+    parser.add_argument("--pixels-per-cm", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.record:
+        name, exercise, video = args.record
+        params = {k: v for k, v in (("px_per_cm", args.px_per_cm), ("pixels_per_cm", args.pixels_per_cm)) if v}
+        spec = record_fixture(args.fixtures, name, exercise, video, params)
+        print(f"Recorded {name}: golden {spec['golden']} (check these before committing the fixture)")
+        return
+
+    fixtures = [(name, exercise, (lambda e=exercise, g=gen, p=params: run_landmarks(e, g(), p)), golden)
+                for name, exercise, gen, params, golden in SYNTHETIC]
+    if os.path.isdir(args.fixtures):
+        fixtures += list(load_fixtures(args.fixtures, use_video=not args.no_video, roi=args.roi,
+                                      flow=args.flow))
+
+    results = [run_fixture(*fixture) for fixture in fixtures]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print_result(result)
+    failed = [r["fixture"] for r in results if r["failures"]]
+    if failed:
+        print(f"\n{len(failed)} fixture(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
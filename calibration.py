@@ -0,0 +1,144 @@
+"""
+calibration.py
+Saved px-per-cm calibration profiles, so a fixed camera mount is calibrated once.
+
+Profiles live in a small JSON file keyed by station, camera id and resolution
+("jump:0:1280x720"). Besides the A4 scale, a profile learns the ratio between
+the athlete-based scale (counters.calculate_px_per_cm at the end of the jump
+setup) and the paper scale. The athlete stands where the paper lay, so that
+ratio stays put while the camera does; when a session's ratio drifts more than
+DRIFT_TOLERANCE from the learned one, the camera has moved and the profile is
+dropped so the paper calibration runs again.
+
+Sessions run in separate worker processes (sessions.py), so every
+read-modify-write of the file holds an OS file lock on a ".lock" file next
+to it (fcntl.flock, msvcrt.locking on Windows).
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CALIBRATION_FILE = os.environ.get("CALIBRATION_FILE", "calibration_profiles.json")
+DRIFT_TOLERANCE = 0.15
+# Weight of the newest session when updating the learned body ratio
+RATIO_SMOOTHING = 0.2
+
+
+
+@contextlib.contextmanager
+def _locked(path):
+    # Exclusive against every thread and process updating the same profiles file
+    with open(os.path.abspath(path) + ".lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds; keep waiting
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def profile_key(station, camera, width, height):
+    return f"{station}:{camera}:{int(width)}x{int(height)}"
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(path, profiles):
+    # Write-and-rename so a crash or a concurrent session never leaves half a file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".calibration-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def load_profiles(path=CALIBRATION_FILE):
+    return _read(path)
+
+
+def load_profile(key, path=CALIBRATION_FILE):
+    """The saved profile for key, or None."""
+    profile = _read(path).get(key)
+    if profile and profile.get("px_per_cm"):
+        return profile
+    return None
+
+
+def save_profile(key, px_per_cm, path=CALIBRATION_FILE):
+    """Store a fresh paper calibration. The body ratio is learned again from scratch."""
+    profile = {"px_per_cm": float(px_per_cm), "created": time.time(), "body_ratio": None, "sessions": 0}
+    with _locked(path):
+        profiles = _read(path)
+        profiles[key] = profile
+        _write(path, profiles)
+    return profile
+
+
+def delete_profile(key, path=CALIBRATION_FILE):
+    with _locked(path):
+        profiles = _read(path)
+        if profiles.pop(key, None) is not None:
+            _write(path, profiles)
+
+
+def scale_drifted(profile, body_px_per_cm):
+    """True when the athlete-based scale no longer agrees with the saved paper scale."""
+    expected = profile.get("body_ratio")
+    if not expected or not body_px_per_cm:
+        return False
+    ratio = body_px_per_cm / profile["px_per_cm"]
+    return abs(ratio / expected - 1.0) > DRIFT_TOLERANCE
+
+
+def learn_body_ratio(key, profile, body_px_per_cm, path=CALIBRATION_FILE):
+    """Fold one session's athlete-based scale into the profile's expected ratio."""
+    if not body_px_per_cm:
+        return profile
+    ratio = body_px_per_cm / profile["px_per_cm"]
+    with _locked(path):
+        profiles = _read(path)
+        stored = profiles.get(key)
+        # Only update if nobody recalibrated in the meantime, starting from what other
+        # sessions on this profile learned since it was loaded
+        if stored and stored.get("created") == profile.get("created"):
+            profile.update(stored)
+            _fold_ratio(profile, ratio)
+            profiles[key] = profile
+            _write(path, profiles)
+        else:
+            _fold_ratio(profile, ratio)
+    return profile
+
+
+def _fold_ratio(profile, ratio):
+    expected = profile.get("body_ratio")
+    profile["body_ratio"] = ratio if not expected else (1 - RATIO_SMOOTHING) * expected + RATIO_SMOOTHING * ratio
+    profile["sessions"] = profile.get("sessions", 0) + 1
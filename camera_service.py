@@ -0,0 +1,403 @@
+"""
+camera_service.py
+Shared camera capture for all exercise backends.
+
+One CameraService owns a frame source (a capture device, or a video file,
+image folder or in-memory frames replayed in its place, see frame_sources.py),
+decodes every frame exactly once on a background thread and keeps the most
+recent frames in a small ring buffer.
+Any number of exercise pipelines subscribe to it and read frames from the ring,
+so switching exercises (or running several analyses on one feed) never has to
+reopen the camera.
+
+Frames handed to subscribers are shared between them and marked read-only:
+copy a frame before drawing on it.
+
+A replay in lockstep (the default for files, see frame_sources.py) hands
+every frame to every subscriber: the capture thread waits for the slowest one
+before decoding the next, so nothing is dropped and the detection loops run
+exactly as fast as they can.
+
+share() also writes every frame into a shared-memory FrameRing
+(frame_ring.py), so another process can read them without pickling them
+through a queue: it attaches to the ring or opens it as the source
+"shm://<name>/<reader>". Nothing calls share() yet; session workers each
+open their own CameraService.
+
+A device stays open for CAMERA_LINGER seconds after its last subscriber
+leaves, so the next session in the same process (session workers are reused,
+see sessions.py) gets frames immediately instead of waiting for the driver.
+
+A station with several cameras names them once in CAMERA_SOURCES, e.g.
+
+    CAMERA_SOURCES="front=0,side=1,hall=rtsp://10.0.0.5/stream"
+
+and sessions pick theirs by index or name (parse_source()). Files, image
+folders and URLs are for scripts and replays (parse_source(value,
+local_only=False)); an HTTP client can only name what the station offers.
+"""
+
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from frame_ring import DEFAULT_READERS, FrameRing, FrameRingError
+from frame_sources import FrameSource, open_source
+
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+BUFFER_SIZE = 4
+# Stride of the pixel grid compared to spot frames the driver hands out twice
+DUPLICATE_SAMPLE_STRIDE = 24
+# Seconds a device stays open without subscribers; replays and streams are always closed at once
+CAMERA_LINGER = float(os.environ.get("CAMERA_LINGER", "30"))
+# name=source pairs, comma separated; a source is a device index, a video file, an image folder or a URL
+CAMERA_SOURCES = os.environ.get("CAMERA_SOURCES", "")
+# Highest device index a session may ask for
+MAX_DEVICE_INDEX = 63
+
+# seq increases by one for every decoded frame, timestamp is the source's capture time (time.time() live)
+CapturedFrame = namedtuple("CapturedFrame", ["seq", "timestamp", "image"])
+
+
+class FrameSubscriber:
+    """Read handle on a CameraService. Each subscriber tracks the last frame it consumed."""
+
+    def __init__(self, service):
+        self.service = service
+        self.last_seq = 0
+        # Frames captured but never read because this reader was too slow
+        self.missed = 0
+        self.closed = False
+
+    def read_frame(self, timeout=1.0):
+        """Wait for a frame newer than the last one read. Returns a CapturedFrame or None."""
+        if self.closed:
+            return None
+        frame = self.service.wait_for_frame(self.last_seq, timeout)
+        if frame is not None:
+            self.missed += frame.seq - self.last_seq - 1
+            self.last_seq = frame.seq
+            if not self.service.realtime:
+                self.service.frame_consumed()
+        return frame
+
+    def read(self, timeout=1.0):
+        """Drop-in replacement for cv2.VideoCapture.read() -> (ret, frame)."""
+        frame = self.read_frame(timeout)
+        if frame is None:
+            return False, None
+        return True, frame.image
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.service.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CameraService:
+    """Owns one frame source and fans decoded frames out to subscribers."""
+
+    def __init__(self, source=0, width=FRAME_WIDTH, height=FRAME_HEIGHT, buffer_size=BUFFER_SIZE,
+                 skip_duplicates=True, linger=CAMERA_LINGER):
+        self.source = source
+        self.frame_source = open_source(source)
+        self.linger = linger if self.frame_source.lingers else 0.0
+        self.width = width
+        self.height = height
+        self.skip_duplicates = skip_duplicates
+        self.duplicates_skipped = 0
+        self.frames = deque(maxlen=buffer_size)
+        self.subscribers = set()
+        self.error = None
+        # FrameRing other processes read, see share()
+        self.ring = None
+        self._ring_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._seq = 0
+        self._resize = False
+        self._linger_timer = None
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        # Lockstep replays: a subscriber took the newest frame, or left
+        self._consumed = threading.Condition(self._lock)
+
+    @property
+    def is_open(self):
+        return self._running
+
+    @property
+    def realtime(self):
+        """False for a lockstep replay, where every subscriber gets every frame."""
+        return self.frame_source.realtime
+
+    def subscribe(self):
+        """Register a new reader, opening the device if this is the first one.
+
+        Returns a FrameSubscriber, or None if the camera could not be opened
+        (the reason is kept in self.error).
+        """
+        with self._lock:
+            self._cancel_linger()
+            if not self._running and not self._open():
+                return None
+            sub = FrameSubscriber(self)
+            # Only hand out frames captured after subscribing
+            sub.last_seq = self._seq
+            self.subscribers.add(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        """Remove a reader; the device is released self.linger seconds after the last one leaves."""
+        with self._lock:
+            self.subscribers.discard(sub)
+            self._consumed.notify_all()
+            if self.subscribers or not self._running:
+                return
+            if self.linger > 0:
+                self._cancel_linger()
+                self._linger_timer = threading.Timer(self.linger, self.release)
+                self._linger_timer.daemon = True
+                self._linger_timer.start()
+                return
+        self.release()
+
+    def release(self):
+        """Close the device now if nobody is subscribed, without waiting for the linger to end."""
+        thread = None
+        with self._lock:
+            self._cancel_linger()
+            if not self.subscribers and self._running:
+                self._running = False
+                thread = self._thread
+                self._new_frame.notify_all()
+                self._consumed.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=2.0)
+
+    def share(self, name=None, readers=DEFAULT_READERS):
+        """Also write every frame into a shared-memory FrameRing; returns its name.
+
+        Sized for frames up to FRAME_WIDTH x FRAME_HEIGHT (or the current size
+        if larger). Other processes attach with FrameRing.attach(name, reader)
+        or read it as the source "shm://<name>/<reader>", one reader index each.
+        """
+        with self._ring_lock:
+            if self.ring is None:
+                self.ring = FrameRing.create(name, max(self.width, FRAME_WIDTH), max(self.height, FRAME_HEIGHT),
+                                             slots=readers + 2, readers=readers)
+            return self.ring.name
+
+    def unshare(self):
+        """Stop sharing frames and free the ring; attached readers stop getting frames."""
+        with self._ring_lock:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+    def _share_frame(self, image, timestamp):
+        with self._ring_lock:
+            if self.ring is None:
+                return
+            try:
+                self.ring.write(image, timestamp)
+            except FrameRingError as e:
+                print(f"Stopped sharing {self.source}: {e}")
+                self.ring.close()
+                self.ring = None
+
+    def _cancel_linger(self):
+        # Called with self._lock held
+        if self._linger_timer is not None:
+            self._linger_timer.cancel()
+            self._linger_timer = None
+
+    def set_resolution(self, width, height):
+        """Ask the device for another capture size. Applied between two reads; drivers may round it.
+
+        Sources with a fixed frame size (replays) keep theirs.
+        """
+        with self._lock:
+            if self.frame_source.size:
+                return
+            if (width, height) != (self.width, self.height):
+                self.width, self.height = width, height
+                self._resize = True
+
+    def latest(self):
+        """Most recent CapturedFrame without waiting, or None."""
+        with self._lock:
+            return self.frames[-1] if self.frames else None
+
+    def frame_consumed(self):
+        """A subscriber has read the newest frame; lets a lockstep replay decode the next one."""
+        with self._lock:
+            self._consumed.notify_all()
+
+    def wait_for_frame(self, after_seq, timeout=1.0):
+        """Block until a frame with seq > after_seq exists and return the newest one."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._running and (not self.frames or self.frames[-1].seq <= after_seq):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._new_frame.wait(remaining)
+            if not self.frames or self.frames[-1].seq <= after_seq:
+                return None
+            return self.frames[-1]
+
+    def _open(self):
+        # Called with self._lock held
+        source = self.frame_source
+        if not source.open(self.width, self.height):
+            self.error = source.error or "Camera could not be opened"
+            return False
+        if source.size:
+            self.width, self.height = source.size
+        self.error = None
+        self.frames.clear()
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, args=(source,), daemon=True)
+        self._thread.start()
+        return True
+
+    def _all_consumed(self):
+        # Called with self._lock held: lockstep replays decode a frame once everyone read the last one
+        return bool(self.subscribers) and all(sub.last_seq >= self._seq for sub in self.subscribers)
+
+    def _capture_loop(self, source):
+        prev_sample = None
+        # Only live sources have drivers that repeat a buffer; a replay may repeat frames on purpose
+        skip_duplicates = self.skip_duplicates and source.realtime
+        try:
+            while self._running:
+                if self._resize:
+                    with self._lock:
+                        self._resize = False
+                        size = (self.width, self.height)
+                    source.set_resolution(*size)
+                frame = source.read()
+                if frame is None:
+                    self.error = source.error
+                    break
+                image, timestamp = frame
+                if skip_duplicates:
+                    # Some drivers return the previous buffer again when polled faster
+                    # than they capture; a sparse pixel grid is enough to notice.
+                    sample = image[::DUPLICATE_SAMPLE_STRIDE, ::DUPLICATE_SAMPLE_STRIDE]
+                    if prev_sample is not None and np.array_equal(sample, prev_sample):
+                        self.duplicates_skipped += 1
+                        continue
+                    prev_sample = sample.copy()
+                image.flags.writeable = False
+                with self._lock:
+                    if not source.realtime:
+                        while self._running and not self._all_consumed():
+                            self._consumed.wait()
+                        if not self._running:
+                            break
+                    self._seq += 1
+                    self.frames.append(CapturedFrame(self._seq, timestamp, image))
+                    self._new_frame.notify_all()
+                if self.ring is not None:
+                    self._share_frame(image, timestamp)
+        finally:
+            source.close()
+            with self._lock:
+                self._running = False
+                self._new_frame.notify_all()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def named_sources():
+    """CAMERA_SOURCES as a {name: source} dict."""
+    sources = {}
+    for item in CAMERA_SOURCES.split(","):
+        name, sep, source = item.partition("=")
+        name, source = name.strip(), source.strip()
+        if sep and name and source:
+            sources[name] = int(source) if source.isdigit() else source
+    return sources
+
+
+def parse_source(value, local_only=True):
+    """Capture source of a session parameter: a device index or a CAMERA_SOURCES name.
+
+    Device indices come back as int, so "1" and 1 name the same camera. With
+    local_only=False (command line and scripts, never HTTP input) a file, an
+    image folder, a URL or a frame_sources.FrameSource is accepted as well.
+    """
+    if isinstance(value, FrameSource) and not local_only:
+        return value
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"Invalid camera: {value!r}")
+    if isinstance(value, int):
+        text = str(value)
+    elif isinstance(value, str):
+        text = value.strip()
+    else:
+        raise ValueError(f"Invalid camera: {value!r}")
+    if not text:
+        raise ValueError("Invalid camera: empty source")
+    if text.isdigit():
+        if int(text) > MAX_DEVICE_INDEX:
+            raise ValueError(f"Invalid camera: no device {text}")
+        return int(text)
+    sources = named_sources()
+    if text in sources:
+        return sources[text]
+    if local_only:
+        raise ValueError(f"Unknown camera: {text} (use a device index or a CAMERA_SOURCES name)")
+    return text
+
+
+def parse_sources(value, local_only=True):
+    """Several cameras, as a list or a comma separated string; duplicates dropped, order kept."""
+    items = value.split(",") if isinstance(value, str) else list(value or ())
+    sources = []
+    for item in items:
+        source = parse_source(item, local_only)
+        if source not in sources:
+            sources.append(source)
+    if not sources:
+        raise ValueError("No camera given")
+    return sources
+
+
+def get_camera(source=0, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """Return the process-wide CameraService for a source, creating it on first use.
+
+    source is anything parse_source() returns, or a frame_sources.FrameSource.
+    """
+    with _services_lock:
+        # Replays and streams are reopened from scratch anyway: forget the closed ones
+        for key, idle in list(_services.items()):
+            if not idle.frame_source.lingers and not idle.is_open and not idle.subscribers:
+                del _services[key]
+        service = _services.get(source)
+        if service is None:
+            service = CameraService(source, width, height)
+            _services[source] = service
+        return service
+
+
+def release_all():
+    """Close every device of this process that has no subscribers, e.g. for another process to open."""
+    with _services_lock:
+        services = list(_services.values())
+    for service in services:
+        service.release()
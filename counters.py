@@ -0,0 +1,726 @@
+"""
+counters.py
+Per-frame rep counting for every exercise, independent of where frames come from.
+
+Each counter is fed one frame of pose landmarks at a time, as a (33, 4)
+landmark array from kinematics.to_array (or None when no pose was found),
+together with the frame's capture timestamp, and returns an event dict when a rep or a
+new best is recorded. The live loops and offline batch analysis drive the same
+counters, so a recording scores exactly like the live session did.
+
+Every counter first smooths the landmarks with its own filters.LandmarkFilter.
+The jump, squat and sit-up counters are rep_engine latches, and also have
+score(landmarks, timestamps, w, h): the same rules over a whole (n, 33, 4)
+stack at once (NaN rows for no pose), returning every event and leaving the
+counter exactly as feeding the frames one by one would.
+
+A jump seen by several cameras is still counted on the first one; JumpView
+and fuse_jump_height() only combine the cameras' peaks into its height.
+"""
+
+from collections import deque
+
+import numpy as np
+
+import kinematics
+import rep_engine
+from filters import LandmarkFilter
+from kinematics import PoseLandmark, X, Y, VISIBILITY
+
+
+# ---------- Vertical jump ----------
+
+def _scale_from_body(landmarks, h, user_height_cm):
+    # (px_per_cm, ankle_y) from the athlete's standing height, one frame or a stack
+    ankle_y = np.maximum(landmarks[..., PoseLandmark.LEFT_ANKLE, Y],
+                         landmarks[..., PoseLandmark.RIGHT_ANKLE, Y]).astype(np.float64) * h
+    head_y = landmarks[..., PoseLandmark.NOSE, Y].astype(np.float64) * h
+    return np.abs(ankle_y - head_y) / user_height_cm, ankle_y
+
+
+def calculate_px_per_cm(landmarks, h, user_height_cm):
+    try:
+        px_per_cm, ankle_y = _scale_from_body(landmarks, h, user_height_cm)
+        return float(px_per_cm), float(ankle_y)
+    except Exception:
+        return None, None
+
+
+BODY_KEYPOINTS = [
+    PoseLandmark.NOSE,
+    PoseLandmark.LEFT_ANKLE,
+    PoseLandmark.RIGHT_ANKLE,
+    PoseLandmark.LEFT_WRIST,
+    PoseLandmark.RIGHT_WRIST,
+]
+
+
+def _body_visible(landmarks, w, h):
+    px = kinematics.to_pixels(landmarks[..., BODY_KEYPOINTS, :], w, h)
+    return ((px[..., 0] >= 0) & (px[..., 0] <= w) & (px[..., 1] >= 0) & (px[..., 1] <= h)).all(axis=-1)
+
+
+def check_body_visible(landmarks, h, w):
+    try:
+        return bool(_body_visible(landmarks, w, h))
+    except Exception:
+        return False
+
+
+# Landmarks whose vertical motion the Kalman cheat check watches
+CHEAT_LANDMARKS = [
+    PoseLandmark.RIGHT_WRIST,
+    PoseLandmark.LEFT_WRIST,
+    PoseLandmark.RIGHT_SHOULDER,
+    PoseLandmark.LEFT_SHOULDER,
+    PoseLandmark.RIGHT_HIP,
+    PoseLandmark.LEFT_HIP,
+]
+
+
+def _wrist_distance(landmarks, w, h):
+    px = kinematics.to_pixels(landmarks[..., [PoseLandmark.LEFT_WRIST, PoseLandmark.RIGHT_WRIST], :], w, h)
+    return np.linalg.norm(px[..., 0, :] - px[..., 1, :], axis=-1)
+
+
+class JumpCounter:
+    """Phase 1 (stand + clap to set the standing reach) and phase 2 (jumps with cheat check).
+
+    px_per_cm comes from the A4 calibration; when it is None the scale is taken
+    from the athlete's body (calculate_px_per_cm) at the moment phase 1 completes.
+    Jump heights use the raw wrist, so peaks are not flattened; the Kalman
+    filter only judges whether the motion of CHEAT_LANDMARKS is plausible.
+    With views (one JumpView per camera, fed by the caller), the height of a
+    jump is fused from every camera's peaks instead (fuse_jump_height).
+    """
+
+    CLAP_FRAMES_REQUIRED = 5
+    CLAP_DISTANCE_THRESHOLD = 60  # pixels
+    JUMP_COOLDOWN = 1.0  # seconds
+    TAKEOFF_MARGIN_PX = 30
+    KALMAN_CHEAT_THRESHOLD_PX = 40  # pixels between a visible landmark and its predicted height
+
+    PHASE1_MESSAGE = "Phase 1: Stand upright with full body visible. Prepare to clap."
+    NOT_VISIBLE_MESSAGE = "Ensure full body & ground is visible."
+    CLAP_MESSAGE = "Join (clap) your hands to start jumping."
+
+    def __init__(self, px_per_cm=None, user_height=170.0, cheat_detection=True):
+        self.px_per_cm = px_per_cm
+        self.user_height = user_height
+        self.cheat_detection = cheat_detection
+        self.jump_count = 0
+        self.last_jump_height = 0.0
+        self.max_jump_height = 0.0
+        self.views = []
+        self.restart_setup()
+
+    def restart_setup(self):
+        """Go back to phase 1 (e.g. after a recalibration); counts are kept."""
+        self.filter = LandmarkFilter("kalman")
+        for view in self.views:
+            view.reset()
+
+        # Phase 1
+        self.setup_done = False
+        self.clap_frames = 0
+        self.standing_reach_y = None
+        self.body_visible = False
+        self.ground_y = None
+        self.clap_detected = False
+        # Athlete-based scale when phase 1 completed, used to spot a moved camera
+        self.body_px_per_cm = None
+
+        # Phase 2: set while the wrist is above the takeoff line
+        self.airborne = rep_engine.Latch()
+        self.takeoff_time = None
+        self.peak_jump_y = None
+        self.last_jump_time = 0
+        self.cheat_flag = False
+        self.wrist_tracked = False
+        self.jump_height_cm = 0.0
+
+        self.status_message = self.PHASE1_MESSAGE
+
+    @property
+    def in_air(self):
+        return self.airborne.state
+
+    def reset_counts(self):
+        self.jump_count = 0
+        self.last_jump_height = 0.0
+        self.max_jump_height = 0.0
+
+    def record_jump(self, jump_height_cm):
+        """Count a jump measured here or reported from outside (/increment)."""
+        self.jump_count += 1
+        if jump_height_cm is not None:
+            self.last_jump_height = jump_height_cm
+            if jump_height_cm > self.max_jump_height:
+                self.max_jump_height = jump_height_cm
+
+    def update(self, landmarks, w, h, timestamp):
+        # Tracked from the first frame, so the filter is locked on when the jumps start
+        self.filter.update(landmarks, timestamp)
+        if not self.setup_done:
+            self._update_setup(landmarks, w, h)
+            return None
+        return self._update_jump(landmarks, h, timestamp)
+
+    def _update_setup(self, landmarks, w, h):
+        self.status_message = self.PHASE1_MESSAGE
+        self.body_visible = False
+        self.clap_detected = False
+        if landmarks is None:
+            return
+        is_visible = check_body_visible(landmarks, h, w)
+        px_cal, ground_y = calculate_px_per_cm(landmarks, h, self.user_height)
+        if not (is_visible and px_cal):
+            self.status_message = self.NOT_VISIBLE_MESSAGE
+            return
+        self.body_visible = True
+        self.ground_y = ground_y
+        if _wrist_distance(landmarks, w, h) < self.CLAP_DISTANCE_THRESHOLD:
+            self.clap_frames += 1
+            self.clap_detected = True
+            if self.clap_frames >= self.CLAP_FRAMES_REQUIRED:
+                self._finish_setup(landmarks, h, px_cal)
+        else:
+            self.clap_frames = 0
+            self.status_message = self.CLAP_MESSAGE
+
+    def _finish_setup(self, landmarks, h, px_cal):
+        self.setup_done = True
+        self.standing_reach_y = float(landmarks[PoseLandmark.RIGHT_WRIST, Y]) * h
+        self.body_px_per_cm = px_cal
+        if self.px_per_cm is None:
+            self.px_per_cm = px_cal
+        for view in self.views:
+            # Every camera's body scale, corrected like this one's
+            view.lock(self.px_per_cm / px_cal)
+        self.status_message = "Phase 1 complete! Phase 2: Start jumping!"
+
+    def _cheats(self, landmarks, innovation, h):
+        # A visible CHEAT_LANDMARK far from its Kalman prediction; one frame or a stack
+        jumped = np.abs(innovation[..., CHEAT_LANDMARKS, Y]) * h > self.KALMAN_CHEAT_THRESHOLD_PX
+        visible = landmarks[..., CHEAT_LANDMARKS, VISIBILITY] >= 0.5
+        return self.cheat_detection & (jumped & visible).any(axis=-1)
+
+    def _land(self, timestamp):
+        jump_height_px = self.standing_reach_y - self.peak_jump_y
+        self.jump_height_cm = jump_height_px / self.px_per_cm
+        if self.views:
+            fused, views = fuse_jump_height(self.views, self.takeoff_time, timestamp)
+            if fused is not None:
+                self.jump_height_cm = fused
+        self.record_jump(self.jump_height_cm)
+        self.last_jump_time = timestamp
+        self.status_message = f"Jump detected! Height: {self.jump_height_cm:.2f} cm"
+        event = {"type": "jump", "timestamp": timestamp, "count": self.jump_count,
+                 "height_cm": round(float(self.jump_height_cm), 2)}
+        if self.views:
+            event["views"] = views
+        return event
+
+    def _update_jump(self, landmarks, h, timestamp):
+        self.cheat_flag = False
+        self.wrist_tracked = False
+        if landmarks is None:
+            return None
+        wrist = landmarks[PoseLandmark.RIGHT_WRIST]
+        if wrist[VISIBILITY] < 0.5:
+            return None
+        self.wrist_tracked = True
+        wrist_y_px = float(wrist[Y]) * h
+        self.cheat_flag = bool(self._cheats(landmarks, self.filter.innovation, h))
+
+        # Takeoff above the line (not a cheat, not within the cooldown), landing back below it
+        above = wrist_y_px < self.standing_reach_y - self.TAKEOFF_MARGIN_PX
+        transition = self.airborne.step(
+            above and not self.cheat_flag and rep_engine.ready(timestamp, self.last_jump_time, self.JUMP_COOLDOWN),
+            not above)
+        if transition == rep_engine.SET:
+            self.takeoff_time = timestamp
+            self.peak_jump_y = wrist_y_px
+        elif transition == rep_engine.RESET:
+            return self._land(timestamp)
+        elif self.in_air:
+            self.peak_jump_y = min(self.peak_jump_y, wrist_y_px)
+        return None
+
+    def score(self, landmarks, timestamps, w, h):
+        """update() over a whole landmark stack; returns the events."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        _, innovations = self.filter.series(landmarks, timestamps)
+        start = 0 if self.setup_done else self._score_setup(landmarks, w, h)
+        if start == len(landmarks):
+            return []
+        return self._score_jumps(landmarks[start:], timestamps[start:], innovations[start:], h)
+
+    def _score_setup(self, landmarks, w, h):
+        # Phase 1 over the stack; returns the index of the first phase 2 frame
+        n = len(landmarks)
+        posed = ~np.isnan(landmarks[:, 0, 0])
+        frames = np.flatnonzero(posed)
+        px_cal, ground_y = _scale_from_body(landmarks[frames], h, self.user_height)
+        valid = _body_visible(landmarks[frames], w, h) & (px_cal != 0)
+        frames, px_cal, ground_y = frames[valid], px_cal[valid], ground_y[valid]
+        # Frames without a usable pose neither count nor break the clap streak
+        clap = _wrist_distance(landmarks[frames], w, h) < self.CLAP_DISTANCE_THRESHOLD
+        streak = rep_engine.runs(clap, self.clap_frames)
+        done = np.flatnonzero(streak >= self.CLAP_FRAMES_REQUIRED)
+        if len(done):
+            i = done[0]
+            self.body_visible = self.clap_detected = True
+            self.ground_y = float(ground_y[i])
+            self.clap_frames = int(streak[i])
+            self._finish_setup(landmarks[frames[i]], h, float(px_cal[i]))
+            return frames[i] + 1
+
+        # Still in phase 1: leave the flags as the last frame set them
+        if len(frames):
+            self.ground_y = float(ground_y[-1])
+            self.clap_frames = int(streak[-1])
+        last_valid = len(frames) and frames[-1] == n - 1
+        self.body_visible = bool(last_valid)
+        self.clap_detected = bool(last_valid and clap[-1])
+        if last_valid:
+            self.status_message = self.PHASE1_MESSAGE if clap[-1] else self.CLAP_MESSAGE
+        elif n:
+            self.status_message = self.NOT_VISIBLE_MESSAGE if posed[-1] else self.PHASE1_MESSAGE
+        return n
+
+    def _score_jumps(self, landmarks, timestamps, innovations, h):
+        tracked = np.flatnonzero(landmarks[:, PoseLandmark.RIGHT_WRIST, VISIBILITY] >= 0.5)
+        y = landmarks[tracked, PoseLandmark.RIGHT_WRIST, Y].astype(np.float64) * h
+        t = timestamps[tracked]
+        cheat = self._cheats(landmarks[tracked], innovations[tracked], h)
+        last_tracked = len(tracked) and tracked[-1] == len(landmarks) - 1
+        self.wrist_tracked = bool(last_tracked)
+        self.cheat_flag = bool(last_tracked and cheat[-1])
+
+        above = y < self.standing_reach_y - self.TAKEOFF_MARGIN_PX
+        events = []
+        pos = 0
+        while pos < len(y):
+            if not self.in_air:
+                takeoff = np.flatnonzero(above[pos:] & ~cheat[pos:]
+                                         & rep_engine.ready(t[pos:], self.last_jump_time, self.JUMP_COOLDOWN))
+                if not len(takeoff):
+                    break
+                pos += takeoff[0]
+                self.airborne.state = True
+                self.takeoff_time = float(t[pos])
+                self.peak_jump_y = float(y[pos])
+                pos += 1
+            else:
+                landing = np.flatnonzero(~above[pos:])
+                end = pos + landing[0] if len(landing) else len(y)
+                if end > pos:
+                    self.peak_jump_y = min(self.peak_jump_y, float(y[pos:end].min()))
+                if end == len(y):
+                    break
+                self.airborne.state = False
+                events.append(self._land(float(t[end])))
+                pos = end + 1
+        return events
+
+
+# ---------- Vertical jump, several cameras ----------
+
+class JumpView:
+    """Wrist and ankle heights of the jumping athlete as one camera sees them.
+
+    A session with several cameras feeds one view per camera, the counting
+    one included, with that camera's raw landmarks. While the counter is in
+    phase 1 a view remembers the athlete's latest standing frame; when the
+    clap completes phase 1 the counter locks every view on it: standing reach
+    (the higher wrist), ground line (the lower ankle) and a scale from the
+    body height, corrected by the counting camera's calibrated / body ratio.
+    """
+
+    HISTORY = 4.0  # seconds of samples kept, more than any flight
+    MIN_SAMPLES = 2  # frames in the air a view needs to count
+
+    def __init__(self, name, user_height=170.0):
+        self.name = name
+        self.user_height = user_height
+        # (timestamp, highest wrist y, lowest ankle y) in pixels, NaN where not visible
+        self.samples = deque()
+        self.reset()
+
+    def reset(self):
+        self.px_per_cm = None
+        self.standing_reach_y = None
+        self.ground_y = None
+        self._standing = None
+
+    def update(self, landmarks, w, h, timestamp):
+        if landmarks is None:
+            return
+        wrists = landmarks[[PoseLandmark.LEFT_WRIST, PoseLandmark.RIGHT_WRIST]]
+        ankles = landmarks[[PoseLandmark.LEFT_ANKLE, PoseLandmark.RIGHT_ANKLE]]
+        wrists = wrists[wrists[:, VISIBILITY] >= 0.5, Y]
+        ankles = ankles[ankles[:, VISIBILITY] >= 0.5, Y]
+        wrist_y = float(wrists.min()) * h if len(wrists) else np.nan
+        ankle_y = float(ankles.max()) * h if len(ankles) else np.nan
+        self.samples.append((timestamp, wrist_y, ankle_y))
+        while self.samples[0][0] < timestamp - self.HISTORY:
+            self.samples.popleft()
+        if self.px_per_cm is None and len(wrists) and check_body_visible(landmarks, h, w):
+            body_px_per_cm, ground_y = calculate_px_per_cm(landmarks, h, self.user_height)
+            if body_px_per_cm:
+                self._standing = (body_px_per_cm, wrist_y, ground_y)
+
+    def lock(self, scale_ratio):
+        """Take the reference heights and scale from the latest standing frame; False if there was none."""
+        if self._standing is None:
+            return False
+        body_px_per_cm, self.standing_reach_y, self.ground_y = self._standing
+        self.px_per_cm = body_px_per_cm * scale_ratio
+        return True
+
+    def peaks(self, start, end):
+        """(wrist rise, feet lift) in cm at their highest between two timestamps; None if not seen.
+
+        The feet lift is None when no ankle was visible.
+        """
+        if self.px_per_cm is None:
+            return None
+        window = np.array([s for s in self.samples if start <= s[0] <= end]).reshape(-1, 3)
+        wrist = window[~np.isnan(window[:, 1])][:, :2]
+        if len(wrist) < self.MIN_SAMPLES:
+            return None
+        ankle = window[~np.isnan(window[:, 2])][:, ::2]
+        lift = (self.ground_y - _apex(ankle)) / self.px_per_cm if len(ankle) else None
+        return (self.standing_reach_y - _apex(wrist)) / self.px_per_cm, lift
+
+
+# Samples on either side of the highest one fitted by _apex()
+APEX_SAMPLES = 3
+
+
+def _apex(track):
+    # Highest y of a (timestamp, y) flight track: the vertex of a parabola through the
+    # samples around the highest one (flight is ballistic), so one noisy frame does not set it
+    i = int(np.argmin(track[:, 1]))
+    top = track[max(0, i - APEX_SAMPLES):i + APEX_SAMPLES + 1]
+    t = top[:, 0] - top[0, 0]
+    if len(top) >= 3 and np.ptp(t) > 0:
+        a, b, c = np.polyfit(t, top[:, 1], 2)
+        if a > 0 and t[0] <= -b / (2 * a) <= t[-1]:
+            return c - b * b / (4 * a)
+    return track[:, 1].min()
+
+
+# A view's wrist may rise this much less than its feet (landmark jitter) ...
+FUSE_FEET_TOLERANCE_CM = 5.0
+# ... and at most this much more: the arms swing up from the clap to overhead
+FUSE_ARM_SWING_CM = 90.0
+
+
+def fuse_jump_height(views, start, end):
+    """Jump height in cm from the views' peaks during one flight, and how many views agreed.
+
+    Each view's wrist peak has to be plausible against its own feet, which
+    drops a camera that lost the wrist behind the body or to a bad detection;
+    the remaining peaks are combined by their median, so two cameras are
+    averaged and one wrong camera out of three cannot move the result.
+    Returns (None, 0) when no view saw the flight.
+    """
+    heights = []
+    for view in views:
+        peaks = view.peaks(start, end)
+        if peaks is None:
+            continue
+        rise, lift = peaks
+        if lift is not None and not lift - FUSE_FEET_TOLERANCE_CM <= rise <= lift + FUSE_ARM_SWING_CM:
+            continue
+        heights.append(rise)
+    if not heights:
+        return None, 0
+    return float(np.median(heights)), len(heights)
+
+
+# ---------- Squat ----------
+
+class SquatCounter:
+    """Knee-angle squat counter with auto standing calibration on the first frame."""
+
+    def __init__(self, min_vis=0.2, depth_percent=0.75, stand_percent=0.95):
+        self.filter = LandmarkFilter("one_euro")
+        self.min_vis = min_vis
+        self.depth_percent = depth_percent  # 75% of standing angle = bottom squat
+        self.stand_percent = stand_percent
+        self.count = 0
+        # Set while down in a squat
+        self.down = rep_engine.Latch()
+        self.angle = None
+        self.standing_reference = None
+        self.status_message = "Calibrating... Please stand straight"
+
+    @property
+    def stage(self):
+        return "down" if self.down.state else "up"
+
+    def reset_counts(self):
+        self.count = 0
+        self.down.state = False
+
+    def _knee_angle(self, landmarks):
+        # Left leg if visible, otherwise right leg; one frame or a stack
+        left = landmarks[..., PoseLandmark.LEFT_KNEE, VISIBILITY] > self.min_vis
+        return np.where(left, kinematics.angle(landmarks, "left_knee"), kinematics.angle(landmarks, "right_knee"))
+
+    def _calibrate(self, angle):
+        # Auto-standing calibration on the first frame
+        if self.standing_reference is None:
+            self.standing_reference = angle
+            self.status_message = "Calibration complete. Start squatting!"
+
+    def _rep(self, timestamp):
+        self.count += 1
+        self.status_message = f"Squat {self.count} completed!"
+        return {"type": "squat", "timestamp": timestamp, "count": self.count}
+
+    def update(self, landmarks, timestamp):
+        landmarks = self.filter.update(landmarks, timestamp)
+        if landmarks is None:
+            return None
+        self.angle = float(self._knee_angle(landmarks))
+        self._calibrate(self.angle)
+        # Down below depth_percent of standing, up again above stand_percent
+        transition = self.down.step(self.angle < self.standing_reference * self.depth_percent,
+                                    self.angle > self.standing_reference * self.stand_percent)
+        if transition == rep_engine.RESET:
+            return self._rep(timestamp)
+        return None
+
+    def score(self, landmarks, timestamps, w=None, h=None):
+        """update() over a whole landmark stack; returns the events."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        landmarks, _ = self.filter.series(landmarks, timestamps)
+        frames = np.flatnonzero(~np.isnan(landmarks[:, 0, 0]))
+        if not len(frames):
+            return []
+        angles = self._knee_angle(landmarks[frames]).astype(np.float64)
+        self._calibrate(float(angles[0]))
+        initial = self.down.state
+        down = rep_engine.latch(angles < self.standing_reference * self.depth_percent,
+                                angles > self.standing_reference * self.stand_percent, initial)
+        _, reps = rep_engine.edges(down, initial)
+        self.angle = float(angles[-1])
+        self.down.state = bool(down[-1])
+        return [self._rep(float(timestamps[frames[i]])) for i in reps]
+
+
+# ---------- Sit-up ----------
+
+class SitupCounter:
+    """Shoulder-hip-knee angle sit-up counter; reps only count with hands behind the head."""
+
+    def __init__(self, down_angle=160, up_angle=100, shoulder_ground_y=0.85, shoulder_up_y=0.6,
+                 rep_cooldown=0.5):
+        self.down_angle = down_angle
+        self.up_angle = up_angle
+        self.shoulder_ground_y = shoulder_ground_y
+        self.shoulder_up_y = shoulder_up_y
+        self.rep_cooldown = rep_cooldown
+        self.filter = LandmarkFilter("one_euro")
+        self.count = 0
+        # Set while sat up
+        self.up = rep_engine.Latch()
+        self.angle = 0.0
+        self.last_rep_time = 0
+        self.status_message = "Sit-up detection started"
+
+    @property
+    def stage(self):
+        return "up" if self.up.state else "down"
+
+    def reset_counts(self):
+        self.count = 0
+        self.up.state = False
+
+    @staticmethod
+    def _hands_behind_head(landmarks):
+        nose_y = landmarks[..., PoseLandmark.NOSE, Y]
+        return ((landmarks[..., PoseLandmark.LEFT_WRIST, Y] < nose_y)
+                & (landmarks[..., PoseLandmark.RIGHT_WRIST, Y] < nose_y))
+
+    def _conditions(self, angle, shoulder_y):
+        # (sat up, back down): shoulder-hip-knee angle and shoulder height, one frame or arrays
+        return ((angle < self.up_angle) & (shoulder_y < self.shoulder_up_y),
+                (angle > self.down_angle) & (shoulder_y > self.shoulder_ground_y))
+
+    def _rep(self, timestamp):
+        self.count += 1
+        self.last_rep_time = timestamp
+        self.status_message = f"Rep {self.count} completed!"
+        return {"type": "situp", "timestamp": timestamp, "count": self.count}
+
+    def update(self, landmarks, timestamp):
+        landmarks = self.filter.update(landmarks, timestamp)
+        if landmarks is None:
+            return None
+        self.angle = float(kinematics.angle(landmarks, "left_hip"))
+        # Reps only count with the hands behind the head
+        if not self._hands_behind_head(landmarks):
+            return None
+        shoulder_y = float(landmarks[PoseLandmark.LEFT_SHOULDER, Y])
+        transition = self.up.step(*self._conditions(self.angle, shoulder_y))
+        if transition == rep_engine.RESET and rep_engine.ready(timestamp, self.last_rep_time, self.rep_cooldown):
+            return self._rep(timestamp)
+        return None
+
+    def score(self, landmarks, timestamps, w=None, h=None):
+        """update() over a whole landmark stack; returns the events."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        landmarks, _ = self.filter.series(landmarks, timestamps)
+        posed = np.flatnonzero(~np.isnan(landmarks[:, 0, 0]))
+        if not len(posed):
+            return []
+        self.angle = float(kinematics.angle(landmarks[posed[-1]], "left_hip"))
+        frames = posed[self._hands_behind_head(landmarks[posed])]
+        if not len(frames):
+            return []
+        lm = landmarks[frames]
+        angles = kinematics.angle(lm, "left_hip").astype(np.float64)
+        shoulder_y = lm[:, PoseLandmark.LEFT_SHOULDER, Y].astype(np.float64)
+        initial = self.up.state
+        up = rep_engine.latch(*self._conditions(angles, shoulder_y), initial)
+        _, reps = rep_engine.edges(up, initial)
+        self.up.state = bool(up[-1])
+        times = timestamps[frames[reps]].astype(np.float64)
+        counted, _ = rep_engine.cooldown_filter(times, self.rep_cooldown, self.last_rep_time)
+        return [self._rep(t) for t in times[counted].tolist()]
+
+
+# ---------- Sit-and-reach ----------
+
+REACH_TOE_CANDIDATES = [
+    PoseLandmark.LEFT_FOOT_INDEX,
+    PoseLandmark.RIGHT_FOOT_INDEX,
+    PoseLandmark.LEFT_HEEL,
+    PoseLandmark.RIGHT_HEEL,
+    PoseLandmark.LEFT_ANKLE,
+    PoseLandmark.RIGHT_ANKLE,
+]
+
+
+def find_best_toe(landmarks, min_visibility=0.20):
+    """Index of the best visible toe/foot reference landmark (foot index, heel, ankle), or None."""
+    for c in REACH_TOE_CANDIDATES:
+        if landmarks[c, VISIBILITY] > min_visibility:
+            return c
+    return None
+
+
+class ReachCounter:
+    """Sit-and-reach: fingertip reach past the toes on smoothed landmarks, plus a held-posture reach check."""
+
+    KNEE_LOCK_ANGLE = 165      # degrees, threshold for straight leg
+    ANKLE_DIST_THRESHOLD = 0.05  # normalized, threshold for feet not sliding
+    HIP_Y_THRESHOLD = 0.05     # normalized, threshold for hip lift
+    WRIST_Y_DIFF_THRESHOLD = 0.05  # normalized, hands aligned
+    HOLD_DURATION = 30         # frames (~1 sec at 30fps)
+
+    def __init__(self, min_visibility=0.20):
+        self.filter = LandmarkFilter("one_euro")
+        self.min_visibility = min_visibility
+        self.reach_cm = 0.0
+        self.max_reach_cm = -999.0
+        self.smoothed_reach_px = None
+        self.hold_frames = 0
+        self.last_valid_reach = None
+
+    def reset_max(self):
+        self.max_reach_cm = -999.0
+
+    def update(self, landmarks, w, h, pixels_per_cm, timestamp):
+        """Returns a max_reach event when the best reach improves on this frame."""
+        lm = self.filter.update(landmarks, timestamp)
+        if lm is None:
+            return None
+        px = kinematics.to_pixels(lm, w, h)
+        new_max = False
+
+        # compute hip center x for forward direction guess
+        hip_center_x = ((lm[PoseLandmark.LEFT_HIP, X] + lm[PoseLandmark.RIGHT_HIP, X]) / 2.0) * w
+
+        # toe reference
+        toe = find_best_toe(lm, self.min_visibility)
+
+        # fingertip candidates (index finger tips)
+        left_vis = lm[PoseLandmark.LEFT_INDEX, VISIBILITY] > self.min_visibility
+        right_vis = lm[PoseLandmark.RIGHT_INDEX, VISIBILITY] > self.min_visibility
+
+        if toe is not None and (left_vis or right_vis):
+            toe_x = int(px[toe, 0])
+            left_x = int(px[PoseLandmark.LEFT_INDEX, 0])
+            right_x = int(px[PoseLandmark.RIGHT_INDEX, 0])
+
+            # choose the hand that is further horizontally from the toe (likely the reaching hand)
+            dist_left = abs(left_x - toe_x) if left_vis else -1
+            dist_right = abs(right_x - toe_x) if right_vis else -1
+            hand_x = left_x if dist_left >= dist_right else right_x
+
+            # Determine "forward" direction relative to hip->toe: if toe is to the right of hips, forward is +x
+            forward_sign = 1 if toe_x > int(hip_center_x) else -1
+
+            # reach in pixels (positive = fingertip beyond toes in forward direction)
+            self.smoothed_reach_px = (hand_x - toe_x) * forward_sign
+
+            # convert to cm if calibrated
+            self.reach_cm = None
+            if pixels_per_cm is not None:
+                self.reach_cm = self.smoothed_reach_px / pixels_per_cm
+                if self.reach_cm > self.max_reach_cm:
+                    self.max_reach_cm = self.reach_cm
+                    new_max = True
+
+        # (a) Legs straight and flat
+        left_leg_angle, right_leg_angle = kinematics.joint_angles(lm, ("left_knee", "right_knee"))
+        legs_straight = left_leg_angle > self.KNEE_LOCK_ANGLE and right_leg_angle > self.KNEE_LOCK_ANGLE
+
+        # (b) Feet placement
+        left_ankle, right_ankle = lm[PoseLandmark.LEFT_ANKLE], lm[PoseLandmark.RIGHT_ANKLE]
+        feet_stable = abs(left_ankle[X] - right_ankle[X]) < self.ANKLE_DIST_THRESHOLD
+
+        # (c) Hip position
+        hip_y = (lm[PoseLandmark.LEFT_HIP, Y] + lm[PoseLandmark.RIGHT_HIP, Y]) / 2
+        ankle_y = (left_ankle[Y] + right_ankle[Y]) / 2
+        hip_down = abs(hip_y - ankle_y) < self.HIP_Y_THRESHOLD
+
+        # (d) Hands aligned
+        left_wrist, right_wrist = lm[PoseLandmark.LEFT_WRIST], lm[PoseLandmark.RIGHT_WRIST]
+        hands_aligned = abs(left_wrist[Y] - right_wrist[Y]) < self.WRIST_Y_DIFF_THRESHOLD
+
+        # (e) Reach forward: the wrist further from the ankle (horizontal distance)
+        left_reach = abs(left_wrist[X] - left_ankle[X])
+        right_reach = abs(right_wrist[X] - right_ankle[X])
+        reach_px = float(max(left_reach, right_reach)) * w  # convert normalized to pixels
+
+        # (f) Hold duration
+        if legs_straight and feet_stable and hip_down and hands_aligned:
+            if self.last_valid_reach is not None and abs(reach_px - self.last_valid_reach) < 10:
+                self.hold_frames += 1
+            else:
+                self.hold_frames = 1
+                self.last_valid_reach = reach_px
+        else:
+            self.hold_frames = 0
+            self.last_valid_reach = None
+
+        # Only count if held for required duration
+        if self.hold_frames >= self.HOLD_DURATION:
+            if pixels_per_cm is not None:
+                self.reach_cm = reach_px / pixels_per_cm
+                if self.reach_cm > self.max_reach_cm:
+                    self.max_reach_cm = self.reach_cm
+                    new_max = True
+            self.hold_frames = 0  # reset after counting
+
+        if new_max:
+            return {"type": "max_reach", "timestamp": timestamp,
+                    "reach_cm": round(float(self.max_reach_cm), 2)}
+        return None
@@ -0,0 +1,47 @@
+"""
+display.py
+Desktop preview windows, switchable off for headless servers.
+
+Detection loops call show() instead of cv2.imshow + cv2.waitKey. In headless
+mode (HEADLESS=1 in the environment, or --headless on the command line) no GUI
+call is made at all, so the loops run on machines without a display and do not
+pay the per-frame waitKey delay.
+"""
+
+import os
+import sys
+
+import cv2
+
+HEADLESS = os.environ.get("HEADLESS", "").lower() in ("1", "true", "yes") or "--headless" in sys.argv
+
+NO_KEY = -1
+
+
+def set_headless(enabled):
+    global HEADLESS
+    HEADLESS = bool(enabled)
+
+
+def open_window(name):
+    if not HEADLESS:
+        cv2.namedWindow(name)
+
+
+def show(name, image, delay=1):
+    """Show image and poll the keyboard. Returns the pressed key (0-255) or NO_KEY."""
+    if HEADLESS:
+        return NO_KEY
+    cv2.imshow(name, image)
+    key = cv2.waitKey(delay)
+    return key & 0xFF if key != -1 else NO_KEY
+
+
+def close_window(name):
+    if not HEADLESS:
+        cv2.destroyWindow(name)
+
+
+def close_all():
+    if not HEADLESS:
+        cv2.destroyAllWindows()
@@ -0,0 +1,293 @@
+"""
+filters.py
+Smoothing for all 33 landmarks at once, shared by every exercise counter.
+
+A LandmarkFilter takes the (33, 4) landmark frames of one athlete and returns
+them smoothed: x, y, z of every landmark in one vectorized update per frame;
+visibility is passed through. Two models:
+
+    one_euro  One-Euro filter: an exponential smoother whose cutoff rises with
+              the landmark's speed, so it is smooth at rest and keeps up with
+              a fast rep without the lag of a fixed EMA.
+    kalman    Constant-velocity Kalman filter per coordinate. Every coordinate
+              is measured on every frame with the same noise, so the 2x2
+              covariance and the gains are shared and only the positions and
+              velocities are arrays.
+
+After each update, `innovation` holds measurement minus prediction for every
+landmark (normalized image units), which the jump counter uses to flag
+implausible motion on several landmarks instead of one wrist.
+
+    smoother = LandmarkFilter("one_euro")
+    lm = smoother.update(lm, timestamp)      # None in, None out
+    stack, innovations = smoother.series(landmarks, timestamps)
+
+series() smooths an (n, 33, 4) stack (NaN rows for no pose) with the same
+arithmetic as update(), so a counter's offline score() smooths like its
+live frames. It does not loop over frames in Python: the stack is cut into
+blocks of about SERIES_BLOCK frames that are filtered side by side, one
+array step per frame of a block. A block's true starting state is the end
+of the block before it, which is only known afterwards, so each block first
+filters the SERIES_WARMUP frames before it from a fresh start. Both filters
+forget where they started well within that, and a block whose warm-up ended
+within SERIES_TOLERANCE of the previous block's end is taken as it is (the
+difference is far below float32, the landmarks' own precision). Blocks that
+are not, say at high frame rates, are filtered again from the ends of the
+blocks before them until they are.
+"""
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from kinematics import NUM_LANDMARKS
+
+MODELS = ("one_euro", "kalman")
+# Pose lost for longer than this: start over rather than bridge the gap
+RESET_GAP = 1.0  # seconds
+MIN_DT = 1e-3  # seconds, for repeated timestamps
+
+# One-Euro defaults, in normalized image units per second
+ONE_EURO_MIN_CUTOFF = 1.0  # Hz, at rest
+ONE_EURO_BETA = 30.0       # cutoff gain per unit of speed
+ONE_EURO_D_CUTOFF = 1.0    # Hz, for the speed estimate
+
+# Kalman defaults, normalized image units
+KALMAN_ACCEL_NOISE = 100.0         # acceleration variance (units/s^2)^2
+KALMAN_MEASUREMENT_NOISE = 4e-5    # landmark jitter variance, about 4.5 px at 720p
+
+# series(): frames per block, frames a block is filtered before it starts (longer than
+# either filter takes to forget where it started) and how close it must then be to the
+# end of the block before it (normalized units, or relative for the Kalman covariance)
+SERIES_BLOCK = 512
+SERIES_WARMUP = 128
+SERIES_TOLERANCE = 1e-9
+
+
+def _alpha(cutoff, dt):
+    # Smoothing factor of a first-order low-pass at `cutoff` Hz
+    tau = 1.0 / (2.0 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class LandmarkFilter:
+    """Smooths one athlete's landmark frames with the One-Euro or Kalman model."""
+
+    def __init__(self, model="one_euro", min_cutoff=ONE_EURO_MIN_CUTOFF, beta=ONE_EURO_BETA,
+                 d_cutoff=ONE_EURO_D_CUTOFF, accel_noise=KALMAN_ACCEL_NOISE,
+                 measurement_noise=KALMAN_MEASUREMENT_NOISE):
+        if model not in MODELS:
+            raise ValueError(f"Unknown filter model: {model}")
+        self.model = model
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.accel_noise = accel_noise
+        self.measurement_noise = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.position = None   # (33, 3) float64 estimate
+        self.velocity = None   # (33, 3) units per second
+        self.innovation = np.zeros((NUM_LANDMARKS, 3))
+        # Kalman: shared covariance [[p00, p01], [p01, p11]] and innovation std
+        self._p00 = self._p01 = self._p11 = 0.0
+        self.innovation_std = None
+        self._last_time = None
+
+    def update(self, landmarks, timestamp):
+        """Smooth one frame; returns a new (33, 4) float32 array, or None for no pose."""
+        if landmarks is None:
+            return None
+        measured = landmarks[:, :3].astype(np.float64)
+        if self.position is None or timestamp - self._last_time > RESET_GAP:
+            self._start(measured)
+        else:
+            dt = max(timestamp - self._last_time, MIN_DT)
+            state = (self.position, self.velocity, self._p00, self._p01, self._p11)
+            self.innovation, state, s = self._step(state, measured, dt)
+            self.position, self.velocity, self._p00, self._p01, self._p11 = state
+            if self.model == "kalman":
+                self.innovation_std = math.sqrt(s)
+        self._last_time = timestamp
+        out = landmarks.astype(np.float32)
+        out[:, :3] = self.position
+        return out
+
+    def series(self, landmarks, timestamps):
+        """update() over an (n, 33, 4) stack: (smoothed stack, (n, 33, 3) innovations), NaN where no pose."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        smoothed = np.full(landmarks.shape, np.nan, dtype=np.float32)
+        innovations = np.full((len(landmarks), NUM_LANDMARKS, 3), np.nan)
+        posed = ~np.isnan(landmarks[:, 0, 0])
+        # Usually every frame has a pose and a slice spares copying them
+        frames = slice(None) if posed.all() else np.flatnonzero(posed)
+        m = int(posed.sum())
+        if not m:
+            return smoothed, innovations
+        measured = np.empty((m, NUM_LANDMARKS * 3))
+        measured.reshape(m, NUM_LANDMARKS, 3)[...] = landmarks[frames, :, :3]
+        times = timestamps[frames]
+        previous = np.empty(m)
+        previous[0] = np.nan if self.position is None else self._last_time
+        previous[1:] = times[:-1]
+        # Same tests as update(); NaN (no state yet) compares False
+        restart = ~(times - previous <= RESET_GAP)
+        dt = np.where(restart, 1.0, np.maximum(times - previous, MIN_DT))
+
+        positions, innovation, final, s = self._blocks(measured, dt, restart)
+        smoothed[frames] = landmarks[frames]
+        smoothed[frames, :, :3] = positions.reshape(m, NUM_LANDMARKS, 3)
+        innovations[frames] = innovation.reshape(m, NUM_LANDMARKS, 3)
+
+        # Leave the filter as m update() calls would
+        position, velocity, self._p00, self._p01, self._p11 = final
+        self.position = position.reshape(NUM_LANDMARKS, 3)
+        self.velocity = velocity.reshape(NUM_LANDMARKS, 3)
+        self.innovation = innovation[-1].reshape(NUM_LANDMARKS, 3).copy()
+        if self.model == "kalman":
+            self.innovation_std = math.sqrt(s)
+        elif restart.any():
+            self.innovation_std = math.sqrt(2.0 * self.measurement_noise)
+        self._last_time = float(times[-1])
+        return smoothed, innovations
+
+    def _blocks(self, measured, dt, restart):
+        # Filter the (m, 99) measurements in blocks side by side; see the module docstring.
+        # Returns positions and innovations per frame, the final state and the last s.
+        m, width = measured.shape
+        count = -(-m // SERIES_BLOCK)
+        length = -(-m // count)
+        warm = SERIES_WARMUP
+
+        def steps(values, fill=0):
+            # View with [k, b] = frame b * length - warm + k, fill outside 0..m-1; the first
+            # warm steps of a block only settle its state
+            padded = np.full((warm + count * length,) + values.shape[1:], fill, values.dtype)
+            padded[warm:warm + m] = values
+            row = padded.strides[0]
+            return as_strided(padded, (warm + length, count) + values.shape[1:],
+                              (row, length * row) + padded.strides[1:], writeable=False)
+
+        z, step_dt, step_restart = steps(measured), steps(dt[:, None], 1.0), steps(restart, False)
+        # Step k filters frames of blocks low[k]..high[k]-1
+        offset = np.arange(warm + length) - warm
+        low = np.maximum(-(offset // length), 0)
+        high = np.minimum(-((offset - m) // length), count)
+        positions = np.empty((count * length, width))
+        innovation = np.empty_like(positions)
+        s = np.empty((count * length, 1))
+        # The same frames as writeable [k - warm, b] views
+        outputs = [as_strided(a, (length, count, a.shape[1]), (a.strides[0], length * a.strides[0], a.strides[1]))
+                   for a in (positions, innovation, s)]
+
+        def run(first, starts, begin):
+            # Blocks first.. from starts, from step begin; returns their states before
+            # their first frame and at the end
+            state = tuple(np.array(part) for part in starts)
+            settled = state
+            for k in range(begin, warm + length):
+                if k == warm:
+                    settled = tuple(part.copy() for part in state)
+                # Blocks whose frame k is in 0..m-1: all but a few at the start or the end
+                lo, hi = max(low[k] - first, 0), high[k] - first
+                if lo >= hi:
+                    continue
+                rows = slice(lo, hi)
+                out, step, step_s = self._step(tuple(part[rows] for part in state), z[k, first:][rows],
+                                               step_dt[k, first:][rows])
+                for part, value in zip(state, step):
+                    # Positions and velocities were updated in place
+                    if not np.may_share_memory(part, value):
+                        part[rows] = value
+                reset = step_restart[k, first:][rows]
+                if k == 0:
+                    # Warm-ups not reaching back to frame 0 start from their first frame
+                    reset = np.arange(lo, hi) + first > 0
+                if reset.any():
+                    for part, value in zip(state, self._fresh(z[k, first:][rows][reset])):
+                        part[rows][reset] = value
+                    out[reset] = 0.0
+                    step_s = np.where(reset[:, None], 2.0 * self.measurement_noise, step_s)
+                if k >= warm:
+                    for view, value in zip(outputs, (state[0][rows], out, step_s)):
+                        view[k - warm, first:][rows] = value
+            return settled, state
+
+        # Every block starts from the filter's state, most restart from their first frame anyway
+        if self.position is None:
+            initial = self._fresh(measured[:1])
+        else:
+            initial = (self.position.reshape(1, -1), self.velocity.reshape(1, -1),
+                       np.full((1, 1), self._p00), np.full((1, 1), self._p01), np.full((1, 1), self._p11))
+        settled, ends = run(0, tuple(np.repeat(part, count, axis=0) for part in initial), 0)
+        # A block is right when its warm-up ended where the block before it did
+        while True:
+            close = np.logical_and.reduce([np.isclose(a[1:], b[:-1], rtol=SERIES_TOLERANCE,
+                                                      atol=SERIES_TOLERANCE).all(axis=1)
+                                           for a, b in zip(settled, ends)])
+            if close.all():
+                break
+            # Run the rest again from the ends before them: the first one is exact now
+            first = int(np.argmin(close)) + 1
+            again = run(first, tuple(part[first - 1:-1] for part in ends), warm)
+            for whole, part in zip(settled + ends, again[0] + again[1]):
+                whole[first:] = part
+
+        final = (ends[0][-1], ends[1][-1]) + tuple(float(part[-1, 0]) for part in ends[2:])
+        return positions[:m], innovation[:m], final, float(s[m - 1, 0])
+
+    def _fresh(self, measured):
+        # State of a (re)started filter for each row of measured
+        n = len(measured)
+        return (measured.copy(), np.zeros_like(measured), np.full((n, 1), self.measurement_noise),
+                np.zeros((n, 1)), np.full((n, 1), self.accel_noise))
+
+    def _start(self, measured):
+        self.position = measured
+        self.velocity = np.zeros_like(measured)
+        self.innovation = np.zeros_like(measured)
+        self._p00, self._p01, self._p11 = self.measurement_noise, 0.0, self.accel_noise
+        self.innovation_std = math.sqrt(2.0 * self.measurement_noise)
+
+    def _step(self, state, measured, dt):
+        # One frame of the model, for a single athlete (floats) or rows of blocks (column arrays).
+        # Returns (innovation, state, s); position and velocity are updated in place.
+        if self.model == "kalman":
+            return self._kalman(state, measured, dt)
+        return self._one_euro(state, measured, dt)
+
+    def _one_euro(self, state, measured, dt):
+        # In place, a dozen small ufunc calls for all 99 coordinates
+        position, velocity = state[:2]
+        innovation = measured - position
+        a_d = _alpha(self.d_cutoff, dt)
+        velocity *= 1.0 - a_d
+        velocity += (a_d / dt) * innovation
+        # _alpha() of the speed-dependent cutoff, written as c / (1 + c)
+        c = np.abs(velocity)
+        c *= self.beta
+        c += self.min_cutoff
+        c *= 2.0 * math.pi * dt
+        a = c / (c + 1.0)
+        a *= innovation
+        position += a
+        return innovation, state, 0.0
+
+    def _kalman(self, state, measured, dt):
+        position, velocity, p00, p01, p11 = state
+        # Predict: position moves with velocity; white-noise acceleration adds uncertainty
+        q = self.accel_noise
+        p00 = p00 + 2.0 * dt * p01 + dt * dt * p11 + q * dt ** 4 / 4.0
+        p01 = p01 + dt * p11 + q * dt ** 3 / 2.0
+        p11 = p11 + q * dt * dt
+        position += dt * velocity
+
+        # Correct with the measurement
+        s = p00 + self.measurement_noise
+        k0, k1 = p00 / s, p01 / s
+        innovation = measured - position
+        position += k0 * innovation
+        velocity += k1 * innovation
+        return innovation, (position, velocity, (1.0 - k0) * p00, (1.0 - k0) * p01, p11 - k1 * p01), s
@@ -0,0 +1,289 @@
+"""
+frame_ring.py
+Frame hand-off between processes through shared memory.
+
+Session workers are separate processes (sessions.py), and pickling a
+1280x720 BGR frame through a multiprocessing Queue costs more than the
+inference it would offload. A FrameRing is a block of shared memory holding
+a fixed number of preallocated frame slots. One process (the capture side,
+see CameraService.share()) writes every decoded frame into a slot in place.
+Any number of other processes attach by name and lease a slot, reading it
+as a NumPy view for as long as the lease lasts:
+
+    ring = FrameRing.create("station1-cam0", 1280, 720)      # capture process
+    ring.write(image, timestamp)
+
+    ring = FrameRing.attach("station1-cam0", reader=1)       # worker process
+    frame = ring.lease(timeout=1.0)
+    if frame is not None:
+        with frame:
+            results = estimator.process(frame.image)          # a view into shared memory
+            complete = frame.intact                           # False only if the lease was lost
+
+Slots are guarded by a seqlock: a slot's generation is odd while the writer
+fills it and even once the frame is complete, and a reader only accepts a
+frame whose generation was even and unchanged around its read. A lease also
+pins the frame: each reader owns one pin cell (its reader index) and the
+writer does not reuse a pinned slot, so a frame normally stays valid for as
+long as it is leased, however slow the reader. With slots >= readers + 2 the
+writer always finds a free slot, and the newest frame is never overwritten
+while it is still the newest. A reader that crashed holding a lease keeps
+one slot until its index attaches again.
+
+Both are plain NumPy loads and stores, with no lock and no memory fence, so
+the guarantees are best-effort:
+
+  - Pinning is a Dekker-style handshake (each side stores its mark, then
+    loads the other's), and even x86-64 may let that load overtake the
+    store. In that narrow window the writer can reuse a slot a reader has
+    just pinned; frame.intact then turns False.
+  - The seqlock itself relies on the CPU keeping stores in order with
+    stores and loads with loads, which x86-64 does; on weakly ordered CPUs
+    (ARM) a torn read can go unnoticed.
+
+A reader that needs a whole frame copies it and checks frame.intact
+afterwards (SharedFrameSource does), dropping the copy if it turned False.
+
+Nothing in the server shares a camera this way yet: every session worker
+opens its own CameraService (sessions.py), and SharedFrameSource, the one
+reader, copies each frame out. The ring is a building block for a station
+whose sessions share one camera across processes.
+
+Header words are aligned int64/float64, which 64-bit CPUs store and load
+atomically. No lock is shared between the processes, so readers poll for
+new frames (POLL_INTERVAL).
+"""
+
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+DEFAULT_SLOTS = 6
+DEFAULT_READERS = 4
+# Seconds between checks for a new frame while a reader waits
+POLL_INTERVAL = 0.001
+
+# Header words: magic, slots, readers, height, width, channels, latest seq, latest slot
+_MAGIC = 0x4652414D4552494E
+_HEADER_WORDS = 8
+_LATEST_SEQ = 6
+_LATEST_SLOT = 7
+_ALIGN = 64
+
+
+class FrameRingError(Exception):
+    """Raised when a ring cannot be created or attached, or a frame does not fit."""
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class RingFrame:
+    """A leased frame: a read-only view of a ring slot, valid until released."""
+
+    def __init__(self, ring, slot, generation, seq, timestamp, image):
+        self.ring = ring
+        self.slot = slot
+        self.generation = generation
+        self.seq = seq
+        self.timestamp = timestamp
+        self.image = image
+        self.released = False
+
+    @property
+    def intact(self):
+        """True while the slot still holds this frame; check it after reading (see the module docstring)."""
+        return self.ring._generations[self.slot] == self.generation
+
+    def release(self):
+        """Unpin the slot; the writer may reuse it for the next frame."""
+        if not self.released:
+            self.released = True
+            self.ring._unpin(self.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    """Fixed-size ring of frame slots in shared memory; see the module docstring."""
+
+    def __init__(self, shm, owner, reader=None):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self.reader = reader
+        header = np.ndarray((_HEADER_WORDS,), np.int64, shm.buf)
+        if header[0] != _MAGIC:
+            raise FrameRingError(f"{shm.name} is not a frame ring")
+        self._header = header
+        self.slots, self.readers, self.height, self.width, self.channels = (int(v) for v in header[1:6])
+        if reader is not None and not 0 <= reader < self.readers:
+            raise FrameRingError(f"Reader index {reader} out of range, the ring has {self.readers}")
+        offset = _HEADER_WORDS * 8
+        self._generations = np.ndarray((self.slots,), np.int64, shm.buf, offset)
+        offset += self.slots * 8
+        self._seqs = np.ndarray((self.slots,), np.int64, shm.buf, offset)
+        offset += self.slots * 8
+        self._timestamps = np.ndarray((self.slots,), np.float64, shm.buf, offset)
+        offset += self.slots * 8
+        # Height and width of the frame in each slot; smaller frames use the top left corner
+        self._shapes = np.ndarray((self.slots, 2), np.int64, shm.buf, offset)
+        offset += self.slots * 16
+        # Frame seq each reader has leased, 0 for none
+        self._pins = np.ndarray((self.readers,), np.int64, shm.buf, offset)
+        offset = _align(offset + self.readers * 8)
+        self._images = np.ndarray((self.slots, self.height, self.width, self.channels), np.uint8, shm.buf, offset)
+        # Writer side: slot written last; reader side: seq leased last, so only newer frames are read
+        self._slot = int(header[_LATEST_SLOT])
+        self._last_seq = int(header[_LATEST_SEQ])
+
+    @staticmethod
+    def size(width, height, channels=3, slots=DEFAULT_SLOTS, readers=DEFAULT_READERS):
+        """Bytes of shared memory a ring of this shape takes."""
+        offset = _HEADER_WORDS * 8 + slots * 40 + readers * 8
+        return _align(offset) + slots * height * width * channels
+
+    @classmethod
+    def create(cls, name, width, height, channels=3, slots=DEFAULT_SLOTS, readers=DEFAULT_READERS):
+        """Allocate a new ring for frames up to width x height. name=None picks a unique one."""
+        if slots < readers + 2:
+            raise FrameRingError(f"A ring for {readers} readers needs at least {readers + 2} slots")
+        try:
+            shm = shared_memory.SharedMemory(name, create=True,
+                                             size=cls.size(width, height, channels, slots, readers))
+        except OSError as e:
+            raise FrameRingError(f"Frame ring {name} could not be created: {e}") from e
+        header = np.ndarray((_HEADER_WORDS,), np.int64, shm.buf)
+        header[1:] = (slots, readers, height, width, channels, 0, 0)
+        # Written last: attach() refuses the block until the layout is complete
+        header[0] = _MAGIC
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, reader=0):
+        """Open an existing ring as reader number reader (each reading process needs its own)."""
+        try:
+            if sys.version_info >= (3, 13):
+                shm = shared_memory.SharedMemory(name, track=False)
+            else:
+                shm = shared_memory.SharedMemory(name)
+                # Before 3.13 every attaching process registers the block and unlinks it when it exits
+                resource_tracker.unregister(shm._name, "shared_memory")
+        except OSError as e:
+            raise FrameRingError(f"Frame ring {name} could not be attached: {e}") from e
+        try:
+            ring = cls(shm, owner=False, reader=reader)
+        except FrameRingError:
+            shm.close()
+            raise
+        # Whoever had this index before may have died holding a lease
+        ring._pins[reader] = 0
+        return ring
+
+    @property
+    def latest_seq(self):
+        """Seq of the newest complete frame, 0 before the first one."""
+        return int(self._header[_LATEST_SEQ])
+
+    def write(self, image, timestamp):
+        """Copy a frame into the next free slot and publish it. Returns its seq."""
+        h, w = image.shape[:2]
+        if h > self.height or w > self.width or image.size != h * w * self.channels:
+            raise FrameRingError(f"Frame {w}x{h} does not fit the {self.width}x{self.height} ring")
+        slot = self._claim_slot()
+        seq = int(self._header[_LATEST_SEQ]) + 1
+        self._images[slot, :h, :w] = image.reshape(h, w, self.channels)
+        self._shapes[slot] = (h, w)
+        self._timestamps[slot] = timestamp
+        self._seqs[slot] = seq
+        self._generations[slot] += 1
+        self._header[_LATEST_SLOT] = slot
+        self._header[_LATEST_SEQ] = seq
+        self._slot = slot
+        return seq
+
+    def _claim_slot(self):
+        # Mark a free slot as being written (odd generation) and return it
+        latest = int(self._header[_LATEST_SLOT])
+        slot = self._slot
+        while True:
+            slot = (slot + 1) % self.slots
+            # The newest frame stays readable until the next one is complete
+            if slot == latest or self._pinned(slot):
+                continue
+            self._generations[slot] += 1
+            # Pin first, check the generation second on the reader side; mark first, check
+            # the pins second here: a reader pinning this slot meanwhile is seen by one of
+            # us, unless the CPU reorders a store after the next load (see the docstring)
+            if not self._pinned(slot):
+                return slot
+            self._generations[slot] -= 1
+
+    def _pinned(self, slot):
+        seq = int(self._seqs[slot])
+        return seq > 0 and bool((self._pins == seq).any())
+
+    def lease(self, after_seq=None, timeout=1.0):
+        """Pin and return the newest frame with seq > after_seq as a RingFrame, or None on timeout.
+
+        after_seq defaults to the frame this reader leased last. Release the
+        lease (or use it as a context manager) before leasing the next frame.
+        """
+        if self.reader is None:
+            raise FrameRingError("The writer of a ring cannot lease frames; attach() as a reader")
+        if after_seq is None:
+            after_seq = self._last_seq
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self._try_lease(after_seq)
+            if frame is not None:
+                self._last_seq = frame.seq
+                return frame
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def _try_lease(self, after_seq):
+        if self._header[_LATEST_SEQ] <= after_seq:
+            return None
+        slot = int(self._header[_LATEST_SLOT])
+        generation = int(self._generations[slot])
+        seq = int(self._seqs[slot])
+        if generation % 2 or seq <= after_seq:
+            # Being rewritten after all: the next latest slot is read on the next poll
+            return None
+        self._pins[self.reader] = seq
+        # The writer may have picked this slot before it saw the pin
+        if self._generations[slot] != generation:
+            self._pins[self.reader] = 0
+            return None
+        h, w = (int(v) for v in self._shapes[slot])
+        image = self._images[slot, :h, :w]
+        image.flags.writeable = False
+        return RingFrame(self, slot, generation, seq, float(self._timestamps[slot]), image)
+
+    def _unpin(self, seq):
+        if self._pins[self.reader] == seq:
+            self._pins[self.reader] = 0
+
+    def close(self):
+        """Detach from the shared memory; the owner also frees it."""
+        # The views must go before the buffer can be closed
+        self._header = self._generations = self._seqs = self._timestamps = None
+        self._shapes = self._pins = self._images = None
+        self.shm.close()
+        if self.owner:
+            if sys.version_info < (3, 13):
+                # A spawned reader shares this process's tracker and unregistered the name in attach()
+                resource_tracker.register(self.shm._name, "shared_memory")
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,318 @@
+"""
+frame_sources.py
+Where a CameraService's frames come from: a camera, a video file, a folder of images or memory.
+
+A FrameSource hands out BGR frames with their capture timestamps. CameraService
+(camera_service.py) reads it on its capture thread and fans the frames out, so
+the detection loops never know which kind they are reading:
+
+    CameraSource(0)                          device index or stream URL, live
+    VideoFileSource("clips/squat_01.mp4")    a recorded video
+    ImageDirectorySource("frames/", fps=30)  numbered images, sorted by name
+    ArraySource(frames, fps=30)              any iterable of arrays, e.g. a generator
+    SharedFrameSource("cam0", reader=1)      frames another process shares (frame_ring.py), live
+
+A live source is stamped by its clock (time.time unless another is injected)
+when each frame arrives, and a reader that falls behind misses frames. The
+replay sources stamp frame i at start_time + i / fps instead, on the
+recording's own timeline. With speed 0 (REPLAY_SPEED, the default) a replay
+also runs in lockstep: CameraService hands every frame to every reader and
+waits for the slowest one before decoding the next. A replay then goes
+exactly as fast as the pipeline can take it, and scores the same on any
+machine. With speed 1 it is paced like the camera that recorded it (2 twice
+as fast), and readers that fall behind miss frames, as they would live.
+
+Replays keep their recorded frame size (FrameSource.size once open); capture
+resolution requests are ignored, as by a driver that only supports one mode.
+"""
+
+import os
+import time
+
+import cv2
+
+from frame_ring import FrameRing, FrameRingError
+
+# Frame rate assumed for image folders, arrays and files that do not say
+DEFAULT_FPS = 30.0
+# 0: replays run in lockstep as fast as they are read; 1: paced in real time
+REPLAY_SPEED = float(os.environ.get("REPLAY_SPEED", "0"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+# Seconds without a new shared frame before SharedFrameSource gives up, like a camera read failure
+SHARED_READ_TIMEOUT = 2.0
+
+
+class FrameSource:
+    """Base class. A source is opened, read until read() returns None, then closed; it can be reopened."""
+
+    # Frames arrive on their own schedule and readers that fall behind miss some;
+    # False: every frame goes to every reader (CameraService waits for them)
+    realtime = True
+    # Slow to open, worth keeping open between sessions (camera_service.CAMERA_LINGER)
+    lingers = False
+
+    def __init__(self, name):
+        self.name = name
+        # Why open() or read() failed; None when a replay simply ended
+        self.error = None
+        # (width, height) of a source whose frame size cannot be changed, once open
+        self.size = None
+
+    def __str__(self):
+        return str(self.name)
+
+    def open(self, width, height):
+        """Start reading, asking for width x height. Returns False (and sets error) on failure."""
+        raise NotImplementedError
+
+    def read(self):
+        """The next (image, timestamp), or None once there are no more frames or reading failed."""
+        raise NotImplementedError
+
+    def set_resolution(self, width, height):
+        """Ask for another frame size between two reads; sources may ignore it."""
+
+    def close(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """A capture device index or a stream URL, read with cv2.VideoCapture and stamped by clock()."""
+
+    def __init__(self, device=0, clock=time.time):
+        super().__init__(device)
+        self.device = device
+        self.clock = clock
+        # Device indices take a while to open; streams are reconnected on demand
+        self.lingers = isinstance(device, int)
+        self._cap = None
+
+    def open(self, width, height):
+        cap = cv2.VideoCapture(self.device)
+        if not cap.isOpened():
+            cap.release()
+            self.error = "Camera could not be opened"
+            return False
+        self._cap = cap
+        self.error = None
+        self.set_resolution(width, height)
+        return True
+
+    def read(self):
+        ret, image = self._cap.read()
+        if not ret:
+            self.error = "Camera read failed"
+            return None
+        return image, self.clock()
+
+    def set_resolution(self, width, height):
+        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class ReplaySource(FrameSource):
+    """Base of the recorded sources: frame i is stamped start_time + i / fps.
+
+    start_time defaults to clock() when the source is opened. speed 0 replays
+    in lockstep as fast as the frames are read, speed > 0 paces them in real
+    time (2: twice as fast).
+    """
+
+    lingers = False
+
+    def __init__(self, name, fps=None, speed=None, start_time=None, clock=time.time):
+        super().__init__(name)
+        self.fps = fps
+        self.speed = REPLAY_SPEED if speed is None else float(speed)
+        self.start_time = start_time
+        self.clock = clock
+        # Frames handed out since the last open()
+        self.frames_read = 0
+        self._start = None
+        self._paced_from = None
+        # First image, read by open() to learn the frame size
+        self._first = None
+
+    @property
+    def realtime(self):
+        return self.speed > 0
+
+    def open(self, width, height):
+        self.error = None
+        self.frames_read = 0
+        if not self._open():
+            return False
+        self._first = self._next()
+        if self._first is None:
+            self.close()
+            self.error = f"No frames in {self.name}"
+            return False
+        self.size = (self._first.shape[1], self._first.shape[0])
+        self.fps = self.fps or DEFAULT_FPS
+        self._start = self.clock() if self.start_time is None else self.start_time
+        self._paced_from = time.monotonic()
+        return True
+
+    def read(self):
+        if self._first is not None:
+            image, self._first = self._first, None
+        else:
+            image = self._next()
+        if image is None:
+            return None
+        media_time = self.frames_read / self.fps
+        self.frames_read += 1
+        if self.speed > 0:
+            delay = self._paced_from + media_time / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return image, self._start + media_time
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _next(self):
+        # The next image, or None at the end
+        raise NotImplementedError
+
+
+class VideoFileSource(ReplaySource):
+    """A video file; fps is read from the file unless given."""
+
+    def __init__(self, path, fps=None, speed=None, start_time=None, clock=time.time):
+        super().__init__(path, fps, speed, start_time, clock)
+        self.path = path
+        self._cap = None
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            cap.release()
+            self.error = f"Video could not be opened: {self.path}"
+            return False
+        self._cap = cap
+        if not self.fps:
+            file_fps = cap.get(cv2.CAP_PROP_FPS)
+            self.fps = file_fps if 0 < file_fps < 1000 else None
+        return True
+
+    def _next(self):
+        ret, image = self._cap.read()
+        return image if ret else None
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class ImageDirectorySource(ReplaySource):
+    """Every image file of a directory, in name order (zero-padded numbers sort right)."""
+
+    def __init__(self, path, fps=None, speed=None, start_time=None, clock=time.time):
+        super().__init__(path, fps, speed, start_time, clock)
+        self.path = path
+        self._files = None
+
+    def _open(self):
+        try:
+            names = sorted(n for n in os.listdir(self.path) if n.lower().endswith(IMAGE_EXTENSIONS))
+        except OSError as e:
+            self.error = f"Image directory could not be read: {e}"
+            return False
+        if not names:
+            self.error = f"No images in {self.path}"
+            return False
+        self._files = iter(os.path.join(self.path, n) for n in names)
+        return True
+
+    def _next(self):
+        for path in self._files:
+            image = cv2.imread(path)
+            if image is not None:
+                return image
+        return None
+
+
+class ArraySource(ReplaySource):
+    """Frames from memory: a list or (n, h, w, 3) array of BGR images, or a generator of them.
+
+    A generator can only be read once; pass a list or a function returning a
+    new iterator (frames=lambda: make_frames()) to replay it again.
+    """
+
+    def __init__(self, frames, fps=None, speed=None, start_time=None, clock=time.time, name="memory"):
+        super().__init__(name, fps, speed, start_time, clock)
+        self.frames = frames
+        self._iterator = None
+
+    def _open(self):
+        self._iterator = iter(self.frames() if callable(self.frames) else self.frames)
+        return True
+
+    def _next(self):
+        return next(self._iterator, None)
+
+
+class SharedFrameSource(FrameSource):
+    """Frames another process captures and shares through a FrameRing (CameraService.share()).
+
+    reader is this process's reader index in the ring. Frames are copied out
+    of the ring once, because a CameraService keeps them beyond a lease; a
+    reader that can work on a leased view should use FrameRing directly.
+    """
+
+    def __init__(self, name, reader=0):
+        super().__init__(f"shm://{name}/{reader}")
+        self.ring_name = name
+        self.reader = reader
+        self._ring = None
+
+    def open(self, width, height):
+        try:
+            self._ring = FrameRing.attach(self.ring_name, self.reader)
+        except FrameRingError as e:
+            self.error = str(e)
+            return False
+        self.error = None
+        return True
+
+    def read(self):
+        while True:
+            frame = self._ring.lease(timeout=SHARED_READ_TIMEOUT)
+            if frame is None:
+                self.error = "Shared camera stopped sending frames"
+                return None
+            with frame:
+                image = frame.image.copy()
+                # Rare while leased (a pin that raced the writer); a torn copy is dropped for the next frame
+                if frame.intact:
+                    return image, frame.timestamp
+
+    def close(self):
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+
+def open_source(source, clock=time.time):
+    """The FrameSource for a camera_service source: a device index, a stream URL, a directory or a file.
+
+    shm://name or shm://name/reader reads a ring shared by another process. A
+    FrameSource is returned as it is.
+    """
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, str) and source.startswith("shm://"):
+        name, _, reader = source[len("shm://"):].partition("/")
+        return SharedFrameSource(name, int(reader or 0))
+    if isinstance(source, int) or "://" in source:
+        return CameraSource(source, clock)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, clock=clock)
+    return VideoFileSource(source, clock=clock)
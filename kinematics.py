@@ -0,0 +1,90 @@
+"""
+kinematics.py
+Joint angles, distances and visibility on landmark arrays.
+
+A frame of pose landmarks is one (33, 4) float32 array with columns x, y, z,
+visibility (normalized image coordinates, as MediaPipe reports them). Every
+function here also accepts a stack of frames (..., 33, 4) and then returns one
+result per frame, which is what offline analysis uses.
+
+    lm = to_array(results.pose_landmarks)
+    knee = angle(lm, "left_knee")
+    angles = joint_angles(lm)          # all JOINTS at once
+"""
+
+import mediapipe as mp
+import numpy as np
+
+PoseLandmark = mp.solutions.pose.PoseLandmark
+
+NUM_LANDMARKS = 33
+X, Y, Z, VISIBILITY = range(4)
+
+# Angle at the middle landmark, in degrees
+JOINTS = {
+    "left_knee": (PoseLandmark.LEFT_HIP, PoseLandmark.LEFT_KNEE, PoseLandmark.LEFT_ANKLE),
+    "right_knee": (PoseLandmark.RIGHT_HIP, PoseLandmark.RIGHT_KNEE, PoseLandmark.RIGHT_ANKLE),
+    "left_hip": (PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_HIP, PoseLandmark.LEFT_KNEE),
+    "right_hip": (PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_HIP, PoseLandmark.RIGHT_KNEE),
+    "left_elbow": (PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW, PoseLandmark.LEFT_WRIST),
+    "right_elbow": (PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW, PoseLandmark.RIGHT_WRIST),
+}
+JOINT_NAMES = tuple(JOINTS)
+_TRIPLES = np.array([[int(i) for i in joint] for joint in JOINTS.values()], dtype=np.intp)
+
+
+def to_array(pose_landmarks):
+    """results.pose_landmarks (or its .landmark list) -> (33, 4) float32, None if no pose."""
+    if pose_landmarks is None:
+        return None
+    landmarks = getattr(pose_landmarks, "landmark", pose_landmarks)
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks], dtype=np.float32)
+
+
+def _angles(lm, triples):
+    # One gather, then plain ufuncs on the x/y components: a handful of small
+    # NumPy calls per frame however many joints are asked for
+    p = lm[..., triples, :2]
+    x, y = p[..., 0], p[..., 1]
+    bax, bay = x[..., 0] - x[..., 1], y[..., 0] - y[..., 1]
+    bcx, bcy = x[..., 2] - x[..., 1], y[..., 2] - y[..., 1]
+    norm = np.sqrt((bax * bax + bay * bay) * (bcx * bcx + bcy * bcy))
+    cosine = (bax * bcx + bay * bcy) / np.maximum(norm, 1e-12)
+    return np.degrees(np.arccos(np.minimum(np.maximum(cosine, -1.0), 1.0)))
+
+
+_triples_cache = {JOINT_NAMES: _TRIPLES}
+
+
+def joint_angles(lm, names=JOINT_NAMES):
+    """Angles (degrees) of the named JOINTS, in order: shape (len(names),) or (..., len(names))."""
+    triples = _triples_cache.get(names)
+    if triples is None:
+        triples = _triples_cache[names] = _TRIPLES[[JOINT_NAMES.index(n) for n in names]]
+    return _angles(lm, triples)
+
+
+def angle(lm, joint):
+    """Angle of one named joint in degrees."""
+    return joint_angles(lm, (joint,))[..., 0]
+
+
+def angle_between(lm, a, b, c):
+    """Angle at landmark b between landmarks a and c, for joints not in JOINTS."""
+    return _angles(lm, np.array([[int(a), int(b), int(c)]], dtype=np.intp))[..., 0]
+
+
+def distance(lm, i, j, w=1.0, h=1.0):
+    """2D distance between two landmarks; pass w, h to get pixels."""
+    d = (lm[..., int(i), :2] - lm[..., int(j), :2]) * np.array([w, h], dtype=np.float32)
+    return np.linalg.norm(d, axis=-1)
+
+
+def visible(lm, min_visibility=0.5):
+    """Boolean mask of landmarks whose visibility exceeds min_visibility."""
+    return lm[..., VISIBILITY] > min_visibility
+
+
+def to_pixels(lm, w, h):
+    """(..., 33, 2) int pixel coordinates."""
+    return (lm[..., :2] * np.array([w, h], dtype=np.float32)).astype(np.int32)
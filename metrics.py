@@ -0,0 +1,194 @@
+"""
+metrics.py
+Low-overhead timing histograms and counters, exposed in Prometheus text format.
+
+Detection loops run in session worker processes (see sessions.py), so each
+worker records into its own Metrics and the SessionContext ships the
+accumulated deltas to the Flask process about once a second. The Flask process
+merges them into the module-level `registry`, which also times every HTTP
+request and is served at /metrics:
+
+    with ctx.metrics.time("inference"):
+        results = pose.process(rgb)
+    ctx.metrics.track("frames_dropped_total", cap.missed, source=cap, reason="capture")
+
+Gauges a session sets carry a session=<id> label, since several sessions may
+run at once, and are removed from the registry when the session ends.
+
+Recording an observation is a bisect and two increments under a lock, cheap
+enough to leave on in production.
+"""
+
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; spans a fast encode (~1 ms) to a stalled capture
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0, 2.5)
+FLUSH_INTERVAL = 1.0
+
+HELP = {
+    "stage_duration_seconds": "Time spent per frame in each detection stage.",
+    "http_request_duration_seconds": "Time to produce an HTTP response, by endpoint.",
+    "frames_dropped_total": "Frames skipped because a stage could not keep up.",
+    "frames_processed_total": "Frames that went through pose inference.",
+    "queue_depth": "Items waiting in a stage hand-off queue.",
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """Histograms, counters and gauges keyed by metric name and labels."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, gauge_labels=None):
+        self.buckets = buckets
+        # Added to every gauge set here: a session's gauges carry its id, so concurrent
+        # sessions do not overwrite each other and an ended one can be dropped alone
+        self.gauge_labels = dict(gauge_labels or {})
+        # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        # Source object -> {(name, labels): last total seen}
+        self._tracked = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            hist[index] += 1
+            hist[-1] += seconds
+
+    @contextmanager
+    def time(self, stage):
+        """Time a block as one observation of stage_duration_seconds{stage=...}."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+    def inc(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def track(self, name, total, source, **labels):
+        """Feed a running total kept by source (e.g. a LatestQueue's dropped) into a counter.
+
+        Only the growth since the last call for the same source is counted, so
+        a source replaced mid-session (new queues after a recalibration)
+        starts from its own zero.
+        """
+        key = _key(name, labels)
+        seen = self._tracked.setdefault(source, {})
+        last = seen.get(key, 0)
+        if total > last:
+            seen[key] = total
+            self.inc(name, total - last, **labels)
+
+    def set(self, name, value, **labels):
+        key = _key(name, dict(labels, **self.gauge_labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def drop_gauges(self, **labels):
+        """Remove every gauge carrying all of labels, e.g. session=<id> once that session ended."""
+        wanted = set(labels.items())
+        with self._lock:
+            self._gauges = {key: value for key, value in self._gauges.items() if not wanted <= set(key[1])}
+
+    def take(self):
+        """Return everything recorded since the last take() and start over (gauges are kept)."""
+        with self._lock:
+            delta = (self._histograms, self._counters, dict(self._gauges))
+            self._histograms, self._counters = {}, {}
+        return delta
+
+    def merge(self, delta):
+        """Add a take() result from another process."""
+        histograms, counters, gauges = delta
+        with self._lock:
+            for key, values in histograms.items():
+                hist = self._histograms.get(key)
+                if hist is None:
+                    self._histograms[key] = list(values)
+                else:
+                    for i, v in enumerate(values):
+                        hist[i] += v
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            self._gauges.update(gauges)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        lines = []
+        for kind, series in (("histogram", histograms), ("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in series}):
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(series.items()):
+                    if metric != name:
+                        continue
+                    if kind == "histogram":
+                        lines.extend(self._render_histogram(name, labels, value))
+                    else:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _render_histogram(self, name, labels, values):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), values):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}"
+        yield f"{name}_sum{_labels(labels)} {values[-1]}"
+        yield f"{name}_count{_labels(labels)} {cumulative}"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+# Flask-process registry: HTTP timings plus everything merged from session workers
+registry = Metrics()
+
+
+def instrument(app):
+    """Time every request of a Flask app and serve the registry at /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_duration(response):
+        start = getattr(g, "metrics_start", None)
+        if start is not None:
+            # Streaming responses are timed up to the first byte, not for their whole life
+            registry.observe("http_request_duration_seconds", time.perf_counter() - start,
+                             endpoint=request.endpoint or "unknown")
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
@@ -0,0 +1,90 @@
+"""
+pipeline.py
+Building blocks for running capture, inference and render/encode as separate stages.
+
+Stages hand work to each other through LatestQueue, a bounded queue that never
+blocks the producer: when it is full the oldest item is dropped, so a slow
+consumer always picks up the newest frame instead of working through a backlog
+of stale ones. A lockstep file replay (see frame_sources.py) has no frames to
+spare, so its stages put with block=True and wait for room instead.
+
+Overlays are described as plain tuples so the stage that decides *what* to draw
+(the exercise logic) does not have to be the one that draws it:
+    ("text", text, (x, y), scale, color, thickness)
+    ("line", (x1, y1), (x2, y2), color, thickness)
+"""
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class LatestQueue:
+    """Bounded hand-off between two stages where the newest item always wins."""
+
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def put(self, item, block=False):
+        """Add an item. Returns True if an older item was dropped.
+
+        With block=True it waits for room instead of dropping (until the queue is closed).
+        """
+        with self._cond:
+            while block and len(self.items) == self.items.maxlen and not self.closed:
+                self._cond.wait()
+            dropped = len(self.items) == self.items.maxlen
+            if dropped:
+                self.dropped += 1
+            self.items.append(item)
+            self._cond.notify_all()
+            return dropped
+
+    def get(self, timeout=None):
+        """Return the oldest queued item, or None on timeout or once closed and drained."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self.items:
+                if self.closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            item = self.items.popleft()
+            # Wakes a blocked put()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Wake any waiting consumer; get() returns None once the queue is empty."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+def start_stage(name, target, *args):
+    """Run target(*args) on a daemon thread named after the stage."""
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def draw_overlay(image, ops):
+    """Draw overlay ops (see module docstring) onto image in place."""
+    for op in ops:
+        if op[0] == "text":
+            _, text, org, scale, color, thickness = op
+            cv2.putText(image, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        elif op[0] == "line":
+            _, pt1, pt2, color, thickness = op
+            cv2.line(image, pt1, pt2, color, thickness)
+    return image
@@ -0,0 +1,375 @@
+"""
+pose_estimator.py
+MediaPipe Pose on a crop around the athlete instead of the whole frame.
+
+The athlete usually fills a fraction of a 1280x720 frame, yet converting and
+uploading the full frame costs every loop. In ROI mode the estimator keeps a
+box around the person found in the previous frame, crops the frame to it and
+downscales the crop to about the model's input size *before* color conversion.
+The landmarks are mapped back to full-frame normalized coordinates in place, so
+results.pose_landmarks is a drop-in for the full-frame result: to_array, the
+counters' pixel math (calculate_px_per_cm, ground line, reach distance) and
+draw_landmarks on the full frame all work unchanged.
+
+When no pose is found the next frame is searched whole (downscaled), and the
+box only moves when the athlete gets near its edge or shrinks well inside it,
+so MediaPipe's own tracking is not disturbed every frame.
+
+    estimator = PoseEstimator()
+    with ctx.metrics.time("convert"):
+        rgb = estimator.prepare(frame.image)
+    with ctx.metrics.time("inference"):
+        results = estimator.infer(rgb)
+
+Set POSE_ROI=0 to feed MediaPipe the untouched full frame. autotune.py picks
+model_complexity and roi_size per machine through configure().
+
+With POSE_FLOW=1 MediaPipe runs only every few frames. In between, prepare()
+moves the landmarks the counters read (FLOW_LANDMARKS) with pyramidal
+Lucas-Kanade optical flow on a small grayscale copy of the frame, shifts the
+rest with them, and infer() returns those instead of running the model. The
+gap adapts to motion: up to FLOW_MAX_INTERVAL frames while the athlete is
+still, every frame while they move fast. A frame goes back to full inference
+when too few points survive a forward-backward flow check, or when the points
+jump more than FLOW_SPIKE_PX in one frame (a jump takeoff), so fast motion is
+always measured, never extrapolated.
+
+Building a graph and its first inference are slow, so session workers take
+estimators from a per-process pool: warm_up() parks a ready one before any
+session starts, and a session holds one for its length with checkout(), which
+returns it to the pool (acquire() and release()) even when the session fails.
+"""
+
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+mp_pose = mp.solutions.pose
+
+ROI_ENABLED = os.environ.get("POSE_ROI", "1").lower() not in ("0", "false", "no")
+# Longest side of the crop handed to MediaPipe; the landmark model itself runs at 256
+ROI_SIZE = 384
+# Longest side of a whole frame searched for a person that is not tracked yet
+SEARCH_SIZE = 640
+# Padding around the landmark bounding box, as a fraction of its longer side
+ROI_PADDING = 0.3
+# Landmarks closer than this fraction of the box to its edge move the box
+EDGE_SLACK = 0.08
+# A person filling less than this share of the box area shrinks the box
+MIN_FILL = 0.3
+MIN_ROI_PX = 96
+# Estimators kept per process by release(); a session worker runs one session at a time
+POOL_SIZE = 1
+
+FLOW_ENABLED = os.environ.get("POSE_FLOW", "0").lower() not in ("0", "false", "no")
+# Most frames tracked by optical flow between two inferences
+FLOW_MAX_INTERVAL = int(os.environ.get("POSE_FLOW_INTERVAL", "4"))
+# About the longest side of the subsampled frame the flow runs on
+FLOW_SIZE = 640
+FLOW_WINDOW = (21, 21)
+FLOW_LEVELS = 3
+# The flow only looks at the points' bounding box plus this margin (flow pixels)
+FLOW_MARGIN = 48
+# Forward-backward error (flow pixels) above which a point counts as lost
+FLOW_MAX_FB_ERROR = 1.0
+# Share of the visible FLOW_LANDMARKS that must survive, else infer
+FLOW_MIN_TRACKED = 0.7
+# Median motion per frame (full-frame pixels): below CALM the full interval is used,
+# above SPIKE the frame is inferred
+FLOW_CALM_PX = 2.0
+FLOW_SPIKE_PX = 10.0
+# Landmarks the counters read; all other landmarks move with their median shift
+FLOW_LANDMARKS = [
+    mp_pose.PoseLandmark.NOSE,
+    mp_pose.PoseLandmark.LEFT_SHOULDER, mp_pose.PoseLandmark.RIGHT_SHOULDER,
+    mp_pose.PoseLandmark.LEFT_WRIST, mp_pose.PoseLandmark.RIGHT_WRIST,
+    mp_pose.PoseLandmark.LEFT_INDEX, mp_pose.PoseLandmark.RIGHT_INDEX,
+    mp_pose.PoseLandmark.LEFT_HIP, mp_pose.PoseLandmark.RIGHT_HIP,
+    mp_pose.PoseLandmark.LEFT_KNEE, mp_pose.PoseLandmark.RIGHT_KNEE,
+    mp_pose.PoseLandmark.LEFT_ANKLE, mp_pose.PoseLandmark.RIGHT_ANKLE,
+]
+
+# What infer() returns for a frame tracked by optical flow, in place of MediaPipe's results
+TrackedResults = namedtuple("TrackedResults", ["pose_landmarks"])
+
+
+class _Landmark:
+    # The fields of a NormalizedLandmark that to_array and draw_landmarks read
+    __slots__ = ("x", "y", "z", "visibility", "presence")
+
+    def __init__(self, x, y, z, visibility, presence):
+        self.x, self.y, self.z, self.visibility, self.presence = x, y, z, visibility, presence
+
+    def HasField(self, name):
+        return name in ("visibility", "presence")
+
+
+class _LandmarkList:
+    """Stands in for a NormalizedLandmarkList proto; building a proto per tracked frame costs about a millisecond."""
+
+    def __init__(self, landmarks, presence):
+        self.landmark = [_Landmark(x, y, z, v, p) for (x, y, z, v), p in zip(landmarks.tolist(), presence)]
+
+
+class PoseEstimator:
+    """mp_pose.Pose with person-ROI cropping. Landmarks always come back in full-frame coordinates."""
+
+    def __init__(self, roi=ROI_ENABLED, roi_size=ROI_SIZE, search_size=SEARCH_SIZE, model_complexity=1,
+                 min_detection_confidence=0.5, min_tracking_confidence=0.5, flow=FLOW_ENABLED):
+        self.roi = roi
+        self.roi_size = roi_size
+        self.search_size = search_size
+        self.model_complexity = model_complexity
+        self._confidence = (min_detection_confidence, min_tracking_confidence)
+        self.pose = self._build(model_complexity)
+        # (x0, y0, x1, y1) pixel box to crop next, None to search the whole frame
+        self.box = None
+        self._frame_size = None
+        self._region = None
+
+        self.flow = flow
+        # Frames served by optical flow and by MediaPipe, for benchmarks and status
+        self.tracked_frames = 0
+        self.inferred_frames = 0
+        self._gray = None
+        self._tracked = None
+        self._drop_keyframe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pose.close()
+
+    def _build(self, model_complexity):
+        detection, tracking = self._confidence
+        return mp_pose.Pose(model_complexity=model_complexity,
+                            min_detection_confidence=detection, min_tracking_confidence=tracking)
+
+    def configure(self, model_complexity=None, roi_size=None):
+        """Switch model or crop size mid-session. A new model restarts MediaPipe's tracking."""
+        if roi_size is not None:
+            self.roi_size = roi_size
+        if model_complexity is not None and model_complexity != self.model_complexity:
+            # Build first: the heavy model is downloaded on first use and may fail offline
+            pose = self._build(model_complexity)
+            self.pose.close()
+            self.pose = pose
+            self.model_complexity = model_complexity
+            self.box = None
+            self._drop_keyframe()
+
+    def reset(self):
+        """Forget the tracked box; the next frame is searched whole."""
+        self.box = None
+        self._drop_keyframe()
+
+    def prepare(self, image):
+        """Crop and downscale a BGR frame and convert it to the RGB input of infer().
+
+        In flow mode a frame that optical flow can cover returns None instead,
+        and infer(None) returns the tracked landmarks.
+        """
+        if self.flow and self._flow_step(image):
+            return None
+        if not self.roi:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        h, w = image.shape[:2]
+        if self._frame_size != (w, h):
+            self._frame_size = (w, h)
+            self.box = None
+        x0, y0, x1, y1 = self.box or (0, 0, w, h)
+        crop = image[y0:y1, x0:x1]
+        self._region = (x0, y0, x1 - x0, y1 - y0)
+        limit = self.roi_size if self.box else self.search_size
+        scale = limit / max(x1 - x0, y1 - y0)
+        if scale < 1.0:
+            size = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+
+    def infer(self, rgb):
+        """Run MediaPipe on a prepare() result; pose_landmarks are rewritten to full-frame coordinates."""
+        if rgb is None:
+            self.tracked_frames += 1
+            return self._tracked
+        self.inferred_frames += 1
+        results = self._infer(rgb)
+        if self.flow:
+            self._set_keyframe(results.pose_landmarks)
+        return results
+
+    def _infer(self, rgb):
+        results = self.pose.process(rgb)
+        if not self.roi:
+            return results
+        if not results.pose_landmarks:
+            self.box = None
+            return results
+        w, h = self._frame_size
+        x0, y0, cw, ch = self._region
+        sx, sy, sz = cw / w, ch / h, cw / w
+        ox, oy = x0 / w, y0 / h
+        xs, ys = [], []
+        for lm in results.pose_landmarks.landmark:
+            lm.x = ox + lm.x * sx
+            lm.y = oy + lm.y * sy
+            # MediaPipe scales z like x
+            lm.z = lm.z * sz
+            xs.append(lm.x)
+            ys.append(lm.y)
+        self.box = self._next_box(min(xs) * w, min(ys) * h, max(xs) * w, max(ys) * h)
+        return results
+
+    def process(self, image):
+        """prepare() and infer() in one call, for loops that do not time them separately."""
+        return self.infer(self.prepare(image))
+
+    # ---------- Optical flow between inferences ----------
+
+    def _drop_keyframe(self):
+        # Landmarks of the last inference or tracked frame: (33, 4) x, y, z, visibility, and presence
+        self._landmarks = None
+        self._presence = None
+        self._since_inference = 0
+        self._interval = FLOW_MAX_INTERVAL
+
+    def _flow_step(self, image):
+        # Small single-channel copy for this frame; True when the landmarks were tracked onto it.
+        # Every other pixel of the green channel: close to luma, at a fraction of cvtColor + resize
+        h, w = image.shape[:2]
+        step = max(1, round(max(w, h) / FLOW_SIZE))
+        gray = np.ascontiguousarray(image[::step, ::step, 1])
+        previous, self._gray = self._gray, gray
+        if self._frame_size != (w, h):
+            self._frame_size = (w, h)
+            self.box = None
+            self._drop_keyframe()
+        if self._landmarks is None or self._since_inference + 1 >= self._interval:
+            return False
+        return self._track(previous, gray)
+
+    def _set_keyframe(self, pose_landmarks):
+        self._since_inference = 0
+        if not pose_landmarks:
+            self._drop_keyframe()
+            return
+        landmarks = pose_landmarks.landmark
+        self._landmarks = np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks], np.float32)
+        self._presence = [lm.presence for lm in landmarks]
+
+    def _track(self, previous, gray):
+        fh, fw = gray.shape[:2]
+        scale = np.array([fw, fh], np.float32)
+        keyframe = self._landmarks[FLOW_LANDMARKS]
+        visible = keyframe[:, 3] > 0.5
+        if not visible.any():
+            return False
+        # Pyramids are rebuilt on every call, so only around the athlete
+        start = keyframe[:, :2] * scale
+        x0, y0 = np.maximum(start.min(axis=0) - FLOW_MARGIN, 0).astype(int)
+        x1, y1 = np.minimum(start.max(axis=0) + FLOW_MARGIN, scale).astype(int)
+        if x1 - x0 < FLOW_WINDOW[0] or y1 - y0 < FLOW_WINDOW[1]:
+            return False
+        origin = np.array([x0, y0], np.float32)
+        start = (start - origin).reshape(-1, 1, 2)
+        previous, current = previous[y0:y1, x0:x1], gray[y0:y1, x0:x1]
+        lk = dict(winSize=FLOW_WINDOW, maxLevel=FLOW_LEVELS)
+        points, found, _ = cv2.calcOpticalFlowPyrLK(previous, current, start, None, **lk)
+        back, found_back, _ = cv2.calcOpticalFlowPyrLK(current, previous, points, None, **lk)
+        fb_error = np.linalg.norm((back - start).reshape(-1, 2), axis=1)
+        ok = found.ravel().astype(bool) & found_back.ravel().astype(bool) & (fb_error < FLOW_MAX_FB_ERROR)
+        if ok[visible].mean() < FLOW_MIN_TRACKED:
+            return False
+
+        w, h = self._frame_size
+        moved = (points - start).reshape(-1, 2)
+        shift = np.median(moved[ok], axis=0)
+        speed = float(np.median(np.linalg.norm(moved[ok], axis=1))) * w / fw
+        if speed > FLOW_SPIKE_PX:
+            return False
+        # Calm: up to FLOW_MAX_INTERVAL frames between inferences; faster motion, shorter gaps
+        self._interval = FLOW_MAX_INTERVAL if speed <= FLOW_CALM_PX else max(
+            1, int(FLOW_MAX_INTERVAL * FLOW_CALM_PX / speed))
+        self._since_inference += 1
+
+        # Every landmark moves with the median shift; tracked points where the flow put them
+        moved[~ok] = shift
+        landmarks = self._landmarks.copy()
+        landmarks[:, :2] += shift / scale
+        landmarks[FLOW_LANDMARKS, :2] = keyframe[:, :2] + moved / scale
+        self._landmarks = landmarks
+        self._tracked = TrackedResults(_LandmarkList(landmarks, self._presence))
+        if self.roi:
+            (bx0, by0), (bx1, by1) = landmarks[:, :2].min(axis=0) * (w, h), landmarks[:, :2].max(axis=0) * (w, h)
+            self.box = self._next_box(bx0, by0, bx1, by1)
+        return True
+
+    def _next_box(self, bx0, by0, bx1, by1):
+        w, h = self._frame_size
+        box = self.box
+        if box is not None:
+            x0, y0, x1, y1 = box
+            slack_x, slack_y = EDGE_SLACK * (x1 - x0), EDGE_SLACK * (y1 - y0)
+            inside = (bx0 >= x0 + slack_x and bx1 <= x1 - slack_x and
+                      by0 >= y0 + slack_y and by1 <= y1 - slack_y)
+            fill = (bx1 - bx0) * (by1 - by0) / float((x1 - x0) * (y1 - y0))
+            if inside and fill >= MIN_FILL:
+                return box
+        pad = ROI_PADDING * max(bx1 - bx0, by1 - by0, MIN_ROI_PX)
+        x0 = int(max(0, bx0 - pad))
+        y0 = int(max(0, by0 - pad))
+        x1 = int(min(w, bx1 + pad))
+        y1 = int(min(h, by1 + pad))
+        if x1 - x0 < MIN_ROI_PX or y1 - y0 < MIN_ROI_PX:
+            return None
+        return x0, y0, x1, y1
+
+
+_pool = []
+
+
+def _blank_frame():
+    return np.zeros((SEARCH_SIZE // 2, SEARCH_SIZE, 3), np.uint8)
+
+
+def acquire():
+    """A pooled, already warmed-up estimator, or a new one when the pool is empty."""
+    if _pool:
+        return _pool.pop()
+    return PoseEstimator()
+
+
+def release(estimator):
+    """Return an estimator from acquire(). It is cleared for the next session, or closed if the pool is full."""
+    if len(_pool) >= POOL_SIZE:
+        estimator.close()
+        return
+    # A frame without a person drops MediaPipe's tracking, so the next session starts from detection
+    estimator.reset()
+    estimator.process(_blank_frame())
+    estimator.reset()
+    _pool.append(estimator)
+
+
+@contextmanager
+def checkout():
+    """acquire() an estimator for a with block and release() it when the block exits."""
+    estimator = acquire()
+    try:
+        yield estimator
+    finally:
+        release(estimator)
+
+
+def warm_up(model_complexity=1):
+    """Build an estimator and run it once, then pool it. Used as a session worker's warmup."""
+    if not _pool:
+        release(PoseEstimator(model_complexity=model_complexity))
@@ -0,0 +1,69 @@
+from flask import Blueprint, Response, jsonify, request
+import time
+from sessions import requested_event_id
+from streaming import EventStream, SSE_HEADERS
+
+# Sit-and-reach routes. The measurement itself runs in sit_and_reach.py, which
+# needs the station's window, keyboard and mouse for calibration; it reports
+# here through telemetry.py and clients read /reach/status or /reach/events.
+bp = Blueprint("reach", __name__)
+
+INITIAL_STATE = dict(
+    current_reach=0.0,
+    max_reach=None,
+    # New maxima reported since the last reset
+    max_count=0,
+    updated_at=None,
+)
+
+state = dict(INITIAL_STATE)
+events = EventStream("reach", state)
+
+
+def reach_state():
+    # Live while sit_and_reach.py has reported in the last few seconds
+    updated_at = state["updated_at"]
+    return dict(state, active=updated_at is not None and time.time() - updated_at < 5.0)
+
+
+@bp.route('/update_reach', methods=['POST'])
+def update_reach():
+    """Current and best reach in cm, posted by sit_and_reach.py (latest value only)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        current = float(data.get('current_reach', 0.0))
+        best = float(data.get('max_reach', -999.0))
+    except (TypeError, ValueError):
+        return jsonify(success=False, message="Invalid reach values"), 400
+    events.update(dict(current_reach=current, max_reach=best if best > -999.0 else None,
+                       updated_at=time.time()))
+    return jsonify(success=True)
+
+
+@bp.route('/reach/max', methods=['POST'])
+def reach_max():
+    """A new max reach, posted by sit_and_reach.py with the counter event."""
+    data = request.get_json(silent=True) or {}
+    changes = dict(max_count=state["max_count"] + 1, updated_at=time.time())
+    if data.get('reach_cm') is not None:
+        changes['max_reach'] = float(data['reach_cm'])
+    events.update(changes)
+    return jsonify(success=True)
+
+
+@bp.route('/reach/status', methods=['GET'])
+def reach_status():
+    return jsonify(success=True, **reach_state())
+
+
+@bp.route('/reach/events', methods=['GET'])
+def reach_events():
+    """Server-Sent Events: current and max reach pushed as they change"""
+    return Response(events.stream(requested_event_id(request), reach_state),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@bp.route('/reach/reset', methods=['POST'])
+def reach_reset():
+    events.update(dict(INITIAL_STATE))
+    return jsonify(success=True, message="Reach reset")
@@ -0,0 +1,288 @@
+"""
+recording.py
+Compact per-frame landmark recordings of every session, and fast re-scoring.
+
+When an athlete disputes a count we need what the counter saw, not a video.
+A LandmarkRecorder appends one fixed-size record per processed frame: capture
+time, the 33 landmarks quantized to int16 (x, y, z, 1/8192 steps, about 0.15 px
+at 1280) and uint8 (visibility), and the derived signals the counters act on
+(SIGNALS, float16). That is FRAME_DTYPE.itemsize = 242 bytes a frame, about
+7 KB per second at 30 FPS.
+
+A file is a small header (magic, frame offset, then the session's JSON meta:
+exercise, frame size, counter params), the raw records, and an optional JSON
+trailer with meta learned later (e.g. px_per_cm after calibration). The records
+are one NumPy structured array, so load() memory-maps them without parsing and
+a recording cut short by a crash still loads up to its last whole frame.
+
+Re-scoring runs the same counters as the live session over the recorded
+landmarks (counter.score(), see rep_engine.py), with any counter attribute
+overridden, thousands of times faster than real time since there is no
+decoding or inference:
+
+    python recording.py recordings/3f2a9c1b7d0e.lmr
+    python recording.py recordings/*.lmr --set depth_percent=0.7,0.75,0.8
+    python recording.py jump.lmr --set TAKEOFF_MARGIN_PX=20 --set JUMP_COOLDOWN=0.8
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+import kinematics
+from kinematics import PoseLandmark, X, Y, VISIBILITY
+
+RECORDINGS_DIR = os.environ.get("RECORDINGS_DIR", "recordings")
+# RECORD_LANDMARKS=0 turns recording off for every session
+RECORD_ENABLED = os.environ.get("RECORD_LANDMARKS", "1").lower() not in ("0", "false", "no")
+EXTENSION = ".lmr"
+
+MAGIC = b"LMREC\x00\x01\x00"
+# magic, offset of the first frame, length of the header meta JSON
+HEADER = struct.Struct("<8sII")
+TRAILER = struct.Struct("<I8s")
+TRAILER_MAGIC = b"LMRMETA\x00"
+COORD_SCALE = 8192.0
+# Frames buffered before a write, so the frame loop rarely touches the file
+WRITE_BATCH = 64
+
+SIGNALS = ("wrist_y", "knee_angle", "reach_x")
+NUM_LANDMARKS = kinematics.NUM_LANDMARKS
+FRAME_DTYPE = np.dtype([
+    ("t_ms", "<u4"),          # milliseconds since meta["start_time"], the first frame's timestamp
+    ("pose", "u1"),           # 0: no pose on this frame
+    ("xyz", "<i2", (NUM_LANDMARKS, 3)),
+    ("visibility", "u1", (NUM_LANDMARKS,)),
+    ("signals", "<f2", (len(SIGNALS),)),
+])
+
+
+def derive_signals(landmarks):
+    """SIGNALS of one (33, 4) frame: right wrist y, left knee angle, widest wrist-ankle x gap."""
+    lm = landmarks
+    reach = max(abs(lm[PoseLandmark.LEFT_WRIST, X] - lm[PoseLandmark.LEFT_ANKLE, X]),
+                abs(lm[PoseLandmark.RIGHT_WRIST, X] - lm[PoseLandmark.RIGHT_ANKLE, X]))
+    return lm[PoseLandmark.RIGHT_WRIST, Y], kinematics.angle(lm, "left_knee"), reach
+
+
+class LandmarkRecorder:
+    """Appends frames of one session to a .lmr file."""
+
+    def __init__(self, path, exercise, **meta):
+        self.path = path
+        self.frames = 0
+        self.meta = dict(meta, exercise=exercise, version=1, created_at=time.time())
+        self._start = None
+        self._extra = {}
+        self._buffer = np.zeros(WRITE_BATCH, FRAME_DTYPE)
+        self._pending = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "wb")
+        head = json.dumps(self.meta, default=float).encode()
+        # Frames start 8-byte aligned
+        offset = -(-(HEADER.size + len(head)) // 8) * 8
+        self._file.write(HEADER.pack(MAGIC, offset, len(head)) + head.ljust(offset - HEADER.size, b" "))
+
+    @classmethod
+    def for_session(cls, session_id, exercise, **meta):
+        """Recorder at RECORDINGS_DIR/<session_id>.lmr, or None when recording is off."""
+        if not RECORD_ENABLED:
+            return None
+        try:
+            return cls(os.path.join(RECORDINGS_DIR, session_id + EXTENSION), exercise,
+                       session_id=session_id, **meta)
+        except OSError as e:
+            # A full or read-only disk must not stop the session
+            print(f"Landmark recording disabled: {e}")
+            return None
+
+    def append(self, landmarks, timestamp):
+        """Record one frame: a (33, 4) landmark array or None, and its capture timestamp."""
+        if self._start is None:
+            self._start = timestamp
+            self._extra["start_time"] = timestamp
+        row = self._buffer[self._pending]
+        row["t_ms"] = max(0, int(round((timestamp - self._start) * 1000.0)))
+        if landmarks is None:
+            row["pose"] = 0
+            row["xyz"] = 0
+            row["visibility"] = 0
+            row["signals"] = np.nan
+        else:
+            row["pose"] = 1
+            row["xyz"] = np.clip(np.rint(landmarks[:, :3] * COORD_SCALE), -32767, 32767)
+            row["visibility"] = np.rint(np.clip(landmarks[:, VISIBILITY], 0.0, 1.0) * 255.0)
+            row["signals"] = derive_signals(landmarks)
+        self._pending += 1
+        self.frames += 1
+        if self._pending == WRITE_BATCH:
+            self.flush()
+
+    def note(self, **meta):
+        """Meta known only later (px_per_cm after calibration, ...), stored in the trailer."""
+        self._extra.update(meta)
+
+    def flush(self):
+        if self._pending:
+            self._file.write(self._buffer[:self._pending].tobytes())
+            self._pending = 0
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        if self._extra:
+            tail = json.dumps(self._extra, default=float).encode()
+            self._file.write(tail + TRAILER.pack(len(tail), TRAILER_MAGIC))
+        self._file.close()
+
+
+class Recording:
+    """A loaded .lmr file. frames is a read-only memmap of FRAME_DTYPE records."""
+
+    def __init__(self, path, meta, frames):
+        self.path = path
+        self.meta = meta
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def exercise(self):
+        return self.meta.get("exercise")
+
+    @property
+    def duration(self):
+        return float(self.frames["t_ms"][-1]) / 1000.0 if len(self.frames) else 0.0
+
+    def timestamps(self):
+        """Capture times in seconds, as the live counters saw them."""
+        # A recording cut short has no trailer; its creation time is within a frame or two
+        start = self.meta.get("start_time", self.meta.get("created_at", 0.0))
+        return start + self.frames["t_ms"] / 1000.0
+
+    def landmarks(self):
+        """(n, 33, 4) float32 like batch_analysis.extract_landmarks: NaN rows where there was no pose."""
+        out = np.empty((len(self.frames), NUM_LANDMARKS, 4), np.float32)
+        out[..., :3] = self.frames["xyz"] / np.float32(COORD_SCALE)
+        out[..., VISIBILITY] = self.frames["visibility"] / np.float32(255.0)
+        out[self.frames["pose"] == 0] = np.nan
+        return out
+
+    def signal(self, name):
+        return self.frames["signals"][:, SIGNALS.index(name)].astype(np.float32)
+
+
+def load(path):
+    """Open a recording without reading its frames into memory."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        magic, offset, head_len = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a landmark recording: {path}")
+        meta = json.loads(f.read(head_len))
+        end = size
+        if size - offset >= TRAILER.size:
+            f.seek(size - TRAILER.size)
+            tail_len, tail_magic = TRAILER.unpack(f.read(TRAILER.size))
+            if tail_magic == TRAILER_MAGIC:
+                end = size - TRAILER.size - tail_len
+                f.seek(end)
+                meta.update(json.loads(f.read(tail_len)))
+    count = (end - offset) // FRAME_DTYPE.itemsize
+    if count <= 0:
+        return Recording(path, meta, np.zeros(0, FRAME_DTYPE))
+    return Recording(path, meta, np.memmap(path, FRAME_DTYPE, mode="r", offset=offset, shape=(count,)))
+
+
+def rescore(recording, overrides=None, params=None):
+    """Run the recording's exercise counter over its frames; overrides are counter attributes.
+
+    Returns the same summary fields as batch_analysis plus the events.
+    """
+    from batch_analysis import AnalysisError, make_counter, score_landmarks, summarize
+
+    exercise = recording.exercise
+    params = dict(recording.meta.get("params") or {}, **(params or {}))
+    counter, feed = make_counter(exercise, params, None)
+    for name, value in (overrides or {}).items():
+        if not hasattr(counter, name):
+            raise AnalysisError(f"{type(counter).__name__} has no setting {name}")
+        setattr(counter, name, value)
+    w, h = recording.meta.get("width", 1280), recording.meta.get("height", 720)
+    started = time.perf_counter()
+    events = score_landmarks(counter, feed, recording.landmarks(), recording.timestamps(), w, h)
+    elapsed = time.perf_counter() - started
+    return dict(
+        exercise=exercise,
+        frames=len(recording),
+        duration=round(recording.duration, 2),
+        elapsed=round(elapsed, 4),
+        realtime_factor=round(recording.duration / elapsed, 1) if elapsed else None,
+        overrides=overrides or {},
+        events=events,
+        **summarize(exercise, counter),
+    )
+
+
+def _parse_setting(text):
+    name, _, values = text.partition("=")
+    if not name or not values:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE[,VALUE...], got {text!r}")
+    parsed = []
+    for value in values.split(","):
+        try:
+            parsed.append(json.loads(value))
+        except ValueError:
+            parsed.append(value)
+    return name, parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score landmark recordings with the live counters.")
+    parser.add_argument("recordings", nargs="+", help=".lmr files or globs")
+    parser.add_argument("--set", dest="settings", type=_parse_setting, action="append", default=[],
+                        metavar="NAME=V1[,V2...]",
+                        help="counter attribute to override; several values are swept")
+    parser.add_argument("--px-per-cm", type=float, default=None, help="jump: replace the recorded scale")
+    parser.add_argument("--pixels-per-cm", type=float, default=None, help="reach: replace the recorded scale")
+    parser.add_argument("--events", action="store_true", help="include per-rep events in the output")
+    args = parser.parse_args()
+
+    params = {}
+    if args.px_per_cm is not None:
+        params["px_per_cm"] = args.px_per_cm
+    if args.pixels_per_cm is not None:
+        params["pixels_per_cm"] = args.pixels_per_cm
+    names = [name for name, _ in args.settings]
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(v for _, v in args.settings))]
+    paths = [p for pattern in args.recordings for p in (sorted(glob.glob(pattern)) or [pattern])]
+
+    from batch_analysis import AnalysisError
+
+    results = []
+    for path in paths:
+        recording = load(path)
+        for overrides in combinations:
+            try:
+                result = rescore(recording, overrides, params)
+            except AnalysisError as e:
+                parser.exit(1, f"{path}: {e}\n")
+            if not args.events:
+                result.pop("events")
+            results.append(dict(recording=path, **result))
+    print(json.dumps(results, indent=2, default=float))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+rep_engine.py
+Rep counting as threshold crossings with hysteresis, on one frame or a whole session.
+
+Every rep counter is a latch over two conditions on the pose: it is set when
+`rise` holds (squat: knee angle below the depth threshold), reset when `fall`
+holds (knee angle back above the standing threshold), and a rep is the
+set -> reset transition. The two thresholds differ, so jitter around either
+one cannot count twice.
+
+On a whole session the conditions are boolean arrays, the latch state is a
+forward fill of the samples where one of them holds, and the reps are its
+falling edges, all in array operations over the session (the smoothing
+before it steps through frames in blocks, see filters.series()):
+
+    down = latch(knee < depth, knee > standing)
+    _, reps = edges(down)              # indices where a squat completed
+
+Live, Latch.step() applies the same rule to one sample. Both follow one
+definition (a sample where rise holds sets the latch, else one where fall
+holds resets it, else the state is kept), so a session counts the same live
+and offline. Rep cooldowns depend on the previous rep, so they loop over reps,
+not frames. Smoothing happens before, in filters.py.
+"""
+
+import numpy as np
+
+# Latch.step() results
+SET = 1
+RESET = -1
+
+
+def latch(rise, fall, initial=False):
+    """Latch state after each sample: set where rise holds, else reset where fall holds, else kept."""
+    rise = np.asarray(rise, dtype=bool)
+    fall = np.asarray(fall, dtype=bool)
+    decided = rise | fall
+    # Index of the latest sample that decided the state, -1 before the first
+    last = np.maximum.accumulate(np.where(decided, np.arange(len(decided)), -1))
+    return np.where(last >= 0, rise[last], initial)
+
+
+def edges(state, initial=False):
+    """(set indices, reset indices) of a latch state array that started at `initial`."""
+    state = np.asarray(state, dtype=bool)
+    previous = np.concatenate(([bool(initial)], state[:-1]))
+    return np.flatnonzero(state & ~previous), np.flatnonzero(previous & ~state)
+
+
+def runs(mask, carry=0):
+    """Length of the run of True samples ending at each sample; `carry` extends a run already going."""
+    mask = np.asarray(mask, dtype=bool)
+    index = np.arange(len(mask))
+    last_false = np.maximum.accumulate(np.where(mask, -1, index))
+    length = index - last_false
+    # Samples before the first False continue the carried run
+    length[last_false < 0] += carry
+    return np.where(mask, length, 0)
+
+
+def ready(timestamp, last, cooldown):
+    """True when more than `cooldown` seconds have passed since `last`."""
+    return timestamp - last > cooldown
+
+
+def cooldown_filter(times, cooldown, last):
+    """Which of the candidate rep times count under `cooldown`; returns (mask, time of the last counted)."""
+    keep = np.zeros(len(times), dtype=bool)
+    for i, timestamp in enumerate(times.tolist()):
+        if ready(timestamp, last, cooldown):
+            keep[i] = True
+            last = timestamp
+    return keep, last
+
+
+class Latch:
+    """latch() one sample at a time, for live frames."""
+
+    def __init__(self, state=False):
+        self.state = state
+
+    def step(self, rise, fall):
+        """Apply one sample; returns SET or RESET on a transition, else 0."""
+        if rise:
+            new = True
+        elif fall:
+            new = False
+        else:
+            return 0
+        if new == self.state:
+            return 0
+        self.state = new
+        return SET if new else RESET
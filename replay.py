@@ -0,0 +1,120 @@
+"""
+replay.py
+Run a recorded clip through an exercise's live detection loop, as fast as it goes.
+
+batch_analysis.py scores with the same counters, but runs pose inference on
+parallel segments and scores the stitched landmarks in one pass. This instead
+drives the whole session function a /start runs (app1, squat_app, situps_app,
+sit_and_reach) in this process, on a file, an image folder or frames in
+memory instead of a camera (frame_sources.py): capture, auto-tuning,
+recording and the results store included. The
+replay runs in lockstep: every frame is scored, the clip's own timeline is
+used for timing, and nothing waits on a wall clock, so a 10 minute clip
+takes as long as its inference does.
+
+Usage:
+    python replay.py squat clip.mp4
+    python replay.py jump clip.mp4 --px-per-cm 12.4 --height 182
+    python replay.py situp frames/ --fps 30
+    python replay.py reach clip.mp4 --pixels-per-cm 9.8
+    python replay.py squat clip.mp4 --speed 1 --show   # paced like the camera, with the window
+
+Prints the session's final state, the frames read and the realtime factor
+(media seconds per wall-clock second) as JSON.
+
+Replays write to the results database and the landmark recordings like any
+session; point RESULTS_DB elsewhere or set RECORD_LANDMARKS=0 to keep them
+out of the station's records. The pose model is fixed (autotune probes and
+adapts to live frame rates, which makes a replay depend on the machine);
+--autotune turns it back on.
+"""
+
+import argparse
+import json
+import time
+
+import display
+import frame_sources
+import sessions
+
+EXERCISES = ("jump", "squat", "situp", "reach")
+
+
+def _session_target(exercise):
+    # Imported on demand: each app module builds its Flask blueprint and SessionManager
+    if exercise == "jump":
+        import app1
+        return app1.run_jump_detection
+    if exercise == "squat":
+        import squat_app
+        return squat_app.run_squat_detection
+    import situps_app
+    return situps_app.situp_detection_loop
+
+
+def replay(exercise, source, params=None):
+    """Score source (a frame_sources.FrameSource) with the exercise's detection loop.
+
+    params are the session params of a /start (jump: px_per_cm is required, as
+    nobody is there to confirm the A4 paper; reach: pixels_per_cm). Returns a
+    dict with the final state, frames read, wall and media seconds.
+    """
+    params = dict(params or {})
+    params.setdefault("autotune", False)
+    start = time.perf_counter()
+    if exercise == "reach":
+        import sit_and_reach
+        best = sit_and_reach.run(source, pixels_per_cm_fixed=params.get("pixels_per_cm"),
+                                 athlete=params.get("athlete"), autotune_enabled=params["autotune"],
+                                 telemetry=False)
+        state = dict(max_reach_cm=best)
+    else:
+        params["camera"] = source
+        if exercise == "jump":
+            params["cameras"] = [source]
+        state = sessions.run_inline(_session_target(exercise), params,
+                                    message_key="message" if exercise == "situp" else "status_message")
+    wall = time.perf_counter() - start
+    media = source.frames_read / source.fps if source.fps else 0.0
+    return dict(exercise=exercise, source=str(source), state=state, frames=source.frames_read,
+                wall_seconds=round(wall, 3), media_seconds=round(media, 3),
+                realtime_factor=round(media / wall, 2) if wall > 0 else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recording through an exercise's live detection loop.")
+    parser.add_argument("exercise", choices=EXERCISES)
+    parser.add_argument("source", help="video file or image folder")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="0: lockstep, as fast as possible (default); 1: paced in real time")
+    parser.add_argument("--fps", type=float, default=None, help="frame rate of an image folder or a file without one")
+    parser.add_argument("--px-per-cm", type=float, default=None, help="jump: scale from an A4 calibration (required)")
+    parser.add_argument("--pixels-per-cm", type=float, default=None, help="reach: scale, else A4 in the clip")
+    parser.add_argument("--height", type=float, default=170.0, help="jump: athlete height in cm")
+    parser.add_argument("--athlete", default=None)
+    parser.add_argument("--model-complexity", type=int, choices=(0, 1, 2), default=None)
+    parser.add_argument("--autotune", action="store_true", help="let the auto-tuner pick and adapt the model")
+    parser.add_argument("--show", action="store_true", help="open the preview window")
+    args = parser.parse_args()
+
+    if args.exercise == "jump" and args.px_per_cm is None:
+        parser.error("jump needs --px-per-cm: nobody can confirm the A4 paper in a replay")
+    display.set_headless(not args.show)
+
+    params = {"height": args.height, "athlete": args.athlete, "autotune": args.autotune}
+    if args.px_per_cm is not None:
+        params["px_per_cm"] = args.px_per_cm
+    if args.pixels_per_cm is not None:
+        params["pixels_per_cm"] = args.pixels_per_cm
+    if args.model_complexity is not None:
+        params["model_complexity"] = args.model_complexity
+
+    source = frame_sources.open_source(args.source)
+    source.fps = args.fps or source.fps
+    source.speed = args.speed
+    result = replay(args.exercise, source, params)
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
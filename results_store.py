@@ -0,0 +1,213 @@
+"""
+results_store.py
+Durable results of every exercise session, in one SQLite database.
+
+Detection loops must never wait on the disk, so ResultsStore.record() only
+puts the row on a queue. A background writer thread drains it and commits
+whatever has piled up (up to BATCH_SIZE rows) in one transaction. The database
+runs in WAL mode, so the session worker processes and the Flask process can
+write and read it at the same time, and every committed rep survives a crash or
+restart.
+
+    store = get_store()
+    store.start_session(ctx.session_id, "squat", athlete=ctx.params.get("athlete"))
+    event = counter.update(landmarks, frame.timestamp)
+    if event is not None:
+        store.record(ctx.session_id, "squat", event)
+    ...
+    store.end_session(ctx.session_id, dict(count=counter.count))
+
+Rows are indexed by session, by athlete and by exercise; see query().
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+RESULTS_DB = os.environ.get("RESULTS_DB", "results.db")
+BATCH_SIZE = 256
+# How long the writer waits for more rows before committing a partial batch
+BATCH_WINDOW = 0.2
+BUSY_TIMEOUT_MS = 5000
+# Numeric field stored in the indexed value column, by event type
+VALUE_FIELDS = ("height_cm", "reach_cm")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    exercise TEXT NOT NULL,
+    athlete TEXT,
+    station TEXT,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    params TEXT,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    athlete TEXT,
+    type TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    count INTEGER,
+    value REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS results_session ON results (session_id, timestamp);
+CREATE INDEX IF NOT EXISTS results_athlete ON results (athlete, exercise, timestamp);
+CREATE INDEX IF NOT EXISTS results_exercise ON results (exercise, timestamp);
+CREATE INDEX IF NOT EXISTS sessions_athlete ON sessions (athlete, started_at);
+CREATE INDEX IF NOT EXISTS sessions_exercise ON sessions (exercise, started_at);
+"""
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+def connect(path=RESULTS_DB):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only risks the last commits on power loss, never corruption
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class ResultsStore:
+    """Non-blocking front of the results database; one writer thread per process."""
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self.written = 0
+        self.errors = 0
+        self._queue = queue.SimpleQueue()
+        # Athlete of each session started in this process, so record() need not repeat it
+        self._athletes = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, name="results-writer", daemon=True)
+        self._thread.start()
+
+    def start_session(self, session_id, exercise, athlete=None, station=None, params=None):
+        self._athletes[session_id] = athlete
+        self._put(("session", session_id, exercise, athlete, station, time.time(),
+                   json.dumps(params or {}, default=str)))
+
+    def record(self, session_id, exercise, event, athlete=None):
+        """Queue one counter event (the dict a counter's update() returns). Never blocks."""
+        value = next((event[k] for k in VALUE_FIELDS if event.get(k) is not None), None)
+        count = event.get("count")
+        if athlete is None:
+            athlete = self._athletes.get(session_id)
+        self._put(("result", session_id, exercise, athlete, event.get("type", exercise),
+                   float(event.get("timestamp") or time.time()),
+                   None if count is None else int(count),
+                   None if value is None else float(value),
+                   json.dumps(event, default=float)))
+
+    def end_session(self, session_id, summary=None):
+        self._athletes.pop(session_id, None)
+        self._put(("end", session_id, time.time(), json.dumps(summary or {}, default=float)))
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far is committed. For the end of a session, not the frame loop."""
+        done = threading.Event()
+        self._put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        if not self._closed:
+            self._closed = True
+            self._queue.put((_CLOSE,))
+            self._thread.join(timeout)
+
+    def _put(self, row):
+        if self._closed:
+            raise RuntimeError("ResultsStore is closed")
+        self._queue.put(row)
+
+    def _writer(self):
+        conn = connect(self.path)
+        try:
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + BATCH_WINDOW
+                while len(batch) < BATCH_SIZE and batch[-1][0] not in (_FLUSH, _CLOSE):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._commit(conn, [row for row in batch if row[0] not in (_FLUSH, _CLOSE)])
+                for row in batch:
+                    if row[0] is _FLUSH:
+                        row[1].set()
+                if batch[-1][0] is _CLOSE:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, rows):
+        if not rows:
+            return
+        sessions = [row[1:] for row in rows if row[0] == "session"]
+        results = [row[1:] for row in rows if row[0] == "result"]
+        ends = [(ended_at, summary, session_id) for _, session_id, ended_at, summary in
+                (row for row in rows if row[0] == "end")]
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO sessions (session_id, exercise, athlete, station, started_at, params)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", sessions)
+                conn.executemany(
+                    "INSERT INTO results (session_id, exercise, athlete, type, timestamp, count, value, data)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", results)
+                conn.executemany("UPDATE sessions SET ended_at = ?, summary = ? WHERE session_id = ?", ends)
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            # Keep the detection running; the rows are lost but the next batch may succeed
+            self.errors += len(rows)
+            print(f"Results store: could not write {len(rows)} rows: {e}")
+
+
+def query(exercise=None, athlete=None, session_id=None, since=None, limit=500, path=RESULTS_DB):
+    """Recorded results, newest first, as dicts. Uses the session/athlete/exercise indexes."""
+    clauses, args = [], []
+    for column, value in (("exercise", exercise), ("athlete", athlete), ("session_id", session_id)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            args.append(value)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        args.append(float(since))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = connect(path)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            "SELECT session_id, exercise, athlete, type, timestamp, count, value, data FROM results"
+            f"{where} ORDER BY timestamp DESC LIMIT ?", args + [int(limit)]).fetchall()
+    finally:
+        conn.close()
+    return [dict(row, data=json.loads(row["data"]) if row["data"] else None) for row in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(path=RESULTS_DB):
+    """The process-wide ResultsStore, started on first use and flushed at exit."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultsStore(path)
+            atexit.register(_store.close)
+        return _store
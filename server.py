@@ -0,0 +1,92 @@
+"""
+server.py
+Every exercise from one process: jump, squat, sit-up and sit-and-reach.
+
+Each exercise module defines a Flask Blueprint (app1.bp, squat_app.bp,
+situps_app.bp, reach_app.bp). Run on their own (`python squat_app.py`) they
+are wrapped by create_app() alone; this server registers all of them on one
+app instead, so a station imports OpenCV and MediaPipe once, keeps one
+camera registry and one results writer, and the exercises' SessionManagers
+share the standby workers, the worker budget and camera claims (see
+sessions.py).
+
+The routes never collided, so every existing path keeps working. The server
+also listens on the old per-exercise ports (LEGACY_PORTS), so the Flutter app
+and start_all_backends.bat setups need no change:
+
+    python server.py
+"""
+
+import os
+import threading
+
+from flask import Flask
+from flask_cors import CORS
+from werkzeug.serving import make_server
+
+import display
+import metrics
+import sessions
+from batch_analysis import MAX_UPLOAD_BYTES
+
+PORT = 5000
+# Ports of the former app1.py, squat_app.py and situps_app.py processes
+LEGACY_PORTS = (5001, 5002, 5003)
+
+
+def create_app(*blueprints):
+    """Flask app serving the given exercise blueprints, with CORS and /metrics."""
+    app = Flask(__name__)
+    # Werkzeug answers 413 to a larger body before parsing it; the largest requests are /analyze uploads
+    app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+    # Enable CORS for Flutter web app - allow all origins for development
+    CORS(app,
+         resources={r"/*": {"origins": "*"}},
+         supports_credentials=False,
+         methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
+         allow_headers=["Content-Type", "Authorization"])
+    for bp in blueprints:
+        app.register_blueprint(bp)
+    metrics.instrument(app)
+    return app
+
+
+def build_app():
+    # Imported here: the exercise modules import create_app from this one
+    import app1
+    import reach_app
+    import situps_app
+    import squat_app
+    return create_app(app1.bp, squat_app.bp, situps_app.bp, reach_app.bp)
+
+
+def run_standalone(bp, port):
+    """One exercise on its own, as `python app1.py` etc. did before, with the debug reloader."""
+    app = create_app(bp)
+    # The reloader's watcher process never serves; only the child keeps standby workers
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        sessions.prewarm()
+    app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
+
+
+def main(host='0.0.0.0', ports=(PORT,) + LEGACY_PORTS):
+    app = build_app()
+    servers = [make_server(host, port, app, threaded=True) for port in ports]
+    # Warmed-up workers shared by the exercises, so the first /start does not wait for MediaPipe
+    sessions.prewarm()
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, name=f"http-{server.port}", daemon=True).start()
+    if display.HEADLESS:
+        print("Headless mode: no preview windows, confirm calibration with POST /calibration/confirm")
+    print(f"Serving jump, squat, sit-up and sit-and-reach on http://{host}:{', '.join(map(str, ports))}")
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers[1:]:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,556 @@
+"""
+sessions.py
+Per-athlete detection sessions, each running in its own worker process.
+
+A SessionManager runs every session in a worker process, so every session
+has its own MediaPipe graph and its own interpreter and stations do not contend
+for the GIL. The detection function runs inside the worker and talks to the
+Flask process through a SessionContext:
+
+    def run_detection(ctx):
+        while ctx.running:
+            for command, payload in ctx.poll_commands():
+                ...
+            ctx.update(count=count, status_message=message)
+            ctx.publish_frame(vis_frame)
+
+The Flask process keeps the last reported state of every session for /status,
+forwards commands (reset, calibration confirm, ...) from the HTTP handlers and
+re-broadcasts the session's preview frames on its own MjpegBroadcaster. State
+changes are also pushed to Server-Sent Events clients through the session's
+EventStream, so watchers do not have to poll /status.
+
+Spawning a worker, importing MediaPipe and building the first graph takes a
+second or more, so workers are not thrown away: the process keeps
+STANDBY_WORKERS idle ones that already ran the managers' warmups (typically
+pose_estimator.warm_up, one inference on a blank frame), and a finished
+session's worker goes back to that pool with its estimator and, for a while,
+its open camera. A /start only hands an idle worker the session.
+
+When several exercises are served from one process (server.py) their
+managers share that pool, one worker budget and one set of exclusive keys.
+Workers are not tied to an exercise: a squat session can run on the worker
+a jump session just finished on, reusing its Pose model, so a station keeps
+STANDBY_WORKERS models loaded rather than one per exercise. A squat session
+cannot grab the camera a jump session is using; a session reading several
+cameras (a fused jump) holds all of their keys.
+
+Each running session's worker is pinned to SESSION_CORES CPU cores per
+camera, the least loaded ones, so four stations on one PC run on four
+disjoint sets of cores instead of every MediaPipe and OpenCV thread pool
+spreading over the whole machine; throughput then grows with the number of
+cores until they are all taken, after which sessions share the least loaded.
+
+run_inline() runs a detection function in the calling process instead, with
+no Flask app and no worker: scripts and file replays (replay.py) use it.
+"""
+
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+
+import cv2
+
+import camera_service
+import metrics
+from streaming import EventStream, MjpegBroadcaster, JPEG_QUALITY, EVENT_RETRY_MS, format_event
+
+# Finished sessions stay queryable until this many have piled up
+MAX_FINISHED_SESSIONS = 20
+# Worker processes running at once, across every SessionManager of the process
+MAX_SESSIONS = os.cpu_count() or 1
+# Idle, warmed-up workers kept ready for the next /start of any exercise; 0 spawns one per session
+STANDBY_WORKERS = int(os.environ.get("SESSION_STANDBY", "1"))
+# CPU cores a session's worker is pinned to, per camera it reads; 0 leaves placement to the OS.
+# The default splits the machine between four single-camera stations.
+SESSION_CORES = int(os.environ.get("SESSION_CORES", max(1, (os.cpu_count() or 1) // 4)))
+
+# spawn everywhere: forking a process that already runs camera and Flask threads is not safe
+_mp = multiprocessing.get_context("spawn")
+_MISSING = object()
+
+
+class SessionError(Exception):
+    """Raised when a session cannot be started or addressed."""
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def can_pin():
+    """True where pin_to_cores() can set the CPU affinity of a process."""
+    return hasattr(os, "sched_setaffinity") or sys.platform == "win32"
+
+
+def pin_to_cores(cores):
+    """Keep every thread of this process on the given CPU cores. Returns False where unsupported."""
+    cores = sorted(cores)
+    if hasattr(os, "sched_setaffinity"):
+        # Linux affinity is per thread, and MediaPipe's and OpenCV's pools already exist
+        try:
+            threads = [int(tid) for tid in os.listdir("/proc/self/task")]
+        except OSError:
+            threads = [0]
+        for tid in threads:
+            try:
+                os.sched_setaffinity(tid, cores)
+            except OSError:
+                # The thread exited meanwhile
+                pass
+    elif sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        kernel32.SetProcessAffinityMask.argtypes = [wintypes.HANDLE, ctypes.c_size_t]
+        if not kernel32.SetProcessAffinityMask(kernel32.GetCurrentProcess(), sum(1 << c for c in cores)):
+            return False
+    else:
+        return False
+    # One OpenCV worker thread per core it may use
+    cv2.setNumThreads(len(cores))
+    return True
+
+
+class SessionContext:
+    """Worker-side handle: stop flag, command inbox and state/frame outbox."""
+
+    def __init__(self, session_id, params, stop_event, commands, updates, viewers, cores=()):
+        self.session_id = session_id
+        self.params = params
+        # CPU cores this session is pinned to; empty when the OS places it
+        self.cores = cores
+        self.state = {}
+        self._stop_event = stop_event
+        self._commands = commands
+        self._updates = updates
+        self._viewers = viewers
+        # Stage timings, shipped to the Flask process's metrics.registry by update()
+        self.metrics = metrics.Metrics(gauge_labels={"session": session_id})
+        self._metrics_flushed = time.monotonic()
+
+    @property
+    def running(self):
+        return not self._stop_event.is_set()
+
+    def stop(self):
+        """End the session from inside the worker (e.g. 'q' in the preview window)."""
+        self._stop_event.set()
+
+    @property
+    def has_viewers(self):
+        return self._viewers.value > 0
+
+    def poll_commands(self):
+        """Return all pending (command, payload) pairs without blocking."""
+        commands = []
+        while True:
+            try:
+                commands.append(self._commands.get_nowait())
+            except queue.Empty:
+                return commands
+
+    def update(self, **changes):
+        """Report state to the Flask process. Only values that changed are sent."""
+        changed = {k: v for k, v in changes.items() if self.state.get(k, _MISSING) != v}
+        if changed:
+            self.state.update(changed)
+            self._updates.put(("state", changed))
+        if time.monotonic() - self._metrics_flushed >= metrics.FLUSH_INTERVAL:
+            self.flush_metrics()
+
+    def flush_metrics(self):
+        self._metrics_flushed = time.monotonic()
+        self._updates.put(("metrics", self.metrics.take()))
+
+    def publish_frame(self, image):
+        """JPEG-encode a preview frame for /video_feed, only while someone is watching."""
+        if not self.has_viewers:
+            return False
+        with self.metrics.time("encode"):
+            ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if ok:
+            self._updates.put(("frame", buffer.tobytes()))
+        return ok
+
+
+def _worker_main(targets, warmups, jobs, stop_event, commands, updates, viewers):
+    # Pay for imports (unpickling targets imports their modules), model loading and the
+    # first inference before any session needs them
+    for warmup in warmups:
+        try:
+            warmup()
+        except Exception as e:
+            print(f"Session worker warm-up failed: {e}")
+    updates.put(("ready", None))
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        if job[0] == "release":
+            camera_service.release_all()
+            updates.put(("released", None))
+            continue
+        _, target, session_id, params, message_key, cores = job
+        if cores and not pin_to_cores(cores):
+            cores = ()
+        ctx = SessionContext(session_id, params, stop_event, commands, updates, viewers, cores)
+        # Commands sent to the previous session after it ended are not for this one
+        ctx.poll_commands()
+        try:
+            target(ctx)
+        except Exception as e:
+            print(f"Error in session {session_id}: {e}")
+            ctx.update(**{message_key: f"Error: {e}"})
+        finally:
+            ctx.flush_metrics()
+            updates.put(("exit", None))
+
+
+class _InlineUpdates:
+    # Outbox of an inline session: metrics go straight to this process's registry, frames nowhere
+
+    def put(self, update):
+        kind, payload = update
+        if kind == "metrics":
+            metrics.registry.merge(payload)
+
+
+def run_inline(target, params=None, session_id=None, message_key="status_message"):
+    """Run a detection function in this process until it returns; returns the state it last reported.
+
+    Nobody watches the preview and no commands arrive; ctx.stop() still ends
+    the session. Metrics are merged into metrics.registry.
+    """
+    ctx = SessionContext(session_id or uuid.uuid4().hex[:12], dict(params or {}), threading.Event(),
+                         queue.Queue(), _InlineUpdates(), _mp.Value("i", 0, lock=False))
+    try:
+        target(ctx)
+    except Exception as e:
+        print(f"Error in session {ctx.session_id}: {e}")
+        ctx.update(**{message_key: f"Error: {e}"})
+    finally:
+        ctx.flush_metrics()
+        metrics.registry.drop_gauges(session=ctx.session_id)
+    return ctx.state
+
+
+class Worker:
+    """A session worker process. Runs one session at a time, of any of targets, and is reused for the next one."""
+
+    def __init__(self, targets=(), warmups=()):
+        # Cameras of the last session run here; their devices may still be open (camera_service.CAMERA_LINGER)
+        self.keys = frozenset()
+        self.stop_event = _mp.Event()
+        self.commands = _mp.Queue()
+        self.updates = _mp.Queue()
+        self.viewers = _mp.Value("i", 0, lock=False)
+        self._jobs = _mp.Queue()
+        self.process = _mp.Process(
+            target=_worker_main,
+            args=(tuple(targets), tuple(warmups), self._jobs, self.stop_event, self.commands, self.updates,
+                  self.viewers),
+            name="session-worker",
+            daemon=True,
+        )
+        self.process.start()
+
+    @property
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def run(self, target, session_id, params, message_key, cores=()):
+        self.stop_event.clear()
+        self._jobs.put(("run", target, session_id, params, message_key, tuple(cores)))
+
+    def release_camera(self, timeout=2.0):
+        """Close the camera this idle worker keeps open, and wait until it has."""
+        self._jobs.put(("release",))
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.is_alive:
+            try:
+                kind, _ = self.updates.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == "released":
+                self.keys = frozenset()
+                return True
+        return False
+
+    def shutdown(self):
+        self._jobs.put(None)
+
+
+class Session:
+    """Flask-side view of one session, running on a Worker."""
+
+    def __init__(self, session_id, worker, target, params, state, keys=frozenset(), message_key="status_message",
+                 on_finish=None, cores=()):
+        self.id = session_id
+        self.target = target
+        self.params = params
+        self.keys = keys
+        self.cores = cores
+        self.state = dict(state)
+        self.started_at = time.time()
+        self.finished_at = None
+        self.broadcaster = MjpegBroadcaster()
+        self.events = EventStream(session_id, self.state)
+        self.worker = worker
+        self._message_key = message_key
+        self._on_finish = on_finish
+        self._pump = threading.Thread(target=self._pump_updates, name=f"session-{session_id}-pump", daemon=True)
+
+    @property
+    def is_running(self):
+        return self.finished_at is None
+
+    def start(self):
+        self.worker.run(self.target, self.id, self.params, self._message_key, self.cores)
+        self._pump.start()
+
+    def send(self, command, payload=None):
+        """Queue a command for the worker. Returns False if the session already ended."""
+        if not self.is_running:
+            return False
+        self.worker.commands.put((command, payload))
+        return True
+
+    def stop(self):
+        """Ask the worker to end this session. A finished session's worker may be running another one."""
+        if not self.is_running:
+            return False
+        self.worker.stop_event.set()
+        return True
+
+    def update_state(self, **changes):
+        """Change the reported state from the Flask side; pushed to event stream clients too."""
+        self.events.update(changes)
+
+    def join(self, timeout=None):
+        self._pump.join(timeout)
+
+    def _pump_updates(self):
+        worker = self.worker
+        while True:
+            # Let the worker know whether encoding preview frames is worth it
+            worker.viewers.value = self.broadcaster.subscribers
+            try:
+                kind, data = worker.updates.get(timeout=0.2)
+            except queue.Empty:
+                if not worker.is_alive:
+                    break
+                continue
+            if kind == "state":
+                self.events.update(data)
+            elif kind == "frame":
+                self.broadcaster.publish_jpeg(data)
+            elif kind == "metrics":
+                metrics.registry.merge(data)
+            elif kind == "exit":
+                break
+        worker.viewers.value = 0
+        # The session's queue depths and the like mean nothing once it ended
+        metrics.registry.drop_gauges(session=self.id)
+        self.finished_at = time.time()
+        self.events.close({"session_id": self.id})
+        if self._on_finish is not None:
+            self._on_finish(self)
+
+
+# Every manager of the process, for the shared key and worker checks in start()
+_managers = []
+_managers_lock = threading.Lock()
+# Idle workers of every manager, most recently used first
+_idle = []
+# Running sessions pinned to each CPU core
+_core_load = dict.fromkeys(_available_cores(), 0)
+
+
+def _assign_cores(count):
+    # Called with _managers_lock held: the `count` least loaded cores
+    if count <= 0 or not can_pin():
+        return ()
+    cores = sorted(sorted(_core_load, key=lambda core: (_core_load[core], core))[:count])
+    for core in cores:
+        _core_load[core] += 1
+    return tuple(cores)
+
+
+def _release_cores(cores):
+    # Called with _managers_lock held
+    for core in cores:
+        _core_load[core] -= 1
+
+
+def _keys(key):
+    # start()'s key: one exclusive resource, a list of them, or None
+    if key is None:
+        return frozenset()
+    if isinstance(key, (list, tuple, set, frozenset)):
+        return frozenset(key)
+    return frozenset([key])
+
+
+class SessionManager:
+    """Starts, tracks and addresses the sessions of one exercise."""
+
+    def __init__(self, target, initial_state, max_sessions=None, message_key="status_message", warmup=None):
+        self.target = target
+        self.initial_state = initial_state
+        self.message_key = message_key
+        self.max_sessions = max_sessions or MAX_SESSIONS
+        self.warmup = warmup
+        self.sessions = {}
+        # Shared by all managers, so a start() sees the others' sessions consistently
+        self._lock = _managers_lock
+        with _managers_lock:
+            _managers.append(self)
+
+    def start(self, params=None, key=None):
+        """Start a new session and return it.
+
+        key names an exclusive resource (the camera), or is a list of them for
+        a session reading several cameras: only one running session of any
+        exercise may hold a given key. Raises SessionError when a key is taken
+        or the box is at max_sessions (or MAX_SESSIONS overall).
+        """
+        keys = _keys(key)
+        with self._lock:
+            running = [s for s in self.sessions.values() if s.is_running]
+            if any(s.keys & keys for s in running):
+                raise SessionError("Detection already running")
+            others = [s for m in _managers if m is not self for s in m.sessions.values() if s.is_running]
+            if any(s.keys & keys for s in others):
+                raise SessionError("Camera in use by another exercise")
+            if len(running) >= self.max_sessions or len(running) + len(others) >= MAX_SESSIONS:
+                raise SessionError(f"Too many sessions (max {min(self.max_sessions, MAX_SESSIONS)})")
+            worker = _checkout(keys)
+            # Another idle worker may still hold one of these cameras open
+            holders = [w for w in _idle if w.keys & keys]
+            cores = _assign_cores(SESSION_CORES * max(1, len(keys)))
+            session = Session(uuid.uuid4().hex[:12], worker, self.target, params or {}, self.initial_state, keys,
+                              self.message_key, on_finish=self._finished, cores=cores)
+            self.sessions[session.id] = session
+            self._prune()
+        for holder in holders:
+            holder.release_camera()
+        session.start()
+        return session
+
+    def _finished(self, session):
+        worker = session.worker
+        with self._lock:
+            _release_cores(session.cores)
+        if not worker.is_alive:
+            worker.process.join(timeout=5.0)
+            # Not while the session ran: loading MediaPipe next to a live session costs it frames
+            prewarm()
+            return
+        with self._lock:
+            if STANDBY_WORKERS <= 0:
+                worker.shutdown()
+                return
+            worker.keys = session.keys
+            _idle.insert(0, worker)
+            # Too many idle: drop the least recently used
+            while len(_idle) > STANDBY_WORKERS:
+                _idle.pop().shutdown()
+
+    def get(self, session_id=None):
+        """Look a session up by id; without an id, the most recently started one."""
+        with self._lock:
+            if session_id:
+                return self.sessions.get(session_id)
+            return next(reversed(self.sessions.values()), None)
+
+    def running(self):
+        with self._lock:
+            return [s for s in self.sessions.values() if s.is_running]
+
+    def stop_all(self):
+        for session in self.running():
+            session.stop()
+
+    def _prune(self):
+        # Called with self._lock held
+        finished = [s for s in self.sessions.values() if not s.is_running]
+        for session in finished[:max(0, len(finished) - MAX_FINISHED_SESSIONS)]:
+            del self.sessions[session.id]
+
+
+def _new_worker():
+    # Called with _managers_lock held: a worker ready for every manager's sessions
+    targets = [m.target for m in _managers]
+    warmups = list(dict.fromkeys(m.warmup for m in _managers if m.warmup is not None))
+    return Worker(targets, warmups)
+
+
+def _checkout(keys):
+    # Called with _managers_lock held: the idle worker that last used these cameras, else any idle one
+    _idle[:] = [w for w in _idle if w.is_alive]
+    for worker in _idle:
+        if worker.keys & keys:
+            _idle.remove(worker)
+            return worker
+    if _idle:
+        # Prefer a worker holding no camera over one lingering on another device
+        worker = min(_idle, key=lambda w: bool(w.keys))
+        _idle.remove(worker)
+        return worker
+    return _new_worker()
+
+
+def prewarm():
+    """Spawn idle workers up to STANDBY_WORKERS, shared by every SessionManager of this process.
+
+    Call once the server is up and its exercise modules are imported, not at import.
+    """
+    with _managers_lock:
+        _idle[:] = [w for w in _idle if w.is_alive]
+        for _ in range(STANDBY_WORKERS - len(_idle)):
+            _idle.append(_new_worker())
+
+
+def requested_session_id(request):
+    """session_id from the query string or JSON body of a Flask request, if any."""
+    session_id = request.args.get("session_id")
+    if not session_id and request.is_json:
+        session_id = (request.get_json(silent=True) or {}).get("session_id")
+    return session_id
+
+
+def requested_event_id(request):
+    """Last-Event-ID of a reconnecting EventSource, or ?last_event_id= for clients that cannot set headers."""
+    return request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+
+
+def event_stream(session, last_event_id, snapshot):
+    """text/event-stream body following a session's state.
+
+    snapshot(session) builds the full state sent first. Without a session
+    there is nothing to follow: one idle snapshot is sent and the client
+    reconnects after the retry delay.
+    """
+    if session is None:
+        yield f"retry: {EVENT_RETRY_MS}\n\n"
+        yield format_event("snapshot", snapshot(None))
+        return
+    yield from session.events.stream(last_event_id, lambda: snapshot(session))
+
+
+async def async_event_stream(session, last_event_id, snapshot):
+    """event_stream() for async_server.py."""
+    if session is None:
+        yield f"retry: {EVENT_RETRY_MS}\n\n"
+        yield format_event("snapshot", snapshot(None))
+        return
+    async for chunk in session.events.astream(last_event_id, lambda: snapshot(session)):
+        yield chunk
@@ -4,30 +4,52 @@ Real-time Sit-and-Reach measurement using MediaPipe Pose + OpenCV.
 
 Controls:
  - 'c' : enter calibration mode (click two points on a known-length object on the displayed window)
+ - 'a' : forget the saved calibration and auto-calibrate again with an A4 paper
  - 'r' : reset recorded max
  - 'q' : quit
 
 Outputs:
  - on-screen: current reach (cm if calibrated), max reach
- - CSV: "sit_and_reach_results.csv" (timestamp, reach_px, reach_cm)
+ - results database (see results_store.py): every new max reach, kept across runs and resets
+ - landmark recording of the session (see recording.py), to re-score it later
+ - calibration profile for this camera (see calibration.py), reused on the next launch
+
+run() can also score a recorded clip: run(frame_sources.VideoFileSource("reach.mp4"),
+pixels_per_cm=..., telemetry=False) reads it as fast as it can (see replay.py).
 """
 
 import cv2
 import mediapipe as mp
 import numpy as np
+import os
 import time
-import csv
+import uuid
 import webbrowser
-import requests
+import autotune
+import calibration
+from camera_service import get_camera, parse_source
+from counters import ReachCounter
+from pose_estimator import PoseEstimator
+import display
+import recording
+import results_store
+from telemetry import TelemetryClient
+import kinematics
 
 # ---------- USER SETTINGS ----------
-SMOOTH_ALPHA = 0.6          # smoothing factor (0..1). Higher = more responsive, lower = smoother
 MIN_VISIBILITY = 0.20      # threshold for considering a keypoint "
-OUTPUT_CSV = "sit_and_reach_results.csv"
+ATHLETE = None             # athlete id stored with the results, if known
+SERVER_URL = "http://127.0.0.1:5000"  # server.py; shows the reach on /reach/status, best effort
 FRAME_WIDTH = 1280
 FRAME_HEIGHT = 720
+# Device index, CAMERA_SOURCES name, file or stream URL; REACH_CAMERA picks another
+CAMERA = parse_source(os.environ.get("REACH_CAMERA", "0"), local_only=False)
 # -----------------------------------
 
+# Set in run() once the auto-tuner has settled the capture resolution; None with a fixed scale
+PROFILE_KEY = None
+WINDOW_NAME = "Sit-and-Reach (press 'q' to quit)"
+
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
@@ -68,30 +90,12 @@ def mouse_callback(event, x, y, flags, param):
                     print("Invalid input. Please enter a number (e.g. 20.0).")
             px = np.linalg.norm(np.array(calib_points[0]) - np.array(calib_points[1]))
             pixels_per_cm = px / val
+            if PROFILE_KEY is not None:
+                calibration.save_profile(PROFILE_KEY, pixels_per_cm)
             print(f"Calibration complete: {pixels_per_cm:.3f} pixels/cm")
             calibrating = False
             calib_points = []
 
-def landmark_to_pixel(landmark, w, h):
-    """Convert MediaPipe normalized landmark to pixel coords (x,y)."""
-    return int(landmark.x * w), int(landmark.y * h)
-
-def find_best_toe(landmarks):
-    """Return the pixel coords of the best visible toe/foot reference (foot index, heel, ankle)."""
-    candidates = [
-        mp_pose.PoseLandmark.LEFT_FOOT_INDEX,
-        mp_pose.PoseLandmark.RIGHT_FOOT_INDEX,
-        mp_pose.PoseLandmark.LEFT_HEEL,
-        mp_pose.PoseLandmark.RIGHT_HEEL,
-        mp_pose.PoseLandmark.LEFT_ANKLE,
-        mp_pose.PoseLandmark.RIGHT_ANKLE,
-    ]
-    for c in candidates:
-        lm = landmarks[c.value]
-        if lm.visibility > MIN_VISIBILITY:
-            return lm
-    return None
-
 def auto_calibrate(frame):
     """
     Detects an A4 paper in the frame and calculates pixels_per_cm.
@@ -124,45 +128,62 @@ def auto_calibrate(frame):
             return pixels_per_cm
     return None
 
-def main():
-    global WINDOW_NAME, calib_frame, calibrating, pixels_per_cm
-
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("ERROR: Camera could not be opened.")
-        return
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-
-    WINDOW_NAME = "Sit-and-Reach (press 'q' to quit)"
-    cv2.namedWindow(WINDOW_NAME)
+def run(camera=CAMERA, pixels_per_cm_fixed=None, athlete=ATHLETE, autotune_enabled=True, telemetry=True,
+        session_id=None):
+    """Measure sit-and-reach on camera until 'q' or the end of a replayed source.
 
-    # CSV writer
-    csvfile = open(OUTPUT_CSV, "w", newline="")
-    csvw = csv.writer(csvfile)
-    csvw.writerow(["timestamp", "reach_px_smoothed", "reach_cm"])
-
-    reach_cm = 0.0
-    max_reach_cm = -999.0
-    smoothed_reach_px = None
-
-    # Constraint parameters
-    KNEE_LOCK_ANGLE = 165      # degrees, threshold for straight leg
-    ANKLE_DIST_THRESHOLD = 0.05  # normalized, threshold for feet not sliding
-    HIP_Y_THRESHOLD = 0.05     # normalized, threshold for hip lift
-    WRIST_Y_DIFF_THRESHOLD = 0.05  # normalized, hands aligned
-    HOLD_DURATION = 30         # frames (~1 sec at 30fps)
-
-    # State for hold detection
-    hold_frames = 0
-    last_valid_reach = None
+    camera is anything parse_source() accepts, or a frame_sources.FrameSource.
+    pixels_per_cm_fixed skips the A4 step and the calibration profile. Returns
+    the best reach in cm, or None.
+    """
+    global calib_frame, calibrating, pixels_per_cm, PROFILE_KEY
 
-    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
+    camera = parse_source(camera, local_only=False)
+    cap = get_camera(camera, FRAME_WIDTH, FRAME_HEIGHT).subscribe()
+    if cap is None:
+        print("ERROR: Camera could not be opened.")
+        return None
+
+    print("Tuning pose model for this machine...")
+    estimator = PoseEstimator()
+    tuner = autotune.AutoTuner("reach", estimator, enabled=autotune_enabled)
+    level = tuner.startup(cap)
+    print(f"Pose model {level.model_complexity}, capture {tuner.status()['capture_resolution']}")
+
+    if pixels_per_cm_fixed:
+        PROFILE_KEY = None
+        pixels_per_cm = float(pixels_per_cm_fixed)
+    else:
+        PROFILE_KEY = calibration.profile_key("reach", camera, *tuner.capture)
+        pixels_per_cm = None
+        # Same mount as last time: skip the A4 step
+        profile = calibration.load_profile(PROFILE_KEY)
+        if profile is not None:
+            pixels_per_cm = profile["px_per_cm"]
+            print(f"Using saved calibration: {pixels_per_cm:.3f} pixels/cm (press 'a' to recalibrate)")
+
+    display.open_window(WINDOW_NAME)
+
+    # Results go to the shared database on a background thread
+    session_id = session_id or uuid.uuid4().hex[:12]
+    store = results_store.get_store()
+    store.start_session(session_id, "reach", athlete=athlete, station=f"camera:{camera}")
+    recorder = recording.LandmarkRecorder.for_session(session_id, "reach", athlete=athlete,
+                                                      width=tuner.capture[0], height=tuner.capture[1])
+    # Posts happen on a background thread; a slow or missing server never stalls the loop
+    telemetry = TelemetryClient(SERVER_URL) if telemetry else None
+
+    # Same counter as offline batch analysis (counters.py)
+    counter = ReachCounter(min_visibility=MIN_VISIBILITY)
+
+    with estimator as pose:
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Camera read failed. Exiting.")
+            captured = cap.read_frame()
+            if captured is None:
+                print("No more frames." if cap.service.error is None else "Camera read failed. Exiting.")
                 break
+            # Frames are shared with other subscribers, draw on a private copy
+            frame = captured.image.copy()
 
             # --- Draw guide rectangle for paper placement ---
             guide_color = (0, 255, 255)  # Yellow
@@ -184,164 +205,58 @@ def main():
                 detected = auto_calibrate(frame)
                 if detected:
                     pixels_per_cm = detected
+                    if PROFILE_KEY is not None:
+                        calibration.save_profile(PROFILE_KEY, pixels_per_cm)
                     print(f"Auto-calibration complete: {pixels_per_cm:.3f} pixels/cm")
                 else:
                     cv2.putText(frame, "Show an A4 paper to calibrate", (30,60),
                                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2)
-                    cv2.imshow(WINDOW_NAME, frame)
-                    if cv2.waitKey(5) == ord('q'):
+                    if display.show(WINDOW_NAME, frame, delay=5) == ord('q'):
                         break
                     continue
 
             h, w = frame.shape[:2]
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = pose.process(frame_rgb)
+            start = time.perf_counter()
+            results = pose.process(frame)
+            if tuner.record(time.perf_counter() - start):
+                print(f"Pose model {tuner.level.model_complexity} to hold {tuner.target_fps:.0f} FPS")
             vis_frame = frame.copy()
+            landmarks = kinematics.to_array(results.pose_landmarks)
+            # Capture time: a replayed clip is scored on its own timeline
+            now = captured.timestamp
+            if recorder:
+                recorder.append(landmarks, now)
 
             # Draw landmarks for user feedback
             if results.pose_landmarks:
                 mp_drawing.draw_landmarks(vis_frame, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
 
-                lm = results.pose_landmarks.landmark
-
-                # compute hip center x for forward direction guess
-                left_hip = lm[mp_pose.PoseLandmark.LEFT_HIP.value]
-                right_hip = lm[mp_pose.PoseLandmark.RIGHT_HIP.value]
-                hip_center_x = ((left_hip.x + right_hip.x) / 2.0) * w
-
-                # toe reference
-                toe_lm = find_best_toe(lm)
-
-                # fingertip candidates (index finger tips)
-                left_index = lm[mp_pose.PoseLandmark.LEFT_INDEX.value]
-                right_index = lm[mp_pose.PoseLandmark.RIGHT_INDEX.value]
-
-                if toe_lm is not None and (left_index.visibility > MIN_VISIBILITY or right_index.visibility > MIN_VISIBILITY):
-                    toe_px = landmark_to_pixel(toe_lm, w, h)
-                    left_px = landmark_to_pixel(left_index, w, h)
-                    right_px = landmark_to_pixel(right_index, w, h)
-
-                    # choose the hand that is further horizontally from the toe (likely the reaching hand)
-                    dist_left = abs(left_px[0] - toe_px[0]) if left_index.visibility > MIN_VISIBILITY else -1
-                    dist_right = abs(right_px[0] - toe_px[0]) if right_index.visibility > MIN_VISIBILITY else -1
-
-                    if dist_left >= dist_right:
-                        hand_px = left_px
-                        hand_vis = left_index.visibility
-                    else:
-                        hand_px = right_px
-                        hand_vis = right_index.visibility
-
-                    # Determine "forward" direction relative to hip->toe: if toe is to the right of hips, forward is +x
-                    forward_sign = 1 if toe_px[0] > int(hip_center_x) else -1
-
-                    # raw reach in pixels (positive = fingertip beyond toes in forward direction)
-                    reach_px = (hand_px[0] - toe_px[0]) * forward_sign
-
-                    # smooth
-                    if smoothed_reach_px is None:
-                        smoothed_reach_px = reach_px
-                    else:
-                        smoothed_reach_px = SMOOTH_ALPHA * reach_px + (1.0 - SMOOTH_ALPHA) * smoothed_reach_px
-
-                    # convert to cm if calibrated
-                    reach_cm = None
-                    if pixels_per_cm is not None:
-                        reach_cm = smoothed_reach_px / pixels_per_cm
-                        if reach_cm > max_reach_cm:
-                            max_reach_cm = reach_cm
-                            # Notify Flask server to increment counter
-                            try:
-                                requests.post("http://127.0.0.1:5000/increment")
-                            except Exception as e:
-                                print("Could not update counter:", e)
-
-                # (a) Legs straight and flat
-                left_knee = lm[mp_pose.PoseLandmark.LEFT_KNEE.value]
-                right_knee = lm[mp_pose.PoseLandmark.RIGHT_KNEE.value]
-                left_ankle = lm[mp_pose.PoseLandmark.LEFT_ANKLE.value]
-                right_ankle = lm[mp_pose.PoseLandmark.RIGHT_ANKLE.value]
-                left_hip = lm[mp_pose.PoseLandmark.LEFT_HIP.value]
-                right_hip = lm[mp_pose.PoseLandmark.RIGHT_HIP.value]
-
-                def angle(a, b, c):
-                    # Returns angle at point b (in degrees)
-                    ba = np.array([a.x - b.x, a.y - b.y])
-                    bc = np.array([c.x - b.x, c.y - b.y])
-                    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-                    return np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
-
-                left_leg_angle = angle(left_hip, left_knee, left_ankle)
-                right_leg_angle = angle(right_hip, right_knee, right_ankle)
-
-                legs_straight = left_leg_angle > KNEE_LOCK_ANGLE and right_leg_angle > KNEE_LOCK_ANGLE
-
-                # (b) Feet placement
-                ankle_dist = abs(left_ankle.x - right_ankle.x)
-                feet_stable = ankle_dist < ANKLE_DIST_THRESHOLD
-
-                # (c) Hip position
-                hip_y = (left_hip.y + right_hip.y) / 2
-                ankle_y = (left_ankle.y + right_ankle.y) / 2
-                hip_down = abs(hip_y - ankle_y) < HIP_Y_THRESHOLD
-
-                # (d) Hands aligned
-                left_wrist = lm[mp_pose.PoseLandmark.LEFT_WRIST.value]
-                right_wrist = lm[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-                hands_aligned = abs(left_wrist.y - right_wrist.y) < WRIST_Y_DIFF_THRESHOLD
-
-                # (e) Reach forward
-                # Use the wrist further from the ankle (horizontal distance)
-                left_reach = abs(left_wrist.x - left_ankle.x)
-                right_reach = abs(right_wrist.x - right_ankle.x)
-                reach_px = max(left_reach, right_reach) * w  # convert normalized to pixels
-
-                # (f) Hold duration
-                valid_pose = legs_straight and feet_stable and hip_down and hands_aligned
-
-                if valid_pose:
-                    if last_valid_reach is not None and abs(reach_px - last_valid_reach) < 10:
-                        hold_frames += 1
-                    else:
-                        hold_frames = 1
-                        last_valid_reach = reach_px
-                else:
-                    hold_frames = 0
-                    last_valid_reach = None
-
-                # Only count if held for required duration
-                if hold_frames >= HOLD_DURATION:
-                    # Only increment if new max
-                    if pixels_per_cm is not None:
-                        reach_cm = reach_px / pixels_per_cm
-                        if reach_cm > max_reach_cm:
-                            max_reach_cm = reach_cm
-                            try:
-                                requests.post("http://127.0.0.1:5000/increment")
-                            except Exception as e:
-                                print("Could not update counter:", e)
-                    hold_frames = 0  # reset after counting
+                # Notify the server on every new max
+                event = counter.update(landmarks, w, h, pixels_per_cm, now)
+                if event is not None:
+                    store.record(session_id, "reach", event)
+                    if telemetry:
+                        telemetry.event("/reach/max", {"reach_cm": float(event["reach_cm"]),
+                                                       "timestamp": event["timestamp"]})
 
             # Show the current frame with annotations
+            reach_cm = counter.reach_cm
+            max_reach_cm = counter.max_reach_cm
             cv2.putText(vis_frame, f"Max Reach: {max_reach_cm:.1f} cm", (30,60),
                         cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0,255,0), 2, cv2.LINE_AA)
             if pixels_per_cm is not None:
                 cv2.putText(vis_frame, f"Current Reach: {reach_cm:.1f} cm", (30,100),
                             cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255,255,255), 2, cv2.LINE_AA)
-            cv2.imshow(WINDOW_NAME, vis_frame)
+            key = display.show(WINDOW_NAME, vis_frame, delay=5)
 
             # Update reach values on server
             safe_reach_cm = reach_cm if isinstance(reach_cm, (int, float)) and reach_cm is not None else 0.0
             safe_max_reach_cm = max_reach_cm if isinstance(max_reach_cm, (int, float)) and max_reach_cm is not None else -999.0
-            try:
-                requests.post(
-                    "http://127.0.0.1:5000/update_reach",
-                    json={"current_reach": float(safe_reach_cm), "max_reach": float(safe_max_reach_cm)}
-                )
-            except Exception as e:
-                print("Could not update reach values:", e)
+            # Coalesced: only the newest value is sent, however fast frames arrive
+            if telemetry:
+                telemetry.update("/update_reach",
+                                 {"current_reach": float(safe_reach_cm), "max_reach": float(safe_max_reach_cm)})
 
-            key = cv2.waitKey(5)
             if key == ord('q'):
                 break
             elif key == ord('c'):
@@ -349,16 +264,31 @@ def main():
                 calib_frame = frame.copy()
                 cv2.putText(calib_frame, "Calibration mode: Click two points", (50,50),
                             cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2, cv2.LINE_AA)
-                cv2.imshow(WINDOW_NAME, calib_frame)
+                display.show(WINDOW_NAME, calib_frame)
+            elif key == ord('a'):
+                if PROFILE_KEY is not None:
+                    calibration.delete_profile(PROFILE_KEY)
+                pixels_per_cm = None
+                print("Saved calibration cleared, show an A4 paper to recalibrate.")
             elif key == ord('r'):
-                max_reach_cm = -999.0
-                with open(OUTPUT_CSV, "w", newline="") as csvfile:
-                    csvw = csv.writer(csvfile)
-                    csvw.writerow(["timestamp", "reach_px_smoothed", "reach_cm"])
-                print("Recorded max reset.")
+                counter.reset_max()
+                print("Recorded max reset (stored results are kept).")
+
+    cap.close()
+    display.close_all()
+    if telemetry:
+        telemetry.close()
+    best = counter.max_reach_cm if counter.max_reach_cm > -999.0 else None
+    store.end_session(session_id, dict(max_reach_cm=best))
+    if recorder:
+        # The scale the session ended with, for re-scoring
+        recorder.note(params=dict(pixels_per_cm=pixels_per_cm))
+        recorder.close()
+    store.flush()
+    return best
 
-    cap.release()
-    cv2.destroyAllWindows()
+def main():
+    run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,202 +1,251 @@
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+from flask import Blueprint, Response, jsonify, request
 import cv2
 import mediapipe as mp
-import numpy as np
-import threading
 import time
+import autotune
+from batch_analysis import analyze_upload, AnalysisError
+from camera_service import get_camera, parse_source
+from counters import SitupCounter
+import pose_estimator
+import recording
+import results_store
+import kinematics
+from sessions import SessionManager, SessionError, requested_session_id, requested_event_id, event_stream
+from streaming import SSE_HEADERS
+import display
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=False, methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"], allow_headers=["Content-Type", "Authorization"])
+# Sit-up routes; served alone by `python situps_app.py` or by server.py
+bp = Blueprint("situp", __name__)
 
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-# Global variables for sit-up tracking
-situp_count = 0
-current_stage = "down"
-current_angle = 0
-status_message = "Idle"
-detection_active = False
-camera = None
-pose = None
+# State reported by each sit-up session (see sessions.py), in /situp/status field names
+INITIAL_STATE = dict(
+    count=0,
+    angle=0.0,
+    stage="down",
+    message="Idle",
+    **autotune.IDLE_STATUS,
+)
 
-def get_angle(a, b, c):
-    """Calculate angle between three points"""
-    ba = np.array([a.x - b.x, a.y - b.y])
-    bc = np.array([c.x - b.x, c.y - b.y])
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    return np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
-
-def situp_detection_loop():
-    """Main detection loop for sit-ups"""
-    global situp_count, current_stage, current_angle, status_message, detection_active, camera, pose
+def situp_detection_loop(ctx):
+    """Main detection loop for sit-ups, runs inside the session's worker process"""
+    # Same counter as offline batch analysis (counters.py)
+    counter = SitupCounter()
+    status_message = "Detection in progress"
+    camera = None
+    tuner = None
+    store = None
+    recorder = None
+    athlete = ctx.params.get('athlete')
+    
+    def report():
+        ctx.update(
+            count=counter.count,
+            angle=round(float(counter.angle), 2),
+            stage=counter.stage,
+            message=status_message,
+            **(tuner.status() if tuner else {}),
+        )
     
     try:
-        camera = cv2.VideoCapture(0)
-        if not camera.isOpened():
+        source = ctx.params.get('camera', 0)
+        camera = get_camera(source, 1280, 720).subscribe()
+        if camera is None:
             status_message = "Error: Camera not available"
+            report()
             return
         
-        # Set camera resolution
-        camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-        
-        pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
-        
-        DOWN_ANGLE = 160
-        UP_ANGLE = 100
-        SHOULDER_GROUND_Y = 0.85
-        SHOULDER_UP_Y = 0.6
-        last_rep_time = 0
-        
-        status_message = "Sit-up detection started"
-        
-        while detection_active:
-            ret, frame = camera.read()
-            if not ret:
-                break
+        store = results_store.get_store()
+        store.start_session(ctx.session_id, "situp", athlete=athlete, station=f"camera:{source}",
+                            params=ctx.params)
+        with pose_estimator.checkout() as pose:
+            status_message = "Tuning pose model for this machine..."
+            report()
+            tuner = autotune.AutoTuner.from_params("situp", pose, ctx.params)
+            tuner.startup(camera)
+            # Per-frame landmarks, to re-score the session later (recording.py)
+            recorder = recording.LandmarkRecorder.for_session(
+                ctx.session_id, "situp", athlete=athlete, width=tuner.capture[0], height=tuner.capture[1])
             
-            h, w = frame.shape[:2]
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = pose.process(frame_rgb)
+            status_message = counter.status_message
+            report()
             
-            # Draw landmarks on frame
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(frame, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
+            while ctx.running:
+                with ctx.metrics.time("capture"):
+                    frame = camera.read_frame(timeout=1.0)
+                if frame is None:
+                    # A read stall (camera hiccup, device handoff) is waited out; a closed camera ends the session
+                    if not camera.service.is_open:
+                        break
+                    continue
+                ctx.metrics.track("frames_dropped_total", camera.missed, source=camera, reason="capture")
                 
-                lm = results.pose_landmarks.landmark
+                for command, payload in ctx.poll_commands():
+                    if command == "reset":
+                        counter.reset_counts()
+                        counter.status_message = "Reset complete"
                 
-                left_shoulder = lm[mp_pose.PoseLandmark.LEFT_SHOULDER.value]
-                left_hip = lm[mp_pose.PoseLandmark.LEFT_HIP.value]
-                left_knee = lm[mp_pose.PoseLandmark.LEFT_KNEE.value]
-                left_wrist = lm[mp_pose.PoseLandmark.LEFT_WRIST.value]
-                right_wrist = lm[mp_pose.PoseLandmark.RIGHT_WRIST.value]
-                nose = lm[mp_pose.PoseLandmark.NOSE.value]
+                start = time.perf_counter()
+                with ctx.metrics.time("convert"):
+                    frame_rgb = pose.prepare(frame.image)
+                with ctx.metrics.time("inference"):
+                    results = pose.infer(frame_rgb)
+                tuner.record(time.perf_counter() - start)
+                ctx.metrics.inc("frames_processed_total")
                 
-                # Calculate angles
-                sh_hip_knee_angle = get_angle(left_shoulder, left_hip, left_knee)
-                shoulder_y = left_shoulder.y
+                # The rep cooldown runs on capture time, so it holds for recordings too
+                landmarks = kinematics.to_array(results.pose_landmarks)
+                with ctx.metrics.time("postprocess"):
+                    event = counter.update(landmarks, frame.timestamp)
+                if event is not None:
+                    store.record(ctx.session_id, "situp", event)
+                if recorder:
+                    recorder.append(landmarks, frame.timestamp)
+                status_message = counter.status_message
+                report()
                 
-                current_angle = sh_hip_knee_angle
+                # Headless servers skip the overlay entirely
+                if display.HEADLESS:
+                    continue
                 
-                # Check if hands are behind head
-                hands_behind_head = (left_wrist.y < nose.y and right_wrist.y < nose.y)
+                # Frames are shared with other subscribers, draw on a private copy
+                overlay_start = time.perf_counter()
+                vis = frame.image.copy()
+                if results.pose_landmarks:
+                    mp_drawing.draw_landmarks(vis, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
                 
-                # Sit-up logic
-                if hands_behind_head:
-                    if current_stage == "down":
-                        if sh_hip_knee_angle < UP_ANGLE and shoulder_y < SHOULDER_UP_Y:
-                            current_stage = "up"
-                    elif current_stage == "up":
-                        if sh_hip_knee_angle > DOWN_ANGLE and shoulder_y > SHOULDER_GROUND_Y:
-                            if time.time() - last_rep_time > 0.5:
-                                situp_count += 1
-                                last_rep_time = time.time()
-                                status_message = f"Rep {situp_count} completed!"
-                            current_stage = "down"
-            
-            # Display UI elements on frame
-            cv2.putText(frame, f"Sit-ups: {situp_count}", (30, 60),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2, cv2.LINE_AA)
-            cv2.putText(frame, f"Stage: {current_stage.upper()}", (30, 120),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
-            cv2.putText(frame, f"Angle: {current_angle:.1f}°", (30, 160),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
-            cv2.putText(frame, status_message, (30, 200),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-            
-            # Display the frame
-            cv2.imshow("Sit-up Detection", frame)
-            
-            # Press 'q' to quit from the display window
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                detection_active = False
+                # Display UI elements on frame
+                cv2.putText(vis, f"Sit-ups: {counter.count}", (30, 60),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2, cv2.LINE_AA)
+                cv2.putText(vis, f"Stage: {counter.stage.upper()}", (30, 120),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+                cv2.putText(vis, f"Angle: {counter.angle:.1f}°", (30, 160),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+                cv2.putText(vis, status_message, (30, 200),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                
+                ctx.metrics.observe("stage_duration_seconds", time.perf_counter() - overlay_start, stage="overlay")
+                # Display the frame, press 'q' to quit from the display window
+                if display.show("Sit-up Detection", vis) == ord('q'):
+                    ctx.stop()
             
-            time.sleep(0.03)
-        
-        cv2.destroyAllWindows()
-        camera.release()
-        pose.close()
-        status_message = "Detection stopped"
+            status_message = "Detection stopped"
+            report()
     
     except Exception as e:
         status_message = f"Error: {str(e)}"
+        report()
         print(f"Error in detection loop: {str(e)}")
     finally:
-        cv2.destroyAllWindows()
+        display.close_all()
         if camera:
-            camera.release()
-        if pose:
-            pose.close()
+            camera.close()
+        if store:
+            store.end_session(ctx.session_id, dict(count=counter.count))
+            store.flush()
+        if recorder:
+            recorder.close()
 
-@app.route('/situp/start', methods=['POST'])
+def session_state(session):
+    if session is None:
+        return dict(INITIAL_STATE, active=False, session_id=None)
+    return dict(session.state, active=session.is_running, session_id=session.id)
+
+@bp.route('/situp/start', methods=['POST'])
 def start_situp_detection():
     """Start sit-up detection"""
-    global situp_count, current_stage, status_message, detection_active
-    
     try:
-        data = request.get_json() or {}
-        height = data.get('height', 170.0)
-        weight = data.get('weight', 70.0)
-        
-        if detection_active:
-            return jsonify(success=False, message="Detection already running")
+        data = request.get_json(silent=True) or {}
+        # Each start gets its own worker process
+        try:
+            params = {
+                'height': data.get('height', 170.0),
+                'weight': data.get('weight', 70.0),
+                'athlete': data.get('athlete'),
+                **autotune.session_params(data),
+            }
+            # Device index or CAMERA_SOURCES name; files and URLs only through replay.py
+            params['camera'] = parse_source(data.get('camera', 0))
+            session = sessions.start(params, key=params['camera'])
+        except ValueError as e:
+            return jsonify(success=False, message=str(e)), 400
+        except SessionError as e:
+            # Camera or session slots busy
+            return jsonify(success=False, message=str(e)), 409
         
-        situp_count = 0
-        current_stage = "down"
-        status_message = "Detection in progress"
-        detection_active = True
-        
-        # Start detection in background thread
-        detection_thread = threading.Thread(target=situp_detection_loop, daemon=True)
-        detection_thread.start()
-        
-        return jsonify(success=True, message="Sit-up detection started", count=situp_count)
+        return jsonify(success=True, message="Sit-up detection started", count=0, session_id=session.id)
     
     except Exception as e:
         return jsonify(success=False, message=str(e)), 500
 
-@app.route('/situp/status', methods=['GET'])
+@bp.route('/situp/status', methods=['GET'])
 def get_situp_status():
     """Get current sit-up detection status"""
-    return jsonify(
-        success=True,
-        count=situp_count,
-        angle=round(current_angle, 2),
-        stage=current_stage,
-        message=status_message,
-        active=detection_active
-    )
+    session_id = requested_session_id(request)
+    session = sessions.get(session_id)
+    if session_id and session is None:
+        return jsonify(success=False, message="Unknown session"), 404
+    return jsonify(success=True, **session_state(session))
+
+@bp.route('/situp/events', methods=['GET'])
+def situp_events():
+    """Server-Sent Events: sit-up count, stage and message pushed as they change"""
+    session_id = requested_session_id(request)
+    session = sessions.get(session_id)
+    if session_id and session is None:
+        return jsonify(success=False, message="Unknown session"), 404
+    return Response(event_stream(session, requested_event_id(request), session_state),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
 
-@app.route('/situp/stop', methods=['POST'])
+@bp.route('/situp/stop', methods=['POST'])
 def stop_situp_detection():
     """Stop sit-up detection"""
-    global detection_active, status_message
-    
     try:
-        detection_active = False
-        status_message = "Detection stopped by user"
+        session = sessions.get(requested_session_id(request))
+        count = 0
+        if session is not None:
+            session.stop()
+            session.update_state(message="Detection stopped by user")
+            count = session.state["count"]
         
-        return jsonify(success=True, message="Detection stopped", count=situp_count)
+        return jsonify(success=True, message="Detection stopped", count=count)
     
     except Exception as e:
         return jsonify(success=False, message=str(e)), 500
 
-@app.route('/situp/reset', methods=['POST'])
+@bp.route('/situp/reset', methods=['POST'])
 def reset_situp():
     """Reset sit-up counter"""
-    global situp_count, current_stage, status_message
-    
     try:
-        situp_count = 0
-        current_stage = "down"
-        status_message = "Reset complete"
+        session = sessions.get(requested_session_id(request))
+        if session is not None:
+            session.update_state(count=0, stage="down", message="Reset complete")
+            session.send("reset")
         
         return jsonify(success=True, message="Sit-up count reset")
     
     except Exception as e:
         return jsonify(success=False, message=str(e)), 500
 
+@bp.route('/situp/analyze', methods=['POST'])
+def analyze_situps():
+    """Score an uploaded recording (multipart field 'video')."""
+    video = request.files.get('video')
+    if video is None:
+        return jsonify(success=False, message="No video uploaded"), 400
+    try:
+        result = analyze_upload(video, "situp", request.form)
+    except AnalysisError as e:
+        return jsonify(success=False, message=str(e)), e.status
+    return jsonify(success=True, **result)
+
+sessions = SessionManager(situp_detection_loop, INITIAL_STATE, message_key="message",
+                          warmup=pose_estimator.warm_up)
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5003)
+    if display.HEADLESS:
+        print("Headless mode: no preview window")
+    from server import run_standalone
+    run_standalone(bp, 5003)
@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'dart:convert';
 import 'package:http/http.dart' as http;
 import 'package:flutter/foundation.dart' show kIsWeb;
@@ -14,6 +15,65 @@ class ApiService {
   // Check if running on web
   static bool get isWeb => kIsWeb;
 
+  // The browser http client buffers whole responses, so web builds keep polling /status
+  static bool get canStreamEvents => !kIsWeb;
+
+  /// Follows a backend's Server-Sent Events endpoint and yields the full
+  /// session state after every change. Reconnects with Last-Event-ID, so no
+  /// update is lost while the connection is down. Cancel the subscription to stop.
+  Stream<Map<String, dynamic>> watchEvents(String url) async* {
+    final state = <String, dynamic>{};
+    String? lastEventId;
+    while (true) {
+      final client = http.Client();
+      try {
+        final request = http.Request('GET', Uri.parse(url));
+        request.headers['Accept'] = 'text/event-stream';
+        if (lastEventId != null) {
+          request.headers['Last-Event-ID'] = lastEventId;
+        }
+        final response = await client.send(request);
+        String? event;
+        String? id;
+        final data = StringBuffer();
+        await for (final line in response.stream.transform(utf8.decoder).transform(const LineSplitter())) {
+          if (line.isNotEmpty) {
+            if (line.startsWith('event:')) {
+              event = line.substring(6).trim();
+            } else if (line.startsWith('id:')) {
+              id = line.substring(3).trim();
+            } else if (line.startsWith('data:')) {
+              data.write(line.substring(5).trim());
+            }
+            continue;
+          }
+          // A blank line ends one event
+          if (id != null) {
+            lastEventId = id;
+          }
+          if ((event == 'snapshot' || event == 'state') && data.isNotEmpty) {
+            final payload = json.decode(data.toString()) as Map<String, dynamic>;
+            if (event == 'snapshot') {
+              state.clear();
+            }
+            state.addAll(payload);
+            yield Map<String, dynamic>.of(state);
+          }
+          event = null;
+          id = null;
+          data.clear();
+        }
+      } catch (_) {
+        // Server restarting or network drop: reconnect below
+      } finally {
+        client.close();
+      }
+      await Future.delayed(const Duration(seconds: 2));
+    }
+  }
+
+  Stream<JumpData> watchStatus() => watchEvents('$baseUrl/events').map(JumpData.fromJson);
+
   Future<JumpData> getStatus() async {
     try {
       final response = await http.get(
@@ -125,12 +185,38 @@ class ApiService {
     }
   }
 
+  // Confirms the A4 paper calibration (same as pressing SPACE on the server window).
+  // Needed when app1.py runs headless.
+  Future<bool> confirmCalibration() async {
+    try {
+      final response = await http.post(
+        Uri.parse('$baseUrl/calibration/confirm'),
+        headers: {'Content-Type': 'application/json'},
+      ).timeout(
+        const Duration(seconds: 10),
+        onTimeout: () {
+          throw Exception('Connection timeout: Server did not respond in time');
+        },
+      );
+      
+      if (response.statusCode == 200) {
+        final data = json.decode(response.body);
+        return data['success'] == true;
+      }
+      return false;
+    } catch (e) {
+      return false;
+    }
+  }
+
   // Squat detection endpoints (using port 5001 for squat_app.py)
   // For Android emulator use: http://10.0.2.2:5001
   // For iOS simulator use: http://localhost:5001
   // For physical device, use your computer's IP: http://10.117.19.2:5001
   // Squat detection endpoints (using port 5001 for squat_app.py)
   
+  Stream<SquatData> watchSquatStatus() => watchEvents('$squatBaseUrl/squat/events').map(SquatData.fromJson);
+
   Future<SquatData> getSquatStatus() async {
     try {
       final response = await http.get(
@@ -243,6 +329,8 @@ class ApiService {
     }
   }
 
+  Stream<Map<String, dynamic>> watchSitupStatus() => watchEvents('$situpsBaseUrl/situp/events');
+
   Future<bool> startSitupDetection({double height = 170.0, double weight = 70.0}) async {
     try {
       final response = await http.post(
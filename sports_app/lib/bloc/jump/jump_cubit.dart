@@ -6,11 +6,17 @@ import 'jump_state.dart';
 class JumpCubit extends Cubit<JumpState> {
   final ApiService _apiService;
   Timer? _timer;
+  StreamSubscription<JumpData>? _events;
 
   JumpCubit(this._apiService) : super(JumpState());
 
   void startPolling() {
-    _timer?.cancel();
+    stopPolling();
+    if (ApiService.canStreamEvents) {
+      // Pushed by the server as jumps happen; no request load while nothing changes
+      _events = _apiService.watchStatus().listen(_emitData);
+      return;
+    }
     _fetchData();
     _timer = Timer.periodic(const Duration(seconds: 1), (_) {
       _fetchData();
@@ -19,19 +25,24 @@ class JumpCubit extends Cubit<JumpState> {
 
   void stopPolling() {
     _timer?.cancel();
+    _events?.cancel();
+    _events = null;
+  }
+
+  void _emitData(JumpData data) {
+    emit(state.copyWith(
+      jumpCount: data.jumpCount,
+      lastJumpHeight: data.lastJumpHeight,
+      maxJumpHeight: data.maxJumpHeight,
+      statusMessage: data.statusMessage,
+      isRunning: data.isRunning,
+      errorMessage: null,
+    ));
   }
 
   Future<void> _fetchData() async {
     try {
-      final data = await _apiService.getStatus();
-      emit(state.copyWith(
-        jumpCount: data.jumpCount,
-        lastJumpHeight: data.lastJumpHeight,
-        maxJumpHeight: data.maxJumpHeight,
-        statusMessage: data.statusMessage,
-        isRunning: data.isRunning,
-        errorMessage: null,
-      ));
+      _emitData(await _apiService.getStatus());
     } catch (e) {
       emit(state.copyWith(errorMessage: e.toString()));
     }
@@ -55,6 +66,15 @@ class JumpCubit extends Cubit<JumpState> {
     }
   }
 
+  Future<void> confirmCalibration() async {
+    final success = await _apiService.confirmCalibration();
+    if (success) {
+      _fetchData();
+    } else {
+      emit(state.copyWith(errorMessage: "Calibration not confirmed: no paper detected"));
+    }
+  }
+
   Future<void> resetData() async {
     final success = await _apiService.resetData();
     if (success) {
@@ -66,7 +86,7 @@ class JumpCubit extends Cubit<JumpState> {
 
   @override
   Future<void> close() {
-    _timer?.cancel();
+    stopPolling();
     return super.close();
   }
 }
@@ -6,6 +6,7 @@ import 'dart:async';
 class SitupCubit extends Cubit<SitupState> {
   final ApiService apiService;
   Timer? _statusTimer;
+  StreamSubscription<Map<String, dynamic>>? _events;
 
   SitupCubit({required this.apiService}) : super(const SitupState());
 
@@ -41,6 +42,7 @@ class SitupCubit extends Cubit<SitupState> {
   Future<void> stopDetection() async {
     try {
       _statusTimer?.cancel();
+      _events?.cancel();
       final result = await apiService.stopSitupDetection();
       
       if (result) {
@@ -74,6 +76,12 @@ class SitupCubit extends Cubit<SitupState> {
 
   void _startStatusPolling() {
     _statusTimer?.cancel();
+    if (ApiService.canStreamEvents) {
+      // Pushed by the server on every rep and stage change
+      _events?.cancel();
+      _events = apiService.watchSitupStatus().listen(_emitStatus);
+      return;
+    }
     _statusTimer = Timer.periodic(const Duration(milliseconds: 500), (_) {
       fetchStatus();
     });
@@ -81,24 +89,27 @@ class SitupCubit extends Cubit<SitupState> {
 
   Future<void> fetchStatus() async {
     try {
-      final statusData = await apiService.getSitupStatus();
-      
-      emit(state.copyWith(
-        situpCount: statusData['count'] ?? 0,
-        currentAngle: (statusData['angle'] ?? 0).toDouble(),
-        currentStage: statusData['stage'] ?? 'down',
-        statusMessage: statusData['message'] ?? 'Monitoring...',
-        isRunning: statusData['active'] ?? false,
-        errorMessage: null,
-      ));
+      _emitStatus(await apiService.getSitupStatus());
     } catch (e) {
       emit(state.copyWith(errorMessage: e.toString()));
     }
   }
 
+  void _emitStatus(Map<String, dynamic> statusData) {
+    emit(state.copyWith(
+      situpCount: statusData['count'] ?? 0,
+      currentAngle: (statusData['angle'] ?? 0).toDouble(),
+      currentStage: statusData['stage'] ?? 'down',
+      statusMessage: statusData['message'] ?? 'Monitoring...',
+      isRunning: statusData['active'] ?? false,
+      errorMessage: null,
+    ));
+  }
+
   @override
   Future<void> close() {
     _statusTimer?.cancel();
+    _events?.cancel();
     return super.close();
   }
 }
@@ -6,6 +6,7 @@ import '../api_service.dart';
 class SquatCubit extends Cubit<SquatState> {
   final ApiService apiService;
   Timer? _statusTimer;
+  StreamSubscription<SquatData>? _events;
 
   SquatCubit({required this.apiService}) : super(const SquatState()) {
     // Start polling for status updates
@@ -14,6 +15,12 @@ class SquatCubit extends Cubit<SquatState> {
 
   void _startStatusPolling() {
     _statusTimer?.cancel();
+    if (ApiService.canStreamEvents) {
+      // Pushed by the server on every rep and stage change
+      _events?.cancel();
+      _events = apiService.watchSquatStatus().listen(_emitStatus);
+      return;
+    }
     _statusTimer = Timer.periodic(const Duration(seconds: 1), (_) {
       fetchStatus();
     });
@@ -96,24 +103,28 @@ class SquatCubit extends Cubit<SquatState> {
 
   Future<void> fetchStatus() async {
     try {
-      final data = await apiService.getSquatStatus();
-      emit(state.copyWith(
-        squatCount: data.squatCount,
-        currentStage: data.currentStage,
-        currentAngle: data.currentAngle,
-        statusMessage: data.statusMessage,
-        isRunning: data.isRunning,
-        errorMessage: null,
-      ));
+      _emitStatus(await apiService.getSquatStatus());
     } catch (e) {
       // Don't emit error on status fetch failure to avoid disrupting UI
       // The error will be shown when user tries to start/stop
     }
   }
 
+  void _emitStatus(SquatData data) {
+    emit(state.copyWith(
+      squatCount: data.squatCount,
+      currentStage: data.currentStage,
+      currentAngle: data.currentAngle,
+      statusMessage: data.statusMessage,
+      isRunning: data.isRunning,
+      errorMessage: null,
+    ));
+  }
+
   @override
   Future<void> close() {
     _statusTimer?.cancel();
+    _events?.cancel();
     return super.close();
   }
 }
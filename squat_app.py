@@ -1,194 +1,215 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Blueprint, Response, request, jsonify
 import cv2
 import mediapipe as mp
-import numpy as np
-import threading
 import time
-
-app = Flask(__name__)
-
-# Enable CORS for Flutter web app - allow all origins for development
-CORS(app, 
-     resources={r"/*": {"origins": "*"}},
-     supports_credentials=False,
-     methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-     allow_headers=["Content-Type", "Authorization"])  # Enable CORS for Flutter app
-
-# Global state for squat detection
-squat_count = 0
-current_stage = "up"
-current_angle = 0.0
-status_message = "Ready to start"
-is_running = False
-camera_thread = None
-cap = None
+import autotune
+from batch_analysis import analyze_upload, AnalysisError
+from camera_service import get_camera, parse_source
+from counters import SquatCounter
+import pose_estimator
+import recording
+import results_store
+import kinematics
+from sessions import SessionManager, SessionError, requested_session_id, requested_event_id, event_stream
+from streaming import SSE_HEADERS
+import display
+
+# Squat routes; served alone by `python squat_app.py` or by server.py
+bp = Blueprint("squat", __name__)
+
+# State reported by each squat session (see sessions.py)
+INITIAL_STATE = dict(
+    squat_count=0,
+    current_stage="up",
+    current_angle=0.0,
+    status_message="Ready to start",
+    **autotune.IDLE_STATUS,
+)
 
 # MediaPipe setup
 mp_pose = mp.solutions.pose
 mp_draw = mp.solutions.drawing_utils
 
-SMOOTH_ALPHA = 0.4
-MIN_VIS = 0.2
-DEPTH_PERCENT = 0.75  # 75% of standing angle = bottom squat
-
 
-def get_angle(a, b, c):
-    a = np.array([a.x, a.y])
-    b = np.array([b.x, b.y])
-    c = np.array([c.x, c.y])
-    ba = a - b
-    bc = c - b
-    cos = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    return np.degrees(np.arccos(np.clip(cos, -1, 1)))
-
-
-def run_squat_detection():
-    global squat_count, current_stage, current_angle, status_message, is_running, cap
-    
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        status_message = "Camera could not be opened"
-        is_running = False
+def run_squat_detection(ctx):
+    """Squat detection for one session. Runs inside the session's worker process."""
+    camera = ctx.params.get('camera', 0)
+    cap = get_camera(camera, 1280, 720).subscribe()
+    if cap is None:
+        ctx.update(status_message="Camera could not be opened")
         return
-    
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    
+
     WINDOW_NAME = "AI Squat Counter - Press 'q' to stop"
-    cv2.namedWindow(WINDOW_NAME)
-    
-    stage = "up"
-    smoothed_angle = None
-    standing_reference = None
-    
-    status_message = "Calibrating... Please stand straight"
-    
-    with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-        while is_running:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = pose.process(rgb)
-            vis = frame.copy()
-            h, w = frame.shape[:2]
-            
-            if results.pose_landmarks:
-                lm = results.pose_landmarks.landmark
-                mp_draw.draw_landmarks(vis, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-                
-                # Use left leg if visible, otherwise right leg
-                if lm[mp_pose.PoseLandmark.LEFT_KNEE].visibility > MIN_VIS:
-                    hip = lm[mp_pose.PoseLandmark.LEFT_HIP]
-                    knee = lm[mp_pose.PoseLandmark.LEFT_KNEE]
-                    ankle = lm[mp_pose.PoseLandmark.LEFT_ANKLE]
-                else:
-                    hip = lm[mp_pose.PoseLandmark.RIGHT_HIP]
-                    knee = lm[mp_pose.PoseLandmark.RIGHT_KNEE]
-                    ankle = lm[mp_pose.PoseLandmark.RIGHT_ANKLE]
-                
-                angle = get_angle(hip, knee, ankle)
-                
-                # Smooth the angle
-                if smoothed_angle is None:
-                    smoothed_angle = angle
-                else:
-                    smoothed_angle = SMOOTH_ALPHA * angle + (1 - SMOOTH_ALPHA) * smoothed_angle
-                
-                current_angle = smoothed_angle
-                
-                # Auto-standing calibration
-                if standing_reference is None:
-                    standing_reference = smoothed_angle
-                    status_message = "Calibration complete. Start squatting!"
-                
-                # Compute dynamic squat depth
-                squat_depth_angle = standing_reference * DEPTH_PERCENT
-                
-                # Squat detection logic
-                # Going DOWN
-                if smoothed_angle < squat_depth_angle and stage == "up":
-                    stage = "down"
-                    current_stage = "down"
-                
-                # Going UP (standing again)
-                if smoothed_angle > standing_reference * 0.95 and stage == "down":
-                    squat_count += 1
-                    stage = "up"
-                    current_stage = "up"
-                    status_message = f"Squat {squat_count} completed!"
-                
-                # Display on screen
-                cv2.putText(vis, f"Angle: {int(smoothed_angle)}°", (30, 60),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                cv2.putText(vis, f"Stage: {stage}", (30, 110),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 255), 2)
-                cv2.putText(vis, f"Squats: {squat_count}", (30, 180),
-                            cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 3)
-                cv2.putText(vis, f"Status: {status_message}", (30, 250),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
-            
-            cv2.imshow(WINDOW_NAME, vis)
-            
-            if cv2.waitKey(5) & 0xFF == ord('q'):
-                is_running = False
-                break
-    
-    if cap:
-        cap.release()
-    cv2.destroyAllWindows()
-    status_message = "Detection stopped"
-    is_running = False
-
-
-@app.route('/squat/status', methods=['GET'])
+    display.open_window(WINDOW_NAME)
+
+    # Same counter as offline batch analysis (counters.py)
+    counter = SquatCounter()
+    athlete = ctx.params.get('athlete')
+    store = results_store.get_store()
+    store.start_session(ctx.session_id, "squat", athlete=athlete, station=f"camera:{camera}", params=ctx.params)
+
+    recorder = None
+    try:
+        with pose_estimator.checkout() as estimator:
+            ctx.update(status_message="Tuning pose model for this machine...")
+            tuner = autotune.AutoTuner.from_params("squat", estimator, ctx.params)
+            tuner.startup(cap)
+            # Per-frame landmarks, to re-score the session later (recording.py)
+            recorder = recording.LandmarkRecorder.for_session(
+                ctx.session_id, "squat", athlete=athlete, width=tuner.capture[0], height=tuner.capture[1])
+            while ctx.running:
+                with ctx.metrics.time("capture"):
+                    frame = cap.read_frame(timeout=1.0)
+                if frame is None:
+                    # A read stall (camera hiccup, device handoff) is waited out; a closed camera ends the session
+                    if not cap.service.is_open:
+                        break
+                    continue
+                ctx.metrics.track("frames_dropped_total", cap.missed, source=cap, reason="capture")
+
+                for command, payload in ctx.poll_commands():
+                    if command == "reset":
+                        counter.reset_counts()
+                        counter.status_message = "Reset complete"
+
+                start = time.perf_counter()
+                with ctx.metrics.time("convert"):
+                    rgb = estimator.prepare(frame.image)
+                with ctx.metrics.time("inference"):
+                    results = estimator.infer(rgb)
+                tuner.record(time.perf_counter() - start)
+                ctx.metrics.inc("frames_processed_total")
+
+                landmarks = kinematics.to_array(results.pose_landmarks)
+                with ctx.metrics.time("postprocess"):
+                    event = counter.update(landmarks, frame.timestamp)
+                if event is not None:
+                    store.record(ctx.session_id, "squat", event)
+                if recorder:
+                    recorder.append(landmarks, frame.timestamp)
+
+                ctx.update(
+                    squat_count=counter.count,
+                    current_stage=counter.stage,
+                    current_angle=float(counter.angle or 0.0),
+                    status_message=counter.status_message,
+                    **tuner.status(),
+                )
+
+                # Headless servers skip the overlay entirely
+                if display.HEADLESS:
+                    continue
+
+                overlay_start = time.perf_counter()
+                vis = frame.image.copy()
+                if results.pose_landmarks:
+                    mp_draw.draw_landmarks(vis, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
+
+                    # Display on screen
+                    cv2.putText(vis, f"Angle: {int(counter.angle)}°", (30, 60),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+                    cv2.putText(vis, f"Stage: {counter.stage}", (30, 110),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 255), 2)
+                    cv2.putText(vis, f"Squats: {counter.count}", (30, 180),
+                                cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 3)
+                    cv2.putText(vis, f"Status: {counter.status_message}", (30, 250),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
+
+                ctx.metrics.observe("stage_duration_seconds", time.perf_counter() - overlay_start, stage="overlay")
+                if display.show(WINDOW_NAME, vis, delay=5) == ord('q'):
+                    break
+    finally:
+        # Workers are reused: nothing of this session may stay open, even after an error
+        if recorder:
+            recorder.close()
+        cap.close()
+        display.close_all()
+        store.end_session(ctx.session_id, dict(count=counter.count))
+        store.flush()
+    ctx.update(status_message="Detection stopped")
+
+
+def session_state(session):
+    if session is None:
+        return dict(INITIAL_STATE, is_running=False, session_id=None)
+    return dict(session.state, is_running=session.is_running, session_id=session.id)
+
+
+@bp.route('/squat/status', methods=['GET'])
 def squat_status():
-    global squat_count, current_stage, current_angle, status_message, is_running
-    return jsonify(
-        squat_count=squat_count,
-        current_stage=current_stage,
-        current_angle=current_angle,
-        status_message=status_message,
-        is_running=is_running
-    )
+    session_id = requested_session_id(request)
+    session = sessions.get(session_id)
+    if session_id and session is None:
+        return jsonify(success=False, message="Unknown session"), 404
+    return jsonify(**session_state(session))
 
 
-@app.route('/squat/start', methods=['POST'])
+@bp.route('/squat/events', methods=['GET'])
+def squat_events():
+    """Server-Sent Events: squat count, stage and status pushed as they change."""
+    session_id = requested_session_id(request)
+    session = sessions.get(session_id)
+    if session_id and session is None:
+        return jsonify(success=False, message="Unknown session"), 404
+    return Response(event_stream(session, requested_event_id(request), session_state),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@bp.route('/squat/start', methods=['POST'])
 def squat_start():
-    global is_running, camera_thread, squat_count, current_stage, status_message
-    
-    if not is_running:
-        is_running = True
-        squat_count = 0
-        current_stage = "up"
-        status_message = "Starting squat detection..."
-        camera_thread = threading.Thread(target=run_squat_detection, daemon=True)
-        camera_thread.start()
-        return jsonify(success=True, message="Squat detection started")
-    return jsonify(success=False, message="Already running")
-
-
-@app.route('/squat/stop', methods=['POST'])
+    data = request.get_json(silent=True) or {}
+    try:
+        # Device index or CAMERA_SOURCES name; files and URLs only through replay.py
+        camera = parse_source(data.get('camera', 0))
+        params = dict(athlete=data.get('athlete'), camera=camera, **autotune.session_params(data))
+        session = sessions.start(params, key=camera)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    except SessionError as e:
+        # Camera or session slots busy
+        return jsonify(success=False, message=str(e)), 409
+    return jsonify(success=True, message="Squat detection started", session_id=session.id)
+
+
+@bp.route('/squat/stop', methods=['POST'])
 def squat_stop():
-    global is_running, status_message
-    is_running = False
-    status_message = "Stopped"
+    session = sessions.get(requested_session_id(request))
+    if session is not None:
+        session.stop()
+        session.update_state(status_message="Stopped")
     return jsonify(success=True, message="Squat detection stopped")
 
 
-@app.route('/squat/reset', methods=['POST'])
+@bp.route('/squat/reset', methods=['POST'])
 def squat_reset():
-    global squat_count, current_stage, status_message
-    squat_count = 0
-    current_stage = "up"
-    status_message = "Reset complete"
+    session = sessions.get(requested_session_id(request))
+    if session is not None:
+        session.update_state(squat_count=0, current_stage="up", status_message="Reset complete")
+        session.send("reset")
     return jsonify(success=True, message="Squat count reset")
 
 
+@bp.route('/squat/analyze', methods=['POST'])
+def squat_analyze():
+    """Score an uploaded recording (multipart field 'video')."""
+    video = request.files.get('video')
+    if video is None:
+        return jsonify(success=False, message="No video uploaded"), 400
+    try:
+        result = analyze_upload(video, "squat", request.form)
+    except AnalysisError as e:
+        return jsonify(success=False, message=str(e)), e.status
+    return jsonify(success=True, **result)
+
+
+sessions = SessionManager(run_squat_detection, INITIAL_STATE, warmup=pose_estimator.warm_up)
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5002)
+    if display.HEADLESS:
+        print("Headless mode: no preview window")
+    from server import run_standalone
+    run_standalone(bp, 5002)
 
 
 
@@ -1,25 +1,21 @@
 @echo off
-REM Start all three backend servers for the Sports App
+REM Start the backend for the Sports App
 
-echo Starting all backend servers...
+echo Starting the backend server...
 echo.
 
-REM Open three separate terminal windows for each backend
+REM One process serves every exercise (server.py). It still listens on the
+REM old per-exercise ports, so the Flutter app needs no change.
 
-start cmd /k "cd C:\Users\kunal salankar\Downloads\purva\sih && python app1.py"
-timeout /t 2 /nobreak
-
-start cmd /k "cd C:\Users\kunal salankar\Downloads\purva\sih && python squat_app.py"
-timeout /t 2 /nobreak
-
-start cmd /k "cd C:\Users\kunal salankar\Downloads\purva\sih && python situps_app.py"
+start cmd /k "cd C:\Users\kunal salankar\Downloads\purva\sih && python server.py"
 
 echo.
-echo All three backend servers are starting:
-echo - Port 5001: Jump Detection (app1.py)
-echo - Port 5002: Squat Detection (squat_app.py)
-echo - Port 5003: Sit-ups Detection (situps_app.py)
+echo The backend is starting on:
+echo - Port 5000: All exercises, sit-and-reach reports here
+echo - Port 5001: Jump Detection (app1.py routes)
+echo - Port 5002: Squat Detection (squat_app.py routes)
+echo - Port 5003: Sit-ups Detection (situps_app.py routes)
 echo.
-echo Keep all windows open while using the Flutter app!
+echo Keep the window open while using the Flutter app!
 echo.
 pause
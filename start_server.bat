@@ -11,7 +11,7 @@ echo For physical device, use: http://10.235.110.146:5000
 echo.
 echo Press Ctrl+C to stop the server
 echo.
-python app1.py
+python server.py
 pause
 
 
@@ -13,7 +13,7 @@ echo ""
 echo "Press Ctrl+C to stop the server"
 echo ""
 
-python3 app1.py
+python3 server.py
 
 
 
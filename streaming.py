@@ -0,0 +1,339 @@
+"""
+streaming.py
+MJPEG broadcasting for /video_feed and Server-Sent Events for session state.
+
+A MjpegBroadcaster encodes each published frame once, and only while at least
+one client is connected. Connected clients sleep on a condition variable and are
+woken when a new JPEG is ready; a client that falls behind simply gets the newest
+frame next time it is ready, so slow viewers skip frames instead of queueing them.
+
+An EventStream pushes a session's state changes (counts, stage, status message,
+cheat flag, ...) to any number of SSE clients the moment the worker reports
+them, instead of every client polling /status. Every event carries an id of
+"<session id>:<seq>"; a client reconnecting with Last-Event-ID gets exactly the
+events it missed, or a fresh snapshot when they are no longer kept.
+
+Both have a thread flavour (frames(), events(), for Flask) and an asyncio one
+(aframes(), aevents(), for async_server.py). Publishers are always threads;
+coroutines waiting for them are woken through AsyncWakeup, with one
+call_soon_threadsafe per event loop per publish however many clients wait.
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+JPEG_QUALITY = 80
+# Re-send the current frame this often when nothing new arrives, so idle
+# connections are not dropped by proxies or the browser
+KEEPALIVE_SECONDS = 1.0
+BOUNDARY = b"frame"
+
+# Events kept for clients resuming with Last-Event-ID
+EVENT_HISTORY = 512
+# SSE comment sent on a quiet stream so proxies keep the connection open
+EVENT_KEEPALIVE_SECONDS = 15.0
+# Reconnect delay suggested to EventSource clients, in milliseconds
+EVENT_RETRY_MS = 2000
+# Response headers for text/event-stream: no caching, no proxy buffering
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncWakeup:
+    """Lets coroutines on any event loop wait for something a thread signals.
+
+    The owner calls future() and notify() with its own lock held; the futures
+    are shared by every coroutine of a loop waiting at the same time.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    def future(self):
+        loop = asyncio.get_running_loop()
+        future = self._futures.get(loop)
+        if future is None:
+            future = self._futures[loop] = loop.create_future()
+        return future
+
+    def notify(self):
+        futures, self._futures = self._futures, {}
+        for loop, future in futures.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # That loop is closed, nobody is waiting on it any more
+                pass
+
+
+async def _wait(future, timeout):
+    # shield: a timed-out waiter must not cancel the future the other waiters share
+    try:
+        await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+class MjpegBroadcaster:
+    def __init__(self, quality=JPEG_QUALITY, idle_size=(640, 480)):
+        self.quality = quality
+        self.idle_size = idle_size
+        self.subscribers = 0
+        self.frames_encoded = 0
+        self._jpeg = None
+        self._idle_jpeg = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._wakeup = AsyncWakeup()
+
+    @property
+    def has_subscribers(self):
+        return self.subscribers > 0
+
+    def publish(self, image):
+        """Encode and broadcast a BGR frame. Skipped (returns False) when nobody is watching."""
+        if not self.subscribers:
+            return False
+        # Encode outside the lock so viewers are never held up by the encoder
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return False
+        self.frames_encoded += 1
+        self.publish_jpeg(buffer.tobytes())
+        return True
+
+    def publish_jpeg(self, data):
+        """Broadcast an already encoded JPEG."""
+        with self._cond:
+            self._jpeg = data
+            self._seq += 1
+            self._cond.notify_all()
+            self._wakeup.notify()
+
+    def clear(self):
+        """Drop the last frame so viewers fall back to the idle frame."""
+        with self._cond:
+            self._jpeg = None
+            self._seq += 1
+            self._cond.notify_all()
+            self._wakeup.notify()
+
+    def frames(self):
+        """Yield JPEG bytes for one viewer until the generator is closed."""
+        with self._cond:
+            self.subscribers += 1
+        try:
+            last_seq = -1
+            while True:
+                with self._cond:
+                    if self._seq == last_seq:
+                        self._cond.wait_for(lambda: self._seq != last_seq, KEEPALIVE_SECONDS)
+                    last_seq = self._seq
+                    jpeg = self._jpeg
+                yield jpeg if jpeg is not None else self._idle_frame()
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    async def aframes(self):
+        """frames() for a coroutine: waiting costs no thread."""
+        with self._cond:
+            self.subscribers += 1
+        try:
+            last_seq = -1
+            while True:
+                with self._cond:
+                    future = self._wakeup.future() if self._seq == last_seq else None
+                if future is not None:
+                    await _wait(future, KEEPALIVE_SECONDS)
+                with self._cond:
+                    last_seq = self._seq
+                    jpeg = self._jpeg
+                yield jpeg if jpeg is not None else self._idle_frame()
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    def stream(self):
+        """multipart/x-mixed-replace body for a Flask Response."""
+        for jpeg in self.frames():
+            yield _mjpeg_part(jpeg)
+
+    async def astream(self):
+        async for jpeg in self.aframes():
+            yield _mjpeg_part(jpeg)
+
+    def _idle_frame(self):
+        # Black placeholder, encoded once and reused
+        if self._idle_jpeg is None:
+            w, h = self.idle_size
+            _, buffer = cv2.imencode('.jpg', np.zeros((h, w, 3), dtype=np.uint8))
+            self._idle_jpeg = buffer.tobytes()
+        return self._idle_jpeg
+
+
+class EventStream:
+    """State changes of one session, fanned out to Server-Sent Events clients.
+
+    state is the dict the session reports through /status. It is only changed
+    through update(), so a snapshot and the sequence number always agree.
+    """
+
+    def __init__(self, stream_id, state, history=EVENT_HISTORY):
+        self.stream_id = stream_id
+        self.state = state
+        self.seq = 0
+        self.closed = False
+        self.subscribers = 0
+        self._events = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self._wakeup = AsyncWakeup()
+
+    def update(self, changes):
+        """Apply changed state fields and push them as one 'state' event."""
+        if changes:
+            with self._cond:
+                self.state.update(changes)
+                self._publish("state", dict(changes))
+
+    def publish(self, name, data):
+        with self._cond:
+            self._publish(name, data)
+
+    def _publish(self, name, data):
+        # Called with self._cond held
+        self.seq += 1
+        self._events.append((self.seq, name, data))
+        self._cond.notify_all()
+        self._wakeup.notify()
+
+    def close(self, data=None):
+        """Push a final 'end' event; connected clients are disconnected after it."""
+        with self._cond:
+            if not self.closed:
+                self._publish("end", data or {})
+                self.closed = True
+
+    def parse_event_id(self, event_id):
+        """seq from a Last-Event-ID of this stream, None for anything else."""
+        stream_id, _, seq = (event_id or "").rpartition(":")
+        if stream_id != self.stream_id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def events(self, last_seq=None, snapshot=None):
+        """Yield (seq, name, data) for one client, None as a keepalive.
+
+        Starts with a 'snapshot' event (snapshot() or a copy of state) unless
+        every event after last_seq is still kept. Consecutive 'state' events a
+        slow client has not read yet are merged into one.
+        """
+        with self._cond:
+            self.subscribers += 1
+        try:
+            while True:
+                with self._cond:
+                    if self._caught_up(last_seq):
+                        self._cond.wait_for(lambda: not self._caught_up(last_seq), EVENT_KEEPALIVE_SECONDS)
+                    pending, closed = self._pending(last_seq, snapshot)
+                if not pending:
+                    if closed:
+                        return
+                    yield None
+                    continue
+                for event in _merge_state_events(pending):
+                    yield event
+                last_seq = pending[-1][0]
+                if closed:
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    async def aevents(self, last_seq=None, snapshot=None):
+        """events() for a coroutine: waiting costs no thread."""
+        with self._cond:
+            self.subscribers += 1
+        try:
+            while True:
+                with self._cond:
+                    future = self._wakeup.future() if self._caught_up(last_seq) else None
+                if future is not None:
+                    await _wait(future, EVENT_KEEPALIVE_SECONDS)
+                with self._cond:
+                    pending, closed = self._pending(last_seq, snapshot)
+                if not pending:
+                    if closed:
+                        return
+                    yield None
+                    continue
+                for event in _merge_state_events(pending):
+                    yield event
+                last_seq = pending[-1][0]
+                if closed:
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    def _caught_up(self, last_seq):
+        # Called with self._cond held: nothing to send until the next publish
+        return last_seq is not None and last_seq >= self.seq and not self.closed
+
+    def _pending(self, last_seq, snapshot):
+        # Called with self._cond held: events after last_seq, or a snapshot when they are gone
+        oldest = self._events[0][0] if self._events else self.seq + 1
+        if last_seq is None or last_seq > self.seq or last_seq + 1 < oldest:
+            pending = [(self.seq, "snapshot", snapshot() if snapshot else dict(self.state))]
+            if self.closed:
+                pending.append(self._events[-1])
+        else:
+            pending = [event for event in self._events if event[0] > last_seq]
+        return pending, self.closed
+
+    def stream(self, last_event_id=None, snapshot=None):
+        """text/event-stream body for a Flask Response."""
+        yield f"retry: {EVENT_RETRY_MS}\n\n"
+        for event in self.events(self.parse_event_id(last_event_id), snapshot):
+            yield self._format(event)
+
+    async def astream(self, last_event_id=None, snapshot=None):
+        yield f"retry: {EVENT_RETRY_MS}\n\n"
+        async for event in self.aevents(self.parse_event_id(last_event_id), snapshot):
+            yield self._format(event)
+
+    def _format(self, event):
+        if event is None:
+            return ": keepalive\n\n"
+        seq, name, data = event
+        return format_event(name, data, f"{self.stream_id}:{seq}")
+
+
+def _mjpeg_part(jpeg):
+    return (b'--' + BOUNDARY + b'\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+
+def _merge_state_events(events):
+    merged = []
+    for seq, name, data in events:
+        if name == "state" and merged and merged[-1][1] == "state":
+            merged[-1] = (seq, name, dict(merged[-1][2], **data))
+        else:
+            merged.append((seq, name, data))
+    return merged
+
+
+def format_event(name, data, event_id=None):
+    """One Server-Sent Event."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {name}\ndata: {json.dumps(data, default=float)}\n\n"
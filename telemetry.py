@@ -0,0 +1,125 @@
+"""
+telemetry.py
+Fire-and-forget HTTP updates from a measurement loop to a backend.
+
+The loop calls update() with the latest value of something (current reach)
+every frame and event() for things that happened (a new max). Neither waits
+on the network: a background thread posts them over one pooled keep-alive
+connection. Per-frame values are coalesced, so however fast the loop runs only
+the newest value of each path is in flight; events queue up to a limit and the
+oldest are dropped beyond it. When the server is slow or down the thread backs
+off and the loop keeps running at camera rate.
+
+    telemetry = TelemetryClient("http://127.0.0.1:5000")
+    telemetry.update("/update_reach", {"current_reach": 12.3, "max_reach": 15.0})
+    telemetry.event("/increment")
+    ...
+    telemetry.close()
+"""
+
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+REQUEST_TIMEOUT = 0.5
+MAX_PENDING_EVENTS = 64
+# Posting the same path more often than this is pointless for a display
+MIN_UPDATE_INTERVAL = 0.05
+# Wait after a failed post, doubled per failure up to MAX_BACKOFF
+BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+
+
+class TelemetryClient:
+    """Background poster with latest-value coalescing and drop-on-backpressure."""
+
+    def __init__(self, base_url, timeout=REQUEST_TIMEOUT, max_events=MAX_PENDING_EVENTS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        # Updates replaced by a newer one before they were sent, events dropped on overflow
+        self.coalesced = 0
+        self.dropped = 0
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        self._latest = {}
+        self._events = deque()
+        self._max_events = max_events
+        self._retry_at = 0.0
+        self._backoff = BACKOFF
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def update(self, path, payload):
+        """Set the latest value for path; replaces any value not sent yet. Never blocks."""
+        with self._cond:
+            if path in self._latest:
+                self.coalesced += 1
+            self._latest[path] = payload
+            self._cond.notify()
+
+    def event(self, path, payload=None):
+        """Queue a one-off post. Drops the oldest queued event when the server cannot keep up."""
+        with self._cond:
+            if len(self._events) >= self._max_events:
+                self._events.popleft()
+                self.dropped += 1
+            self._events.append((path, payload))
+            self._cond.notify()
+
+    def close(self, timeout=1.0):
+        """Stop the sender, giving it up to timeout seconds to deliver what is pending."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._session.close()
+
+    def _next(self):
+        # Called with self._cond held: an event first, so counts are not starved by updates
+        if self._events:
+            return self._events.popleft()
+        path = next(iter(self._latest))
+        return path, self._latest.pop(path)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    pending = bool(self._events or self._latest)
+                    if self._closed and (not pending or now < self._retry_at):
+                        return
+                    if pending and now >= self._retry_at:
+                        break
+                    self._cond.wait(self._retry_at - now if pending else None)
+                path, payload = self._next()
+            self._post(path, payload)
+            if not self._events:
+                time.sleep(MIN_UPDATE_INTERVAL)
+
+    def _post(self, path, payload):
+        try:
+            if payload is None:
+                response = self._session.post(self.base_url + path, timeout=self.timeout)
+            else:
+                response = self._session.post(self.base_url + path, json=payload, timeout=self.timeout)
+            response.close()
+        except requests.RequestException as e:
+            self.failed += 1
+            if self._backoff == BACKOFF:
+                # Once per outage, not once per frame
+                print(f"Telemetry to {self.base_url} failing, backing off: {e}")
+            with self._cond:
+                self._retry_at = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, MAX_BACKOFF)
+            return
+        self.sent += 1
+        self._backoff = BACKOFF
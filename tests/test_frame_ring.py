@@ -0,0 +1,142 @@
+"""
+Seqlock and pin protocol of frame_ring.FrameRing, with a writer and readers in spawned processes.
+
+Every frame is filled with a pattern of its own seq, so a reader can tell a
+torn or misattributed image from a whole one.
+"""
+
+import multiprocessing
+import os
+import time
+import uuid
+
+import numpy as np
+import pytest
+
+from frame_ring import FrameRing, FrameRingError
+
+WIDTH, HEIGHT = 320, 240
+FRAMES = 3000
+READERS = 2
+
+
+def _frame(seq):
+    image = np.full((HEIGHT, WIDTH, 3), seq % 251, dtype=np.uint8)
+    image.reshape(-1)[:8] = np.frombuffer(np.int64(seq).tobytes(), dtype=np.uint8)
+    return image
+
+
+def _check(image, seq):
+    # Problems with a frame claimed to be seq, empty when it is whole
+    flat = image.reshape(-1)
+    stamped = int(np.frombuffer(flat[:8].tobytes(), dtype=np.int64)[0])
+    if stamped != seq:
+        return [f"frame {seq} holds frame {stamped}"]
+    if not (flat[8:] == seq % 251).all():
+        return [f"frame {seq} is torn"]
+    return []
+
+
+def _write(name, attached, done):
+    ring = FrameRing.create(name, WIDTH, HEIGHT, readers=READERS)
+    try:
+        for event in attached:
+            event.wait(10.0)
+        for seq in range(1, FRAMES + 1):
+            assert ring.write(_frame(seq), float(seq)) == seq
+        done.wait(30.0)
+    finally:
+        ring.close()
+
+
+def _read(name, reader, attached, results, hold):
+    ring = FrameRing.attach(name, reader=reader)
+    attached.set()
+    seqs, errors, lost = [], [], 0
+    try:
+        while True:
+            frame = ring.lease(timeout=2.0)
+            if frame is None:
+                break
+            with frame:
+                image = frame.image.copy()
+                if hold:
+                    # A slow reader: the writer has to work around its pinned slot
+                    time.sleep(hold)
+                if frame.timestamp != float(frame.seq):
+                    errors.append(f"frame {frame.seq} stamped {frame.timestamp}")
+                if frame.intact:
+                    errors += _check(image, frame.seq)
+                else:
+                    lost += 1
+                seqs.append(frame.seq)
+    finally:
+        ring.close()
+    results.put((reader, seqs, errors, lost))
+
+
+def test_spawned_writer_and_readers():
+    ctx = multiprocessing.get_context("spawn")
+    name = f"ring-test-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    attached = [ctx.Event() for _ in range(READERS)]
+    done = ctx.Event()
+    results = ctx.Queue()
+    writer = ctx.Process(target=_write, args=(name, attached, done))
+    writer.start()
+    # attach() fails until the writer has created the ring
+    deadline = time.monotonic() + 30.0
+    while True:
+        try:
+            FrameRing.attach(name, reader=0).close()
+            break
+        except FrameRingError:
+            assert time.monotonic() < deadline, "writer never created the ring"
+            time.sleep(0.05)
+    readers = [ctx.Process(target=_read, args=(name, i, attached[i], results, 0.002 * i))
+               for i in range(READERS)]
+    for process in readers:
+        process.start()
+    try:
+        outcomes = [results.get(timeout=90.0) for _ in readers]
+    finally:
+        done.set()
+        for process in readers + [writer]:
+            process.join(10.0)
+    assert writer.exitcode == 0
+    for reader, seqs, errors, lost in outcomes:
+        assert not errors, (reader, errors[:5])
+        assert len(seqs) > 10, (reader, len(seqs))
+        assert all(a < b for a, b in zip(seqs, seqs[1:])), f"reader {reader} went back in seq"
+        # The newest frame is never overwritten, so every reader ends on the last one
+        assert seqs[-1] == FRAMES, (reader, seqs[-1])
+        # Losing a lease takes a pin racing the writer's store-load reordering: rare
+        assert lost <= len(seqs) // 100, (reader, lost, len(seqs))
+
+
+def test_pinned_slot_outlives_newer_frames():
+    ring = FrameRing.create(None, WIDTH, HEIGHT, slots=4, readers=2)
+    reader = FrameRing.attach(ring.name, reader=0)
+    try:
+        ring.write(_frame(1), 1.0)
+        frame = reader.lease(timeout=0.1)
+        assert frame.seq == 1
+        for seq in range(2, 50):
+            ring.write(_frame(seq), float(seq))
+        assert frame.intact and not _check(frame.image, 1)
+        frame.release()
+        newest = reader.lease(timeout=0.1)
+        assert newest.seq == 49 and not _check(newest.image, 49)
+        newest.release()
+        assert reader.lease(timeout=0.01) is None
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_frame_larger_than_ring_is_refused():
+    ring = FrameRing.create(None, WIDTH, HEIGHT, readers=1, slots=3)
+    try:
+        with pytest.raises(FrameRingError):
+            ring.write(np.zeros((HEIGHT + 1, WIDTH, 3), dtype=np.uint8), 0.0)
+    finally:
+        ring.close()
@@ -0,0 +1,123 @@
+"""
+Angles, distances and visibility of kinematics on poses of known geometry.
+
+Every check runs on a single (33, 4) frame and on a stacked (N, 33, 4) series,
+which must give the single-frame result once per frame.
+"""
+
+import types
+import warnings
+
+import numpy as np
+import pytest
+
+import kinematics
+from kinematics import PoseLandmark
+
+HIP, KNEE, ANKLE = PoseLandmark.LEFT_HIP, PoseLandmark.LEFT_KNEE, PoseLandmark.LEFT_ANKLE
+SHOULDER, ELBOW, WRIST = PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW, PoseLandmark.LEFT_WRIST
+
+
+def _pose(points, visibility=1.0):
+    # Every landmark at the origin but the given {index: (x, y)}
+    lm = np.zeros((kinematics.NUM_LANDMARKS, 4), dtype=np.float32)
+    lm[:, kinematics.VISIBILITY] = visibility
+    for index, (x, y) in points.items():
+        lm[int(index), :2] = x, y
+    return lm
+
+
+# Left knee at a right angle, left elbow straight, right knee with the hip on the knee
+RIGHT_ANGLE = {HIP: (0.5, 0.2), KNEE: (0.5, 0.5), ANKLE: (0.8, 0.5)}
+STRAIGHT = {SHOULDER: (0.4, 0.1), ELBOW: (0.4, 0.3), WRIST: (0.4, 0.5)}
+DEGENERATE = {PoseLandmark.RIGHT_HIP: (0.6, 0.5), PoseLandmark.RIGHT_KNEE: (0.6, 0.5),
+              PoseLandmark.RIGHT_ANKLE: (0.6, 0.8)}
+FRAME = _pose({**RIGHT_ANGLE, **STRAIGHT, **DEGENERATE})
+
+
+def _frames(single):
+    # The frame alone and stacked three times
+    return [(single, ()), (np.stack([single] * 3), (3,))]
+
+
+@pytest.mark.parametrize("lm, shape", _frames(FRAME), ids=["frame", "series"])
+def test_right_angle_and_straight_limb(lm, shape):
+    knee, elbow = kinematics.angle(lm, "left_knee"), kinematics.angle(lm, "left_elbow")
+    assert np.shape(knee) == np.shape(elbow) == shape
+    np.testing.assert_allclose(knee, 90.0, atol=1e-4)
+    np.testing.assert_allclose(elbow, 180.0, atol=1e-4)
+    np.testing.assert_allclose(kinematics.angle_between(lm, HIP, KNEE, ANKLE), knee)
+    # The same three landmarks the other way round
+    np.testing.assert_allclose(kinematics.angle_between(lm, ANKLE, KNEE, HIP), knee)
+    np.testing.assert_allclose(kinematics.angle_between(lm, WRIST, ELBOW, SHOULDER), elbow)
+
+
+@pytest.mark.parametrize("lm, shape", _frames(FRAME), ids=["frame", "series"])
+def test_joint_angles_in_order(lm, shape):
+    angles = kinematics.joint_angles(lm)
+    assert angles.shape == shape + (len(kinematics.JOINT_NAMES),)
+    for i, name in enumerate(kinematics.JOINT_NAMES):
+        np.testing.assert_array_equal(angles[..., i], kinematics.angle(lm, name))
+    picked = kinematics.joint_angles(lm, ("left_elbow", "left_knee"))
+    np.testing.assert_allclose(picked, np.broadcast_to([180.0, 90.0], shape + (2,)), atol=1e-4)
+
+
+@pytest.mark.parametrize("lm, shape", _frames(FRAME), ids=["frame", "series"])
+def test_zero_length_segment_is_finite(lm, shape):
+    # Hip on the knee: no direction to measure from, but no NaN or warning either
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        knee = kinematics.angle(lm, "right_knee")
+        length = kinematics.distance(lm, PoseLandmark.RIGHT_HIP, PoseLandmark.RIGHT_KNEE)
+    assert np.shape(knee) == shape
+    assert np.isfinite(knee).all()
+    assert ((0.0 <= knee) & (knee <= 180.0)).all()
+    np.testing.assert_array_equal(length, np.zeros(shape))
+
+
+@pytest.mark.parametrize("lm, shape", _frames(FRAME), ids=["frame", "series"])
+def test_distance(lm, shape):
+    # Hip to ankle across the right angle, then each leg along one axis, in pixels too
+    np.testing.assert_allclose(kinematics.distance(lm, HIP, ANKLE), np.full(shape, 0.3 * 2 ** 0.5), rtol=1e-6)
+    np.testing.assert_allclose(kinematics.distance(lm, KNEE, ANKLE), np.full(shape, 0.3), rtol=1e-6)
+    np.testing.assert_allclose(kinematics.distance(lm, KNEE, ANKLE, w=1280, h=720), np.full(shape, 384.0),
+                               rtol=1e-6)
+    np.testing.assert_allclose(kinematics.distance(lm, HIP, KNEE, w=1280, h=720), np.full(shape, 216.0), rtol=1e-6)
+
+
+@pytest.mark.parametrize("lm, shape", _frames(FRAME), ids=["frame", "series"])
+def test_visible(lm, shape):
+    lm = lm.copy()
+    lm[..., KNEE, kinematics.VISIBILITY] = 0.5
+    lm[..., ANKLE, kinematics.VISIBILITY] = 0.2
+    mask = kinematics.visible(lm)
+    assert mask.shape == shape + (kinematics.NUM_LANDMARKS,)
+    # Strictly above the threshold
+    assert not mask[..., KNEE].any() and not mask[..., ANKLE].any() and mask[..., HIP].all()
+    assert kinematics.visible(lm, min_visibility=0.4)[..., KNEE].all()
+
+
+def test_missing_landmarks_give_nan():
+    series = np.stack([FRAME, np.full_like(FRAME, np.nan), FRAME])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        angles = kinematics.joint_angles(series)
+        knee = kinematics.angle_between(series, HIP, KNEE, ANKLE)
+        length = kinematics.distance(series, KNEE, ANKLE)
+        mask = kinematics.visible(series)
+    assert np.isnan(angles[1]).all() and np.isfinite(angles[[0, 2]]).all()
+    assert np.isnan(knee).tolist() == [False, True, False]
+    assert np.isnan(length).tolist() == [False, True, False]
+    # A missing landmark is never visible
+    assert not mask[1].any() and mask[[0, 2]].all()
+
+
+def test_to_array():
+    assert kinematics.to_array(None) is None
+    landmark = [types.SimpleNamespace(x=0.1 * i, y=0.2, z=-0.3, visibility=0.9)
+                for i in range(kinematics.NUM_LANDMARKS)]
+    lm = kinematics.to_array(types.SimpleNamespace(landmark=landmark))
+    assert lm.shape == (kinematics.NUM_LANDMARKS, 4) and lm.dtype == np.float32
+    np.testing.assert_allclose(lm[5], [0.5, 0.2, -0.3, 0.9], rtol=1e-6)
+    # The bare landmark list reads the same
+    np.testing.assert_array_equal(kinematics.to_array(landmark), lm)
@@ -0,0 +1,100 @@
+"""
+A counter scores a session the same live, one update() per frame, as offline in one score() call.
+
+Fuzzes the synthetic benchmark sessions with landmark noise, visibility
+changes, frames without a pose and uneven timestamps, and compares the rep
+events and the counter state both ways end at.
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+import benchmark
+import filters
+from batch_analysis import frame_landmarks, make_counter
+
+WIDTH, HEIGHT = 1280, 720
+TRIALS = 20
+REPEATS = 4
+# Counter state compared after the session, where the counter has it
+STATE = ("count", "stage", "angle", "standing_reference", "last_rep_time", "jump_count", "last_jump_height",
+         "max_jump_height", "setup_done", "clap_frames", "standing_reach_y", "body_visible", "ground_y",
+         "clap_detected", "body_px_per_cm", "in_air", "peak_jump_y", "last_jump_time", "cheat_flag",
+         "wrist_tracked", "jump_height_cm", "status_message", "px_per_cm")
+
+
+def _state(counter):
+    return {key: getattr(counter, key) for key in STATE if hasattr(counter, key)}
+
+
+def _same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+
+def _fuzz(rng, base):
+    landmarks = base.copy()
+    n = len(landmarks)
+    noise = rng.choice([0.0, 0.005, 0.02, 0.05])
+    landmarks[..., :2] += rng.normal(0, noise, landmarks[..., :2].shape).astype(np.float32)
+    landmarks[..., 3] = np.clip(landmarks[..., 3] + rng.normal(0, 0.3, landmarks[..., 3].shape), 0, 1)
+    landmarks[rng.random(n) < rng.choice([0.0, 0.05, 0.3])] = np.nan
+    timestamps = 1000 + np.cumsum(rng.uniform(0.01, 0.08, n))
+    return landmarks, timestamps
+
+
+@pytest.mark.parametrize("name, exercise, make, params, golden", benchmark.SYNTHETIC,
+                         ids=[fixture[0] for fixture in benchmark.SYNTHETIC])
+def test_score_matches_update(name, exercise, make, params, golden):
+    rng = np.random.default_rng(20)
+    # Repeated to span several of filters.series()'s blocks
+    base = np.concatenate([make()] * REPEATS)
+    for trial in range(TRIALS):
+        landmarks, timestamps = _fuzz(rng, base)
+        live, feed = make_counter(exercise, params, None)
+        live_events = []
+        for row, timestamp in zip(landmarks, timestamps):
+            event = feed(frame_landmarks(row), WIDTH, HEIGHT, float(timestamp))
+            if event:
+                live_events.append(event)
+
+        offline, _ = make_counter(exercise, params, None)
+        if trial % 2:
+            offline_events = offline.score(landmarks, timestamps, WIDTH, HEIGHT)
+        else:
+            # A session scored in two calls carries its state over
+            split = int(rng.integers(0, len(landmarks)))
+            offline_events = (offline.score(landmarks[:split], timestamps[:split], WIDTH, HEIGHT)
+                              + offline.score(landmarks[split:], timestamps[split:], WIDTH, HEIGHT))
+
+        assert offline_events == live_events, (name, trial)
+        live_state, offline_state = _state(live), _state(offline)
+        differ = {key: (live_state[key], offline_state[key])
+                  for key in live_state if not _same(live_state[key], offline_state[key])}
+        assert not differ, (name, trial, differ)
+
+
+@pytest.mark.parametrize("model", filters.MODELS)
+@pytest.mark.parametrize("frames", [1, 2, 127, 129, 600, 1500])
+@pytest.mark.parametrize("fps", [30.0, 500.0])
+def test_series_matches_update(model, frames, fps):
+    rng = np.random.default_rng(frames)
+    landmarks = (0.5 + np.cumsum(rng.normal(0, 0.01, (frames, 33, 4)), axis=0)).astype(np.float32)
+    landmarks[rng.random(frames) < 0.1] = np.nan
+    timestamps = 100 + np.cumsum(rng.uniform(0.5, 1.5, frames)) / fps
+    # A gap long enough to restart the filter
+    timestamps[frames // 2:] += 2.0 * filters.RESET_GAP
+    live, offline = filters.LandmarkFilter(model), filters.LandmarkFilter(model)
+
+    expected = np.full(landmarks.shape, np.nan, dtype=np.float32)
+    for i, (row, timestamp) in enumerate(zip(landmarks, timestamps)):
+        if not np.isnan(row[0, 0]):
+            expected[i] = live.update(row, timestamp)
+    smoothed, innovations = offline.series(landmarks, timestamps)
+
+    np.testing.assert_array_equal(smoothed, expected)
+    assert np.isnan(innovations[:, 0, 0]).tolist() == np.isnan(landmarks[:, 0, 0]).tolist()
+    if live.position is not None:
+        np.testing.assert_allclose(offline.position, live.position, rtol=0, atol=filters.SERIES_TOLERANCE * 10)
+        assert offline._last_time == live._last_time